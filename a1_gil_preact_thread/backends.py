@@ -0,0 +1,49 @@
+import os
+import sys
+import sysconfig
+import platform
+import concurrent.futures as cf
+
+# 可选的执行器后端：名字 -> executor 类（当前运行时没有的就是 None）
+# interpreter: 3.14+ 的 InterpreterPoolExecutor，每个 worker 是同进程里的子解释器，各有各的 GIL
+BACKENDS = {
+    "thread": cf.ThreadPoolExecutor,
+    "process": cf.ProcessPoolExecutor,
+    "interpreter": getattr(cf, "InterpreterPoolExecutor", None),
+}
+
+
+def free_threaded_build() -> bool:
+    """是不是 free-threaded（python3.13t 这类 --disable-gil）构建"""
+    return bool(sysconfig.get_config_var("Py_GIL_DISABLED"))
+
+def gil_enabled() -> bool:
+    """
+    运行时 GIL 是否真的开着。
+    free-threaded 构建也可能因为 PYTHON_GIL=1 或导入了不支持的 C 扩展而重新打开 GIL，所以要单独查。
+    """
+    is_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_enabled() if is_enabled is not None else True
+
+def runtime_label() -> str:
+    # 例：CPython 3.13.1t gil=off
+    t = "t" if free_threaded_build() else ""
+    return f"{platform.python_implementation()} {platform.python_version()}{t} gil={'on' if gil_enabled() else 'off'}"
+
+def get_executor(name: str):
+    """按名字取 executor 类，当前运行时不支持时返回 None"""
+    if name not in BACKENDS:
+        raise ValueError(f"unknown backend: {name!r}, expected one of {tuple(BACKENDS)}")
+    return BACKENDS[name]
+
+def available_backends():
+    return tuple(k for k, v in BACKENDS.items() if v is not None)
+
+def make_executor(executor_cls, workers: int):
+    if executor_cls is not None and executor_cls is BACKENDS["interpreter"]:
+        # 任务函数按 "模块名.函数名" pickle 过去，子解释器要能 import 到本目录的 engines / scheduler。
+        # initializer 本身也要能被 pickle，所以用内置的 exec 跑一行代码把目录塞进 sys.path
+        here = os.path.dirname(os.path.abspath(__file__))
+        return executor_cls(max_workers=workers, initializer=exec,
+                            initargs=(f"import sys; sys.path.insert(0, {here!r})",))
+    return executor_cls(max_workers=workers)
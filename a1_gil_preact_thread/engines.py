@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import math
+from functools import partial
+
+try:
+    import numpy as np
+except ImportError:
+    # 例如在子解释器里：NumPy 还不支持多解释器，这时只有 trial 引擎能用
+    np = None
+
+# 分段筛每段的长度（按数字个数算，bool 数组，一段约 1MB）
+# 段太小时每段都要在 Python 里遍历一遍基素数表，持有 GIL 的时间占比会变大
+SEGMENT_SIZE = 1 << 20
+
+
+# 引擎 1：逐个数试除（纯 Python 字节码，全程持有 GIL）
+def is_prime(n: int) -> bool:
+    if n < 2:
+        return False
+    if n % 2 == 0:
+        return n == 2
+    r = int(math.isqrt(n))
+    for i in range(3, r + 1, 2):
+        if n % i == 0:
+            return False
+    return True
+
+def count_primes(lo: int, hi: int) -> int:
+    c = 0
+    for x in range(lo, hi):
+        if is_prime(x):
+            c += 1
+    return c
+
+
+# 引擎 2：NumPy 分段筛（大部分时间在 NumPy kernel 里，kernel 执行期间会释放 GIL）
+def base_primes(limit: int) -> np.ndarray:
+    """普通埃氏筛求出 [2, limit] 内的素数，作为各段共享的基素数表"""
+    if limit < 2:
+        return np.empty(0, dtype=np.int64)
+    flags = np.ones(limit + 1, dtype=np.bool_)
+    flags[:2] = False
+    for p in range(2, math.isqrt(limit) + 1):
+        if flags[p]:
+            flags[p * p::p] = False
+    return np.flatnonzero(flags).astype(np.int64)
+
+def count_primes_sieve(lo: int, hi: int, primes: np.ndarray, segment: int = SEGMENT_SIZE) -> int:
+    """
+    用分段筛统计 [lo, hi) 内的素数个数。
+    primes 必须覆盖到 isqrt(hi - 1)，由父进程预先算好后传进来，各段/各 worker 共用。
+    """
+    lo = max(lo, 2)
+    c = 0
+    seg = np.empty(segment, dtype=np.bool_)
+    for s_lo in range(lo, hi, segment):
+        s_hi = min(s_lo + segment, hi)
+        flags = seg[:s_hi - s_lo]
+        flags.fill(True)
+        for p in primes:
+            p = int(p)
+            pp = p * p
+            if pp >= s_hi:
+                break
+            # 段内第一个 p 的倍数（且不小于 p*p，避免把 p 自己筛掉）
+            start = max(pp, (s_lo + p - 1) // p * p)
+            flags[start - s_lo::p] = False
+        c += int(np.count_nonzero(flags))
+    return c
+
+
+ENGINES = ("trial", "sieve")
+
+def make_task(engine: str, n: int):
+    """
+    按引擎名返回 fn(lo, hi) -> int。
+    sieve 引擎在这里一次性算好基素数表，通过 partial 绑定（多进程时随任务 pickle 过去，表很小）。
+    """
+    if engine == "trial":
+        return count_primes
+    if engine == "sieve":
+        return partial(count_primes_sieve, primes=base_primes(math.isqrt(max(n - 1, 0))))
+    raise ValueError(f"unknown engine: {engine!r}, expected one of {ENGINES}")
@@ -1,27 +1,13 @@
 import os
 import time
-import math
+import argparse
 import psutil
-from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
-# 示例 CPU 密集型任务：判断质数 + 计数
-def is_prime(n: int) -> bool:
-    if n < 2:
-        return False
-    if n % 2 == 0:
-        return n == 2
-    r = int(math.isqrt(n))
-    for i in range(3, r + 1, 2):
-        if n % i == 0:
-            return False
-    return True
-
-def count_primes(lo: int, hi: int) -> int:
-    c = 0
-    for x in range(lo, hi):
-        if is_prime(x):
-            c += 1
-    return c
+# 示例 CPU 密集型任务：判断质数 + 计数（trial 试除 / sieve 分段筛 两种引擎）
+from engines import ENGINES, make_task
+from scheduler import SCHEDULES, run_static, run_dynamic, summarize
+from sampler import CpuSampler
+from backends import available_backends, get_executor, make_executor, runtime_label
 
 # psutil库工具打印进程 CPU 使用情况
 def monitor_cpu(pid: int, stop_after: float = 0.5):
@@ -32,93 +18,104 @@ def monitor_cpu(pid: int, stop_after: float = 0.5):
     cpu = p.cpu_percent(interval=None)
     return cpu
 
-# 子进程和父进程一起监控
-def monitor_cpu_tree(pid: int, interval: float = 0.5, verbose: bool = False) -> float:
-    """
-    监控 pid 这个父进程 + 其子进程(递归) 在 interval 秒内的 CPU 使用率总和。
-    返回 total_cpu_percent（按 psutil 的口径：可能 > 100%）。
-    """
-    parent = psutil.Process(pid)
-
-    # 采样开始时拿一次进程树（ProcessPoolExecutor 的 worker 通常是 child）
-    procs = [parent] + parent.children(recursive=True)
-
-    # 预热：cpu_percent(None) 第一次没意义，必须先调用一次建立基线
-    for p in procs:
-        try:
-            p.cpu_percent(interval=None)
-        except (psutil.NoSuchProcess, psutil.AccessDenied):
-            pass
-
-    time.sleep(interval)
-
-    total = 0.0
-    per = []
-    for p in procs:
-        try:
-            cpu = p.cpu_percent(interval=None)
-            total += cpu
-            if verbose:
-                per.append((p.pid, cpu))
-        except (psutil.NoSuchProcess, psutil.AccessDenied):
-            pass
-
-    if verbose:
-        per.sort(key=lambda x: x[1], reverse=True)
-        print("cpu% by pid:", per)
-
-    return total
-
-def run_case(executor_cls, workers: int, chunks: int, n: int):
+def run_case(executor_cls, workers: int, chunks: int, n: int, engine: str = "trial",
+             schedule: str = "static", min_chunk: int = 0,
+             sample_interval: float = 0.1, timeline_dir: str = ""):
     """
     把区间 [2, n) 切成 chunks 份，丢给 workers 并行跑
+    engine 选择每块的计算方式：trial（纯 Python，持有 GIL）/ sieve（NumPy，释放 GIL）
+    schedule 选择切块方式：
+      static  一开始等宽切成 chunks 份
+      dynamic worker 空下来再从共享游标领下一块，块长 guided 递减，最小 min_chunk（默认 span / (chunks * 4)）
+    整个运行期间后台按 sample_interval 采样进程树；给了 timeline_dir 就把时间线写成 json + csv
     """
     pid = os.getpid()
-    print(f"\n=== {executor_cls.__name__} | workers={workers} | chunks={chunks} | n={n} | pid={pid} ===")
+    print(f"\n=== {executor_cls.__name__} | engine={engine} | schedule={schedule} | workers={workers} | chunks={chunks} | n={n} "
+          f"| {runtime_label()} | pid={pid} ===")
+    task = make_task(engine, n)
+    if schedule == "dynamic" and min_chunk <= 0:
+        min_chunk = max(1, (n - 2) // (chunks * 4))
 
-    # 切块
-    span = n - 2
-    step = span // chunks
-    ranges = []
-    start = 2
-    for i in range(chunks):
-        end = start + step
-        if i == chunks - 1:
-            end = n
-        ranges.append((start, end))
-        start = end
+    # 监控当前进程 + 子进程：从提交任务前一直采到全部结束
+    sampler = CpuSampler(pid, interval=sample_interval).start()
 
     t0 = time.time()
-    # 开始并行
-    with executor_cls(max_workers=workers) as ex:
-        futures = [ex.submit(count_primes, lo, hi) for lo, hi in ranges]
-
-        # 监控当前进程的CPU占用（多进程时这里只监控父进程）
-        cpu_parent = monitor_cpu_tree(pid)
-
-        total = sum(f.result() for f in futures)
-
-    t1 = time.time()
+    try:
+        # 开始并行
+        with make_executor(executor_cls, workers) as ex:
+            if schedule == "static":
+                records = run_static(ex, task, n, chunks)
+            elif schedule == "dynamic":
+                records = run_dynamic(ex, task, n, workers, min_chunk)
+            else:
+                raise ValueError(f"unknown schedule: {schedule!r}, expected one of {SCHEDULES}")
+            total = sum(r[0] for r in records)
+        t1 = time.time()
+    finally:
+        # 这个组合失败了（main 里会跳过继续跑）也要停掉采样线程，不然它一直采着，混进后面组合的 CPU 数据
+        sampler.stop()
+    report = summarize(records, t0, t1, workers)
+    cpu = sampler.summary()
     print(f"total primes = {total}")
     print(f"elapsed = {t1 - t0:.3f}s")
-    print(f"parent process cpu% (approx) = {cpu_parent:.1f}%")
+    print(f"process tree cpu% mean = {cpu['cpu_percent_mean']:.1f}% | peak = {cpu['cpu_percent_peak']:.1f}% "
+          f"| samples = {cpu['samples']} | procs = {cpu['procs_seen']}")
+    print(f"per-core mean % = {cpu['per_core_mean']}")
+    print(f"runnable threads mean = {cpu['runnable_mean']} | peak = {cpu['runnable_peak']} "
+          f"| ctx switches vol/invol = {cpu['ctx_voluntary']}/{cpu['ctx_involuntary']} | rss peak = {cpu['rss_peak_mb']}MB")
+    print(f"tasks = {len(records)} | busy = {report['busy_s']:.3f}s | utilization = {report['utilization']:.1%} "
+          f"| tail idle = {report['tail_idle_s']:.3f}s (max {report['max_tail_idle_s']:.3f}s)")
+    for w in report["workers"]:
+        print(f"  worker {w['worker']}: tasks={w['tasks']} busy={w['busy_s']:.3f}s tail_idle={w['tail_idle_s']:.3f}s")
+
+    if timeline_dir:
+        os.makedirs(timeline_dir, exist_ok=True)
+        name = f"{executor_cls.__name__}_{engine}_{schedule}_w{workers}_n{n}"
+        sampler.to_json(os.path.join(timeline_dir, name + ".json"))
+        sampler.to_csv(os.path.join(timeline_dir, name + ".csv"))
+        print(f"timeline -> {os.path.join(timeline_dir, name)}.json/.csv")
     return t1 - t0
 
 def main():
+    parser = argparse.ArgumentParser()
     # 让任务足够重一些，才看得出差异
-    n = 2400_000     # 机器快的话可以改成 600_000 或 800_000
+    parser.add_argument("--n", type=int, default=2400_000)  # 机器快的话可以改成 600_000 或 800_000
+    parser.add_argument("--engine", choices=ENGINES + ("all",), default="trial")
+    parser.add_argument("--schedule", choices=SCHEDULES + ("all",), default="static")
+    parser.add_argument("--sample-interval", type=float, default=0.1)
+    parser.add_argument("--timeline-dir", default="")  # 不为空时每个 case 输出一份 json/csv 时间线
+    parser.add_argument("--backends", default="all")  # 逗号分隔：thread,process,interpreter；all = 当前运行时支持的全部
+    args = parser.parse_args()
+
+    n = args.n
     cpu_cnt = os.cpu_count() or 4
     workers = min(8, cpu_cnt)   # 不要盲目开很大
     chunks = workers * 4        # 让任务分更细一点
-
-    # 1) 单线程（线程池1个worker）
-    run_case(ThreadPoolExecutor, workers=1, chunks=chunks, n=n)
-
-    # 2) 多线程（CPU密集型：通常不会更快，常常更慢）
-    run_case(ThreadPoolExecutor, workers=workers, chunks=chunks, n=n)
-
-    # 3) 多进程（CPU密集型：通常显著变快）
-    run_case(ProcessPoolExecutor, workers=workers, chunks=chunks, n=n)
+    engines = ENGINES if args.engine == "all" else (args.engine,)
+    schedules = SCHEDULES if args.schedule == "all" else (args.schedule,)
+    backends = available_backends() if args.backends == "all" else tuple(args.backends.split(","))
+
+    # 1) 单线程（线程池1个worker）做基线
+    # 2) thread 多线程（trial：有 GIL 时通常不会更快，常常更慢；free-threaded 构建或 sieve 释放 GIL 时线程也能并行）
+    # 3) process 多进程（CPU密集型：通常显著变快）
+    # 4) interpreter 子解释器（3.14+，每个解释器一把 GIL，启动和内存介于线程和进程之间）
+    cases = [("thread", 1)] + [(b, workers) for b in backends]
+    print(f"runtime: {runtime_label()} | available backends: {', '.join(available_backends())}")
+
+    for engine in engines:
+        for schedule in schedules:
+            kw = dict(chunks=chunks, n=n, engine=engine, schedule=schedule,
+                      sample_interval=args.sample_interval, timeline_dir=args.timeline_dir)
+            for backend, w in cases:
+                executor_cls = get_executor(backend)
+                if executor_cls is None:
+                    print(f"\n=== skip {backend}: not available on {runtime_label()} ===")
+                    continue
+                try:
+                    run_case(executor_cls, workers=w, **kw)
+                except Exception as e:
+                    # 例如子解释器里 import 不了还不支持多解释器的 C 扩展（NumPy），跳过这个组合继续跑
+                    print(f"\n=== skip {backend} | engine={engine}: {type(e).__name__}: {e} ===")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,163 @@
+import os
+import csv
+import json
+import time
+import threading
+import psutil
+
+
+def runnable_threads(pid: int, exclude_tid: int = 0) -> int:
+    """
+    数一下 pid 里处于 R（running/runnable）状态的线程数，只在 Linux 上有 /proc 可读，其它平台返回 -1。
+    多线程跑纯 Python 时，R 状态的线程多但 CPU% 只有 ~100%，说明大家在抢 GIL。
+    """
+    try:
+        tids = os.listdir(f"/proc/{pid}/task")
+    except OSError:
+        return -1
+    n = 0
+    for tid in tids:
+        if int(tid) == exclude_tid:
+            continue
+        try:
+            with open(f"/proc/{pid}/task/{tid}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # comm 字段可能带空格，状态字段在最后一个 ')' 之后
+        if stat[stat.rfind(")") + 2] == "R":
+            n += 1
+    return n
+
+
+class CpuSampler:
+    """
+    后台线程按 interval 持续采样 pid 及其子进程（递归）：
+    每个进程的 CPU%、RSS、上下文切换次数、线程数、runnable 线程数，以及每个核的利用率。
+    start() 之后到 stop() 之间的整段运行都会被记录，而不是只看一个 0.5s 的快照。
+    """
+    def __init__(self, pid: int, interval: float = 0.1):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._procs = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="cpu-sampler", daemon=True)
+        self._t0 = 0.0
+        self._tid = 0
+
+    def _tree(self):
+        # 每次采样都重新拿一次进程树：ProcessPoolExecutor 的 worker 是提交任务后才陆续起来的
+        try:
+            parent = self._procs.get(self.pid) or psutil.Process(self.pid)
+            live = [parent] + parent.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return []
+        procs = []
+        for p in live:
+            # 复用同一个 Process 对象，cpu_percent(None) 才是相对上一次采样的增量
+            if p.pid not in self._procs:
+                self._procs[p.pid] = p
+                try:
+                    p.cpu_percent(interval=None)
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    pass
+            procs.append(self._procs[p.pid])
+        return procs
+
+    def _sample(self):
+        t = time.time() - self._t0
+        procs = []
+        for p in self._tree():
+            try:
+                with p.oneshot():
+                    ctx = p.num_ctx_switches()
+                    procs.append({
+                        "pid": p.pid,
+                        "cpu_percent": p.cpu_percent(interval=None),
+                        "rss": p.memory_info().rss,
+                        "ctx_voluntary": ctx.voluntary,
+                        "ctx_involuntary": ctx.involuntary,
+                        "threads": p.num_threads(),
+                        "runnable": runnable_threads(p.pid, self._tid),
+                    })
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+        self.samples.append({
+            "t": round(t, 4),
+            "cpu_percent": sum(x["cpu_percent"] for x in procs),
+            "rss": sum(x["rss"] for x in procs),
+            "runnable": sum(max(x["runnable"], 0) for x in procs),
+            "per_core": psutil.cpu_percent(interval=None, percpu=True),
+            "procs": procs,
+        })
+
+    def _run(self):
+        self._tid = threading.get_native_id()
+        self._tree()
+        psutil.cpu_percent(interval=None, percpu=True)
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._t0 = time.time()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        # 运行时间比 interval 还短时补采一次，至少留一个点
+        if not self.samples:
+            self._sample()
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def summary(self) -> dict:
+        s = self.samples
+        if not s:
+            return {}
+        cpu = [x["cpu_percent"] for x in s]
+        run = [x["runnable"] for x in s]
+        cores = list(zip(*[x["per_core"] for x in s]))
+        # 上下文切换是累计值：每个进程取最后一次 - 第一次出现时的值
+        first, last = {}, {}
+        for x in s:
+            for p in x["procs"]:
+                first.setdefault(p["pid"], p)
+                last[p["pid"]] = p
+        vol = sum(last[k]["ctx_voluntary"] - first[k]["ctx_voluntary"] for k in last)
+        invol = sum(last[k]["ctx_involuntary"] - first[k]["ctx_involuntary"] for k in last)
+        return {
+            "samples": len(s),
+            "interval_s": self.interval,
+            "duration_s": s[-1]["t"],
+            "procs_seen": len(last),
+            "cpu_percent_mean": round(sum(cpu) / len(cpu), 1),
+            "cpu_percent_peak": round(max(cpu), 1),
+            "per_core_mean": [round(sum(c) / len(c), 1) for c in cores],
+            "rss_peak_mb": round(max(x["rss"] for x in s) / 2**20, 1),
+            "runnable_mean": round(sum(run) / len(run), 2),
+            "runnable_peak": max(run),
+            "ctx_voluntary": vol,
+            "ctx_involuntary": invol,
+        }
+
+    def to_json(self, path: str):
+        with open(path, "w") as f:
+            json.dump({"pid": self.pid, "summary": self.summary(), "timeline": self.samples}, f, indent=1)
+
+    def to_csv(self, path: str):
+        # 一行一个 (采样时刻, 进程)，方便直接丢进表格/pandas 画图
+        fields = ["t", "pid", "cpu_percent", "rss", "ctx_voluntary", "ctx_involuntary", "threads", "runnable"]
+        with open(path, "w", newline="") as f:
+            w = csv.DictWriter(f, fieldnames=fields)
+            w.writeheader()
+            for x in self.samples:
+                for p in x["procs"]:
+                    w.writerow({"t": x["t"], **p})
@@ -0,0 +1,104 @@
+import os
+import time
+import threading
+from concurrent.futures import wait, FIRST_COMPLETED
+
+SCHEDULES = ("static", "dynamic")
+
+
+def worker_key() -> str:
+    # 线程池里同一个进程内靠线程 id 区分 worker，进程池靠 pid 区分
+    return f"{os.getpid()}/{threading.get_ident()}"
+
+def timed_call(fn, lo: int, hi: int):
+    """在 worker 里执行 fn(lo, hi)，顺便带回是谁跑的、什么时候开始/结束"""
+    t0 = time.time()
+    c = fn(lo, hi)
+    t1 = time.time()
+    return c, worker_key(), t0, t1
+
+
+# 静态切块：一开始就把 [2, n) 等宽切成 chunks 份
+def static_ranges(n: int, chunks: int):
+    span = n - 2
+    step = span // chunks
+    ranges = []
+    start = 2
+    for i in range(chunks):
+        end = start + step
+        if i == chunks - 1:
+            end = n
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+def run_static(ex, task, n: int, chunks: int):
+    futures = [ex.submit(timed_call, task, lo, hi) for lo, hi in static_ranges(n, chunks)]
+    return [f.result() for f in futures]
+
+
+# 动态切块：父进程持有一个共享游标，谁空下来就从游标处再领一小块
+def guided_chunk(remaining: int, workers: int, min_chunk: int) -> int:
+    """guided 递减块长：剩余量越少块越小，最后靠小块把尾巴填平"""
+    return min(remaining, max(min_chunk, remaining // (2 * workers)))
+
+def run_dynamic(ex, task, n: int, workers: int, min_chunk: int):
+    """
+    始终保持 workers 个任务在途：完成一个就按 guided_chunk 从游标处切下一块补上。
+    游标只在父进程里推进，不需要跨进程的锁，线程池/进程池都能用。
+    """
+    cursor = 2
+    pending = set()
+    records = []
+
+    def submit_next():
+        nonlocal cursor
+        size = guided_chunk(n - cursor, workers, min_chunk)
+        pending.add(ex.submit(timed_call, task, cursor, cursor + size))
+        cursor += size
+
+    while cursor < n and len(pending) < workers:
+        submit_next()
+
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for f in done:
+            pending.discard(f)
+            records.append(f.result())
+            if cursor < n:
+                submit_next()
+    return records
+
+
+def summarize(records, t_start: float, t_end: float, n_workers: int) -> dict:
+    """
+    按 worker 汇总忙碌时间和尾部空闲时间。
+    tail_idle = 最后一个块结束时刻 - 该 worker 最后一次完成时刻（别人还在跑、它已经没活干的时间）
+    """
+    last_end = max((r[3] for r in records), default=t_end)
+    per = {}
+    for _, key, t0, t1 in records:
+        w = per.setdefault(key, {"tasks": 0, "busy_s": 0.0, "last_end": t0})
+        w["tasks"] += 1
+        w["busy_s"] += t1 - t0
+        w["last_end"] = max(w["last_end"], t1)
+
+    wall = t_end - t_start
+    workers = []
+    for key, w in sorted(per.items()):
+        workers.append({
+            "worker": key,
+            "tasks": w["tasks"],
+            "busy_s": round(w["busy_s"], 4),
+            "tail_idle_s": round(last_end - w["last_end"], 4),
+        })
+    busy = sum(w["busy_s"] for w in per.values())
+    return {
+        "wall_s": round(wall, 4),
+        "busy_s": round(busy, 4),
+        "tail_idle_s": round(sum(w["tail_idle_s"] for w in workers), 4),
+        "max_tail_idle_s": max((w["tail_idle_s"] for w in workers), default=0.0),
+        # 所有 worker 的忙碌时间 / (worker 数 * 墙钟时间)，一次都没领到活的 worker 也算在分母里
+        "utilization": round(busy / (n_workers * wall), 3) if wall > 0 else 0.0,
+        "workers": workers,
+    }
@@ -0,0 +1,69 @@
+import json
+import random
+
+# 短请求：聊天类；长请求：长文档总结这类 prompt 很长的
+SHORT_PROMPT = (10, 200)
+LONG_PROMPT = (1000, 4000)
+SHORT_TOKENS = (10, 25)
+LONG_TOKENS = (20, 60)
+
+
+def make_request(rid: int, t: float, long: bool, rng: random.Random) -> dict:
+    lo, hi = LONG_PROMPT if long else SHORT_PROMPT
+    tlo, thi = LONG_TOKENS if long else SHORT_TOKENS
+    return {
+        "rid": rid,
+        "t": round(t, 6),                    # 相对开始时刻的到达时间（秒）
+        "prompt_len": rng.randint(lo, hi),
+        "n_tokens": rng.randint(tlo, thi),
+        "priority": 1 if long else 0,        # 数字越小越优先：短的交互请求默认优先
+        "kind": "long" if long else "short",
+    }
+
+def poisson_arrivals(n: int, rate: float, long_frac: float = 0.2, seed: int = 0):
+    """
+    开环到达：间隔服从指数分布（Poisson 过程），不管系统处理得多慢都按时间表到达。
+    long_frac 是长请求的比例。
+    """
+    rng = random.Random(seed)
+    t = 0.0
+    reqs = []
+    for rid in range(n):
+        t += rng.expovariate(rate)
+        reqs.append(make_request(rid, t, rng.random() < long_frac, rng))
+    return reqs
+
+def burst_arrivals(n: int, long_frac: float = 0.2, seed: int = 0):
+    """所有请求在 t=0 一起到（和 thread_pc_stream 里 burst=True 一样）"""
+    rng = random.Random(seed)
+    return [make_request(rid, 0.0, rng.random() < long_frac, rng) for rid in range(n)]
+
+def load_trace(path: str):
+    """
+    回放 jsonl 格式的 trace：每行一个请求，至少要有 t（或 arrival_s）和 prompt_len；
+    n_tokens / priority / kind 没给就按 prompt_len 粗略推断。
+    """
+    reqs = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            d = json.loads(line)
+            prompt_len = int(d["prompt_len"])
+            long = prompt_len >= LONG_PROMPT[0]
+            reqs.append({
+                "rid": d.get("rid", len(reqs)),
+                "t": float(d.get("t", d.get("arrival_s", 0.0))),
+                "prompt_len": prompt_len,
+                "n_tokens": int(d.get("n_tokens", d.get("max_new_tokens", 20))),
+                "priority": int(d.get("priority", 1 if long else 0)),
+                "kind": d.get("kind", "long" if long else "short"),
+            })
+    reqs.sort(key=lambda r: r["t"])
+    return reqs
+
+def dump_trace(reqs, path: str):
+    with open(path, "w") as f:
+        for r in reqs:
+            f.write(json.dumps(r) + "\n")
@@ -0,0 +1,154 @@
+import time
+import random
+import asyncio
+import argparse
+
+import thread_pc_stream
+from thread_pc_stream import STOP, DONE, report
+
+class TokenChannel(thread_pc_stream.TokenChannel):
+    """
+    和线程版一样的每请求 token 通道，只是换成 asyncio.Queue：满了 await 让出事件循环，而不是阻塞线程。
+    closed 表示客户端已经断开，worker 看到后就不再为它生成。
+    """
+    def __init__(self, rid: int, maxsize: int = 8, read_delay: float = 0.0):
+        super().__init__(rid, maxsize, read_delay)
+        self.q = asyncio.Queue(maxsize=maxsize)
+        self.closed = False
+
+    async def put(self, wid: int, token: str):
+        await self.q.put((wid, token))  # 通道满会挂起：背压
+
+    async def get(self):
+        return await self.q.get()
+
+
+async def producer(req_q: asyncio.Queue, n_requests: int, new_q: asyncio.Queue, burst: bool = True,
+                   chan_size: int = 8, slow_rids=(), slow_delay: float = 0.0, verbose: bool = True):
+    """模拟请求进入：把请求放入队列，同时通知 streamer 有新连接"""
+    for rid in range(n_requests):
+        if not burst:
+            await asyncio.sleep(random.uniform(0.02, 0.08))  # 平滑到达
+        chan = TokenChannel(rid, chan_size, slow_delay if rid in slow_rids else 0.0)
+        req = {"rid": rid, "prompt_len": random.randint(10, 200), "chan": chan}
+        new_q.put_nowait(chan)
+        await req_q.put(req)  # 队列满会挂起：背压
+        if verbose:
+            print(f"[producer] enqueue rid={rid} prompt_len={req['prompt_len']}")
+    if verbose:
+        print("[producer] done")
+
+async def worker(wid: int, req_q: asyncio.Queue, verbose: bool = True):
+    """模拟推理 worker：取请求 -> 生成 token -> 写进请求自己的通道"""
+    while True:
+        req = await req_q.get()
+        if req is STOP:
+            req_q.task_done()
+            if verbose:
+                print(f"[worker-{wid}] stop")
+            break
+
+        chan = req["chan"]
+        try:
+            # 模拟推理逐 token 生成
+            n_tokens = random.randint(10, 25)
+            for t in range(n_tokens):
+                if chan.closed:
+                    # 客户端已经断开：立刻停止生成，把 worker 让给别的请求
+                    break
+                await asyncio.sleep(random.uniform(0.01, 0.03))
+                await chan.put(wid, f"T{t}")
+            else:
+                await chan.put(wid, DONE)
+        finally:
+            req_q.task_done()
+
+async def client(chan: TokenChannel, cancel_after: int = -1, verbose: bool = True):
+    """模拟一个客户端连接；cancel_after >= 0 时收到这么多 token 后断开"""
+    try:
+        while True:
+            wid, token = await chan.get()
+            if token == DONE:
+                if verbose:
+                    print(f"[stream] rid={chan.rid} from worker-{wid} DONE")
+                break
+            await asyncio.sleep(chan.read_delay)
+            chan.t_tokens.append(time.perf_counter())
+            if verbose:
+                print(f"[stream] rid={chan.rid} from worker-{wid} token={token}")
+            if 0 <= cancel_after <= len(chan.t_tokens):
+                if verbose:
+                    print(f"[stream] rid={chan.rid} client disconnected")
+                break
+    finally:
+        chan.closed = True
+        # 把通道里剩下的 token 丢掉，免得 worker 卡在 put 上
+        while not chan.q.empty():
+            chan.q.get_nowait()
+
+async def streamer(new_q: asyncio.Queue, n_requests: int, seen: list, cancel_rids=(), verbose: bool = True):
+    """每来一个新请求就起一个 client 协程，比线程便宜得多"""
+    clients = []
+    for _ in range(n_requests):
+        chan = await new_q.get()
+        seen.append(chan)
+        cancel_after = 3 if chan.rid in cancel_rids else -1
+        clients.append(asyncio.create_task(client(chan, cancel_after, verbose)))
+    await asyncio.gather(*clients)
+
+async def run_pipeline(n_requests: int = 20, n_workers: int = 4, slow_rids=(), slow_delay: float = 0.2,
+                       chan_size: int = 8, cancel_rids=(), timeout: float = 0.0, verbose: bool = True):
+    """
+    和线程版 run_pipeline 同样的 producer / worker / streamer 角色。
+    timeout > 0 时整条流水线超时后取消所有协程（模拟服务关闭 / 上游超时）。
+    """
+    req_q = asyncio.Queue(maxsize=50)   # 请求队列：调度 + 背压
+    new_q = asyncio.Queue()             # 新连接通知：producer -> streamer
+    chans = []                          # streamer 见过的所有通道，结束后统计
+
+    t_stream = asyncio.create_task(streamer(new_q, n_requests, chans, set(cancel_rids), verbose))
+    workers = [asyncio.create_task(worker(wid, req_q, verbose)) for wid in range(n_workers)]
+    t_prod = asyncio.create_task(producer(req_q, n_requests, new_q, True, chan_size, set(slow_rids), slow_delay, verbose))
+
+    async def drain():
+        await t_prod
+        await req_q.join()
+        # 发送 STOP，让 worker 退出
+        for _ in range(n_workers):
+            await req_q.put(STOP)
+        await asyncio.gather(*workers)
+        await t_stream
+
+    try:
+        await asyncio.wait_for(drain(), timeout=timeout if timeout > 0 else None)
+    except asyncio.TimeoutError:
+        if verbose:
+            print(f"[pipeline] timeout after {timeout}s, cancelling")
+    finally:
+        tasks = [t_prod, t_stream, *workers]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return chans
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--slow", type=int, default=1)              # 前几个请求是慢客户端
+    parser.add_argument("--slow-delay", type=float, default=0.2)    # 慢客户端每个 token 的写回耗时
+    parser.add_argument("--cancel", type=int, default=0)            # 接下来几个请求收到 3 个 token 后断开
+    parser.add_argument("--chan-size", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=0.0)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    slow_rids = set(range(args.slow))
+    cancel_rids = set(range(args.slow, args.slow + args.cancel))
+    chans = asyncio.run(run_pipeline(args.requests, args.workers, slow_rids, args.slow_delay,
+                                     args.chan_size, cancel_rids, args.timeout, args.verbose))
+    report("asyncio", chans, slow_rids)
+    print("ALL DONE")
+
+if __name__ == "__main__":
+    main()
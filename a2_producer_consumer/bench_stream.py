@@ -0,0 +1,129 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+import subprocess
+
+import psutil
+
+import thread_pc_stream
+import async_pc_stream
+from thread_pc_stream import percentile
+
+IMPLS = ("thread", "async")
+
+
+class PeakSampler:
+    """后台线程每 interval 秒采一次本进程的 RSS 和线程数，记峰值"""
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.proc = psutil.Process()
+        self.peak_rss = 0
+        self.peak_threads = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self.proc.oneshot():
+                self.peak_rss = max(self.peak_rss, self.proc.memory_info().rss)
+                self.peak_threads = max(self.peak_threads, self.proc.num_threads())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_one(impl: str, concurrency: int, chan_size: int = 8) -> dict:
+    """
+    在当前进程里跑一轮：concurrency 个请求同时进来，每个请求一个 worker（thread-per-stream / task-per-stream）
+    """
+    random.seed(0)
+    base_rss = psutil.Process().memory_info().rss
+    t0 = time.perf_counter()
+    with PeakSampler() as ps:
+        if impl == "thread":
+            chans = thread_pc_stream.run_pipeline("per_request", concurrency, concurrency,
+                                                  chan_size=chan_size, verbose=False)
+        else:
+            chans = asyncio.run(async_pc_stream.run_pipeline(concurrency, concurrency,
+                                                             chan_size=chan_size, verbose=False))
+    wall = time.perf_counter() - t0
+
+    ttft = [c.ttft_ms() for c in chans if c.t_tokens]
+    itl = [x for c in chans for x in c.itl_ms()]
+    tokens = sum(len(c.t_tokens) for c in chans)
+    return {
+        "impl": impl,
+        "concurrency": concurrency,
+        "wall_s": round(wall, 3),
+        "req_per_s": round(len(chans) / wall, 1),
+        "tokens_per_s": round(tokens / wall, 1),
+        "ttft_p50_ms": round(percentile(ttft, 50), 1),
+        "ttft_p99_ms": round(percentile(ttft, 99), 1),
+        "itl_p50_ms": round(percentile(itl, 50), 1),
+        "itl_p99_ms": round(percentile(itl, 99), 1),
+        # 峰值 RSS 相对起跑前的增量，摊到每个在途请求上
+        "kb_per_inflight": round((ps.peak_rss - base_rss) / 1024 / concurrency, 1),
+        "peak_threads": ps.peak_threads,
+    }
+
+def run_isolated(impl: str, concurrency: int, chan_size: int, timeout: float) -> dict:
+    """
+    每个组合放到一个新的子进程里跑：RSS 只涨不跌，同一进程里连续跑会互相污染内存数字。
+    线程版在高并发下可能直接起不来线程（ulimit / 内存），记成失败而不是把整个 benchmark 搞挂。
+    """
+    cmd = [sys.executable, os.path.abspath(__file__), "--one", impl, str(concurrency), "--chan-size", str(chan_size)]
+    try:
+        out = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {"impl": impl, "concurrency": concurrency, "error": f"timeout after {timeout}s"}
+    if out.returncode != 0:
+        err = out.stderr.strip().splitlines()
+        return {"impl": impl, "concurrency": concurrency, "error": err[-1] if err else f"exit {out.returncode}"}
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", default="10,100,1000,10000")
+    parser.add_argument("--impls", default=",".join(IMPLS))
+    parser.add_argument("--chan-size", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=600.0)  # 单个组合的超时
+    parser.add_argument("--json", default="")                    # 不为空时把全部结果写成 json
+    parser.add_argument("--one", nargs=2, metavar=("IMPL", "C"))  # 内部用：子进程里只跑一个组合
+    args = parser.parse_args()
+
+    if args.one:
+        impl, c = args.one
+        print(json.dumps(run_one(impl, int(c), args.chan_size)))
+        return
+
+    results = []
+    cols = ("impl", "concurrency", "wall_s", "req_per_s", "tokens_per_s", "ttft_p50_ms", "ttft_p99_ms",
+            "itl_p50_ms", "itl_p99_ms", "kb_per_inflight", "peak_threads")
+    print(" | ".join(cols))
+    for c in [int(x) for x in args.concurrency.split(",")]:
+        for impl in args.impls.split(","):
+            r = run_isolated(impl, c, args.chan_size, args.timeout)
+            results.append(r)
+            if "error" in r:
+                print(f"{impl} | {c} | FAILED: {r['error']}")
+            else:
+                print(" | ".join(str(r[k]) for k in cols))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+
+if __name__ == "__main__":
+    main()
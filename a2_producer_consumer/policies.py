@@ -0,0 +1,72 @@
+import time
+import heapq
+import itertools
+from queue import Queue
+
+# 和标准库的 PriorityQueue / LifoQueue 一样，只重写 _init/_qsize/_put/_get，
+# 锁、阻塞、task_done/join 都沿用 queue.Queue 的实现，worker 那边不用改。
+# 停止信号 None 排在所有请求后面。
+
+
+class FIFOQueue(Queue):
+    """先来先服务（就是 queue.Queue 本身）"""
+
+
+class SJFQueue(Queue):
+    """shortest job first：按 prompt_len 从短到长出队，同样长度按到达顺序"""
+    def _init(self, maxsize):
+        self.heap = []
+        self.seq = itertools.count()
+
+    def _qsize(self):
+        return len(self.heap)
+
+    def _put(self, item):
+        key = float("inf") if item is None else item["prompt_len"]
+        heapq.heappush(self.heap, (key, next(self.seq), item))
+
+    def _get(self):
+        return heapq.heappop(self.heap)[-1]
+
+
+class AgingPriorityQueue(Queue):
+    """
+    优先级 + 老化：score = priority - aging * 已等待秒数，score 小的先出。
+    等得越久分数越低，低优先级的长请求等够 1/aging 秒就能追上高一档的请求，不会被饿死。
+    因为分数随时间变，出队时要扫一遍（O(n)），队列只有几百个请求时无所谓。
+    """
+    def __init__(self, maxsize: int = 0, aging: float = 1.0):
+        self.aging = aging
+        super().__init__(maxsize)
+
+    def _init(self, maxsize):
+        self.items = []
+        self.seq = itertools.count()
+
+    def _qsize(self):
+        return len(self.items)
+
+    def _put(self, item):
+        self.items.append((time.perf_counter(), next(self.seq), item))
+
+    def _get(self):
+        now = time.perf_counter()
+        def score(entry):
+            t, seq, item = entry
+            if item is None:
+                return (float("inf"), seq)
+            return (item["priority"] - self.aging * (now - t), seq)
+        i = min(range(len(self.items)), key=lambda k: score(self.items[k]))
+        return self.items.pop(i)[-1]
+
+
+POLICIES = {
+    "fifo": FIFOQueue,
+    "sjf": SJFQueue,
+    "aging": AgingPriorityQueue,
+}
+
+def make_queue(policy: str, **kw) -> Queue:
+    if policy not in POLICIES:
+        raise ValueError(f"unknown policy: {policy!r}, expected one of {tuple(POLICIES)}")
+    return POLICIES[policy](**kw)
@@ -0,0 +1,150 @@
+import time
+import struct
+import argparse
+import multiprocessing as mp
+
+from shm_ring import TokenRing
+from thread_pc_stream import percentile
+
+STOP = None  # 停止信号
+TRANSPORTS = ("ring", "queue")
+
+# ring 里一条 token 记录：rid, token 序号, 发送时刻(ns) + 变长的 token 文本
+REC = struct.Struct("<iiq")
+SLOT_SIZE = 64
+RING_SLOTS = 4096
+END = -1  # rid = END 表示这个 worker 已经退出
+
+
+def postprocess(t: int, cost: int) -> str:
+    """模拟 detokenize / 后处理这种纯 CPU 的活：cost 越大越吃 CPU，线程下会被 GIL 串行化"""
+    s = f"T{t}"
+    for _ in range(cost):
+        s = s[::-1]
+    return s
+
+def worker(wid: int, req_q, transport: str, out, n_tokens: int, post_cost: int):
+    """
+    进程 worker：取请求 -> 逐 token 后处理 -> 写回父进程
+    transport=ring 时 out 是这个 worker 独占的 ring 名字（SPSC：一个 worker 写，父进程读）
+    transport=queue 时 out 是所有 worker 共用的 multiprocessing.Queue，每个 token 都要 pickle 一次
+    """
+    ring = TokenRing.attach(out, RING_SLOTS, SLOT_SIZE) if transport == "ring" else None
+
+    def send(rid: int, t: int, text: str):
+        ts = time.monotonic_ns()  # Linux 上 monotonic 时钟跨进程可比
+        if ring is None:
+            out.put((rid, t, ts, text))
+            return
+        data = REC.pack(rid, t, ts) + text.encode()
+        while not ring.put(data):
+            time.sleep(0)  # 满了：让出 CPU 等父进程读走
+
+    while True:
+        req = req_q.get()
+        if req is STOP:
+            break
+        for t in range(n_tokens):
+            send(req["rid"], t, postprocess(t, post_cost))
+    send(END, wid, "")
+    if ring is not None:
+        ring.close()
+
+
+def consume_rings(rings, n_workers: int, on_token):
+    """父进程轮询所有 ring；都空的时候逐步退避，别在单核机器上把 worker 的 CPU 抢光"""
+    ended = 0
+    idle = 0
+    while ended < n_workers:
+        got = False
+        for ring in rings:
+            data = ring.get()
+            if data is None:
+                continue
+            got = True
+            rid, t, ts = REC.unpack_from(data)
+            if rid == END:
+                ended += 1
+                continue
+            on_token(rid, t, ts, data[REC.size:].decode())
+        if got:
+            idle = 0
+        else:
+            idle += 1
+            time.sleep(0 if idle < 100 else 0.0001)
+
+def consume_queue(out_q, n_workers: int, on_token):
+    ended = 0
+    while ended < n_workers:
+        rid, t, ts, text = out_q.get()
+        if rid == END:
+            ended += 1
+            continue
+        on_token(rid, t, ts, text)
+
+
+def run_pipeline(transport: str = "ring", n_requests: int = 200, n_workers: int = 4,
+                 n_tokens: int = 200, post_cost: int = 0) -> dict:
+    req_q = mp.Queue()  # 请求本身很少，直接走 Queue 就行；热路径是 token
+    rings, out_q = [], None
+    if transport == "ring":
+        rings = [TokenRing.create(RING_SLOTS, SLOT_SIZE) for _ in range(n_workers)]
+        outs = [r.name for r in rings]
+    elif transport == "queue":
+        out_q = mp.Queue(maxsize=RING_SLOTS * n_workers)
+        outs = [out_q] * n_workers
+    else:
+        raise ValueError(f"unknown transport: {transport!r}, expected one of {TRANSPORTS}")
+
+    procs = [mp.Process(target=worker, args=(wid, req_q, transport, outs[wid], n_tokens, post_cost))
+             for wid in range(n_workers)]
+    for p in procs:
+        p.start()
+
+    lat_us = []
+    def on_token(rid, t, ts, text):
+        lat_us.append((time.monotonic_ns() - ts) / 1000)
+
+    t0 = time.perf_counter()
+    for rid in range(n_requests):
+        req_q.put({"rid": rid})
+    for _ in range(n_workers):
+        req_q.put(STOP)
+    try:
+        if transport == "ring":
+            consume_rings(rings, n_workers, on_token)
+        else:
+            consume_queue(out_q, n_workers, on_token)
+        wall = time.perf_counter() - t0
+    finally:
+        for p in procs:
+            p.join()
+        for r in rings:
+            r.close()
+
+    return {
+        "transport": transport,
+        "workers": n_workers,
+        "tokens": len(lat_us),
+        "wall_s": round(wall, 3),
+        "tokens_per_s": round(len(lat_us) / wall),
+        "lat_p50_us": round(percentile(lat_us, 50), 1),
+        "lat_p99_us": round(percentile(lat_us, 99), 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transport", choices=TRANSPORTS + ("both",), default="both")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--tokens", type=int, default=200)      # 每个请求生成多少 token
+    parser.add_argument("--post-cost", type=int, default=0)     # 每个 token 的后处理 CPU 开销
+    args = parser.parse_args()
+
+    transports = TRANSPORTS if args.transport == "both" else (args.transport,)
+    for transport in transports:
+        r = run_pipeline(transport, args.requests, args.workers, args.tokens, args.post_cost)
+        print(" | ".join(f"{k}={v}" for k, v in r.items()))
+
+if __name__ == "__main__":
+    main()
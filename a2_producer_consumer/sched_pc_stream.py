@@ -0,0 +1,100 @@
+import copy
+import time
+import argparse
+import threading
+
+from arrivals import poisson_arrivals, burst_arrivals, load_trace, dump_trace
+from policies import POLICIES, make_queue
+from thread_pc_stream import STOP, percentile
+
+
+def producer(req_q, reqs, t0: float):
+    """开环发压：严格按 trace 里的到达时刻入队，不看系统忙不忙（请求队列不设上限，入队不会被背压挡住）"""
+    for req in reqs:
+        delay = t0 + req["t"] - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        req["t_arrive"] = time.perf_counter()
+        req_q.put(req)
+
+def worker(wid: int, req_q, prefill_ms: float, decode_ms: float):
+    """模拟推理：prefill 耗时和 prompt_len 成正比，decode 耗时和生成 token 数成正比"""
+    while True:
+        req = req_q.get()
+        if req is STOP:
+            req_q.task_done()
+            break
+        req["t_start"] = time.perf_counter()
+        time.sleep((req["prompt_len"] * prefill_ms + req["n_tokens"] * decode_ms) / 1000.0)
+        req["t_done"] = time.perf_counter()
+        req["wid"] = wid
+        req_q.task_done()
+
+def run_policy(policy: str, reqs, n_workers: int = 4, prefill_ms: float = 0.05,
+               decode_ms: float = 5.0, aging: float = 1.0):
+    """同一份到达序列在某个队列策略下跑一遍，返回带时间戳的请求"""
+    reqs = copy.deepcopy(reqs)
+    kw = {"aging": aging} if policy == "aging" else {}
+    req_q = make_queue(policy, **kw)
+
+    workers = [threading.Thread(target=worker, args=(wid, req_q, prefill_ms, decode_ms), daemon=True)
+               for wid in range(n_workers)]
+    for t in workers:
+        t.start()
+
+    producer(req_q, reqs, time.perf_counter())
+    req_q.join()
+    for _ in range(n_workers):
+        req_q.put(STOP)
+    for t in workers:
+        t.join()
+    return reqs
+
+def report(policy: str, reqs):
+    print(f"\n=== policy={policy} ===")
+    groups = [("all", reqs)] + [(k, [r for r in reqs if r["kind"] == k]) for k in ("short", "long")]
+    for name, rs in groups:
+        if not rs:
+            continue
+        wait = [(r["t_start"] - r["t_arrive"]) * 1000 for r in rs]
+        done = [(r["t_done"] - r["t_arrive"]) * 1000 for r in rs]
+        print(f"{name:>5} n={len(rs):<4} queue wait p50={percentile(wait, 50):7.1f} p90={percentile(wait, 90):7.1f} "
+              f"p99={percentile(wait, 99):7.1f}ms | completion p50={percentile(done, 50):7.1f} "
+              f"p90={percentile(done, 90):7.1f} p99={percentile(done, 99):7.1f}ms")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--arrivals", choices=("poisson", "burst", "trace"), default="poisson")
+    parser.add_argument("--trace", default="")                  # --arrivals trace 时回放的 jsonl 文件
+    parser.add_argument("--dump-trace", default="")             # 把生成的到达序列存成 jsonl，之后可以回放
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=25.0)     # Poisson 到达率（请求/秒）
+    parser.add_argument("--long-frac", type=float, default=0.2) # 长请求占比
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--prefill-ms", type=float, default=0.05)  # 每个 prompt token 的 prefill 耗时
+    parser.add_argument("--decode-ms", type=float, default=5.0)    # 每个生成 token 的 decode 耗时
+    parser.add_argument("--aging", type=float, default=1.0)        # aging 策略每等 1 秒提升多少优先级
+    parser.add_argument("--policies", default=",".join(POLICIES))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.arrivals == "trace":
+        reqs = load_trace(args.trace)
+    elif args.arrivals == "burst":
+        reqs = burst_arrivals(args.requests, args.long_frac, args.seed)
+    else:
+        reqs = poisson_arrivals(args.requests, args.rate, args.long_frac, args.seed)
+    if not reqs:
+        # 空 trace（--requests 0 或者 trace 文件里没有请求）没什么可跑的，后面的 reqs[-1] 也会 IndexError
+        parser.error("no requests to run: use --requests > 0 or a non-empty --trace")
+    if args.dump_trace:
+        dump_trace(reqs, args.dump_trace)
+
+    n_long = sum(r["kind"] == "long" for r in reqs)
+    print(f"{len(reqs)} requests ({n_long} long) over {reqs[-1]['t']:.2f}s, workers={args.workers}")
+    for policy in args.policies.split(","):
+        done = run_policy(policy, reqs, args.workers, args.prefill_ms, args.decode_ms, args.aging)
+        report(policy, done)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import struct
+from multiprocessing import shared_memory
+
+# 头部：写指针 head 和读指针 tail 各占一个 cache line，避免生产者/消费者来回抢同一行（false sharing）
+# 下标按 uint64 算：head 在第 0 个，tail 在第 8 个（字节偏移 64）
+HEAD = 0
+TAIL = 8
+HEADER_SIZE = 128
+LEN = struct.Struct("<I")
+
+
+class TokenRing:
+    """
+    基于 multiprocessing.shared_memory 的单生产者 / 单消费者（SPSC）环形缓冲区。
+
+    - 只有生产者写 head，只有消费者写 tail，所以不需要锁
+    - 每个槽位定长：4 字节长度 + payload，payload 是调用方自己 pack 好的 bytes，不经过 pickle
+    - head / tail 是单调递增的序号，槽位下标 = 序号 & (slots - 1)，head - tail == slots 时为满
+
+    内存序：先写槽位再写 head（生产者）、先读完槽位再写 tail（消费者）。
+    x86 上 store 不会和 store 重排，这个顺序就够了；弱内存序的 CPU（ARM）严格来说还需要内存屏障，Python 层拿不到。
+    """
+    def __init__(self, shm: shared_memory.SharedMemory, slots: int, slot_size: int, owner: bool):
+        self.shm = shm
+        self.buf = shm.buf
+        # head / tail 通过 cast 成 "Q" 的 memoryview 读写：单个元素赋值是一次 8 字节 memcpy（对齐时就是一条 store）。
+        # 不能用 struct.pack_into：它会先把目标区域 memset 成 0 再写，对方可能正好读到 0
+        self.idx = self.buf[:HEADER_SIZE].cast("Q")
+        self.slots = slots
+        self.slot_size = slot_size
+        self.mask = slots - 1
+        self.owner = owner
+        # 自己这一侧的指针缓存在本地，只有对方的指针需要每次从共享内存读
+        self._head = self.idx[HEAD]
+        self._tail = self.idx[TAIL]
+
+    @classmethod
+    def create(cls, slots: int = 4096, slot_size: int = 64):
+        if slots & (slots - 1):
+            raise ValueError(f"slots must be a power of two, got {slots}")
+        shm = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + slots * slot_size)
+        shm.buf[:HEADER_SIZE] = bytes(HEADER_SIZE)
+        return cls(shm, slots, slot_size, owner=True)
+
+    @classmethod
+    def attach(cls, name: str, slots: int, slot_size: int):
+        try:
+            # 3.13+：只有创建者负责登记和回收，attach 的一方不进 resource_tracker
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name)
+        return cls(shm, slots, slot_size, owner=False)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def put(self, data: bytes) -> bool:
+        """生产者：非阻塞写入一条，满了返回 False"""
+        n = len(data)
+        if n > self.slot_size - LEN.size:
+            raise ValueError(f"record of {n} bytes does not fit slot_size={self.slot_size}")
+        head = self._head
+        if head - self.idx[TAIL] >= self.slots:
+            return False
+        off = HEADER_SIZE + (head & self.mask) * self.slot_size
+        LEN.pack_into(self.buf, off, n)
+        self.buf[off + LEN.size:off + LEN.size + n] = data
+        # 槽位写完再发布 head，消费者看到新 head 时数据一定已经在了
+        self._head = head + 1
+        self.idx[HEAD] = self._head
+        return True
+
+    def get(self):
+        """消费者：非阻塞读一条，空了返回 None"""
+        tail = self._tail
+        if tail == self.idx[HEAD]:
+            return None
+        off = HEADER_SIZE + (tail & self.mask) * self.slot_size
+        n = LEN.unpack_from(self.buf, off)[0]
+        data = bytes(self.buf[off + LEN.size:off + LEN.size + n])
+        # 数据拷出来之后才释放槽位
+        self._tail = tail + 1
+        self.idx[TAIL] = self._tail
+        return data
+
+    def __len__(self):
+        return self.idx[HEAD] - self.idx[TAIL]
+
+    def close(self):
+        # 先释放自己导出的 memoryview，否则 shm.close() 会报 BufferError
+        self.idx.release()
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
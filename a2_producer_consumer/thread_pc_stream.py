@@ -1,78 +1,181 @@
 import time
 import random
+import argparse
 import threading
 from queue import Queue, Empty
 
 STOP = None  # 停止信号
-
-def producer(req_q: Queue, n_requests: int, burst: bool = True):
-    """模拟请求进入：把请求放入队列"""
+DONE = "[DONE]"  # 单个请求生成结束
+
+class TokenChannel:
+    """
+    每个请求自己的 token 通道。
+    有界队列 = 这一路自己的背压：客户端读得慢只会让写这一路的 worker 阻塞，不会拖住别的请求。
+    """
+    def __init__(self, rid: int, maxsize: int = 8, read_delay: float = 0.0):
+        self.rid = rid
+        self.q = Queue(maxsize=maxsize)
+        self.read_delay = read_delay            # 模拟客户端读得慢（写 socket 要等多久）
+        self.t_enqueue = time.perf_counter()    # 请求进入系统的时刻
+        self.t_tokens = []                      # 客户端实际收到每个 token 的时刻
+
+    def put(self, wid: int, token: str):
+        self.q.put((wid, token))  # 通道满会阻塞：背压
+
+    def get(self, timeout=None):
+        return self.q.get(timeout=timeout)
+
+    def ttft_ms(self) -> float:
+        # time to first token：进队到客户端收到第一个 token
+        return (self.t_tokens[0] - self.t_enqueue) * 1000 if self.t_tokens else 0.0
+
+    def itl_ms(self):
+        # inter-token latency：相邻两个 token 到达客户端的间隔
+        return [(b - a) * 1000 for a, b in zip(self.t_tokens, self.t_tokens[1:])]
+
+
+def producer(req_q: Queue, n_requests: int, burst: bool = True, new_q: Queue = None,
+             chan_size: int = 8, slow_rids=(), slow_delay: float = 0.0, verbose: bool = True):
+    """模拟请求进入：把请求放入队列，同时通知 streamer 有新连接"""
     for rid in range(n_requests):
         if not burst:
             time.sleep(random.uniform(0.02, 0.08))  # 平滑到达
-        req = {"rid": rid, "prompt_len": random.randint(10, 200)}
+        chan = TokenChannel(rid, chan_size, slow_delay if rid in slow_rids else 0.0)
+        req = {"rid": rid, "prompt_len": random.randint(10, 200), "chan": chan}
+        new_q.put(chan)
         req_q.put(req)  # 队列满会阻塞：背压
-        print(f"[producer] enqueue rid={rid} prompt_len={req['prompt_len']}")
-    print("[producer] done")
-
-def worker(wid: int, req_q: Queue, out_q: Queue):
-    """模拟推理 worker：取请求 -> 生成 token -> 流式输出"""
+        if verbose:
+            print(f"[producer] enqueue rid={rid} prompt_len={req['prompt_len']}")
+    if verbose:
+        print("[producer] done")
+
+def worker(wid: int, req_q: Queue, out_q: Queue = None, verbose: bool = True):
+    """
+    模拟推理 worker：取请求 -> 生成 token -> 流式输出
+    out_q 为 None 时写进请求自己的通道（per_request），否则写进所有请求共用的 out_q（shared）
+    """
     while True:
         req = req_q.get()  # 阻塞等待
         if req is STOP:
             req_q.task_done()
-            print(f"[worker-{wid}] stop")
+            if verbose:
+                print(f"[worker-{wid}] stop")
             break
 
         rid = req["rid"]
+        chan = req["chan"]
         # 模拟推理逐 token 生成
         n_tokens = random.randint(10, 25)
-        for t in range(n_tokens):
-            time.sleep(random.uniform(0.01, 0.03))
-            out_q.put((rid, wid, f"T{t}"))
-        out_q.put((rid, wid, "[DONE]"))
+        for t in range(n_tokens + 1):
+            token = f"T{t}" if t < n_tokens else DONE
+            if t < n_tokens:
+                time.sleep(random.uniform(0.01, 0.03))
+            if out_q is None:
+                chan.put(wid, token)
+            else:
+                out_q.put((rid, wid, token))
 
         req_q.task_done()
 
-def streamer(out_q: Queue, n_requests: int):
-    """模拟向客户端 streaming：不断取 token 并输出"""
+def client(chan: TokenChannel, verbose: bool = True):
+    """模拟一个客户端连接：只读自己的通道，按自己的速度写回"""
+    while True:
+        wid, token = chan.get()
+        if token == DONE:
+            if verbose:
+                print(f"[stream] rid={chan.rid} from worker-{wid} DONE")
+            break
+        time.sleep(chan.read_delay)
+        chan.t_tokens.append(time.perf_counter())
+        if verbose:
+            print(f"[stream] rid={chan.rid} from worker-{wid} token={token}")
+
+def streamer(new_q: Queue, n_requests: int, seen: list, verbose: bool = True):
+    """per_request：每来一个新请求就给它起一个 client 线程，各路并发写回，互不阻塞"""
+    clients = []
+    for _ in range(n_requests):
+        chan = new_q.get()
+        seen.append(chan)
+        t = threading.Thread(target=client, args=(chan, verbose), daemon=True)
+        t.start()
+        clients.append(t)
+    for t in clients:
+        t.join()
+
+def shared_streamer(out_q: Queue, new_q: Queue, n_requests: int, seen: list, verbose: bool = True):
+    """shared：一个线程从共用的 out_q 里取 token 再按 rid 分发，写慢客户端时所有请求都在后面排队"""
+    chans = {}
     done = set()
     while len(done) < n_requests:
         try:
             rid, wid, token = out_q.get(timeout=1.0)
         except Empty:
             continue
+        while rid not in chans:
+            chan = new_q.get()
+            chans[chan.rid] = chan
+            seen.append(chan)
+        chan = chans[rid]
 
-        if token == "[DONE]":
+        if token == DONE:
             if rid not in done:
                 done.add(rid)
-            print(f"[stream] rid={rid} from worker-{wid} DONE ({len(done)}/{n_requests})")
+            if verbose:
+                print(f"[stream] rid={rid} from worker-{wid} DONE ({len(done)}/{n_requests})")
         else:
-            print(f"[stream] rid={rid} from worker-{wid} token={token}")
+            time.sleep(chan.read_delay)
+            chan.t_tokens.append(time.perf_counter())
+            if verbose:
+                print(f"[stream] rid={rid} from worker-{wid} token={token}")
 
         out_q.task_done()
 
 
-def main():
-    n_requests = 20
-    n_workers = 4
+def percentile(values, p: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[int((p / 100.0) * (len(s) - 1))]
+
+def report(mode: str, chans, slow_rids):
+    print(f"\n=== mode={mode} ===")
+    groups = [("fast", [c for c in chans if c.rid not in slow_rids]),
+              ("slow", [c for c in chans if c.rid in slow_rids])]
+    for name, cs in groups:
+        if not cs:
+            continue
+        ttft = [c.ttft_ms() for c in cs if c.t_tokens]  # 超时/取消前一个 token 都没收到的不算
+        itl = [x for c in cs for x in c.itl_ms()]
+        print(f"{name:>4} n={len(cs):<3} TTFT p50={percentile(ttft, 50):7.1f}ms p99={percentile(ttft, 99):7.1f}ms | "
+              f"ITL p50={percentile(itl, 50):6.1f}ms p99={percentile(itl, 99):6.1f}ms max={max(itl, default=0.0):6.1f}ms")
 
+def run_pipeline(mode: str = "per_request", n_requests: int = 20, n_workers: int = 4,
+                 slow_rids=(), slow_delay: float = 0.2, chan_size: int = 8, verbose: bool = True):
     req_q = Queue(maxsize=50)   # 请求队列：调度 + 背压
-    out_q = Queue(maxsize=500)  # 输出队列：token streaming
+    new_q = Queue()             # 新连接通知：producer -> streamer
+    out_q = Queue(maxsize=500) if mode == "shared" else None  # shared 模式下所有请求共用的输出队列
+    chans = []                  # streamer 见过的所有通道，结束后统计
 
     # 启动 streamer（模拟写回客户端）
-    t_stream = threading.Thread(target=streamer, args=(out_q, n_requests), daemon=True)
+    if mode == "shared":
+        t_stream = threading.Thread(target=shared_streamer, args=(out_q, new_q, n_requests, chans, verbose), daemon=True)
+    else:
+        t_stream = threading.Thread(target=streamer, args=(new_q, n_requests, chans, verbose), daemon=True)
     t_stream.start()
 
     # 启动workers
     workers = []
     for wid in range(n_workers):
-        t = threading.Thread(target=worker, args=(wid, req_q, out_q), daemon=True)
+        t = threading.Thread(target=worker, args=(wid, req_q, out_q, verbose), daemon=True)
         t.start()
         workers.append(t)
 
     # 启动 producer
-    t_prod = threading.Thread(target=producer, args=(req_q, n_requests, True), daemon=True)
+    t_prod = threading.Thread(
+        target=producer,
+        args=(req_q, n_requests, True, new_q, chan_size, set(slow_rids), slow_delay, verbose),
+        daemon=True,
+    )
     t_prod.start()
 
     # 等 producer 完成
@@ -87,10 +190,29 @@ def main():
     for t in workers:
         t.join()
 
-    # 等 streamer 消费完输出
-    out_q.join()
+    # 等 streamer 把所有 token 写回客户端
+    t_stream.join()
+    return chans
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=("per_request", "shared", "both"), default="both")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--slow", type=int, default=1)              # 前几个请求是慢客户端
+    parser.add_argument("--slow-delay", type=float, default=0.2)    # 慢客户端每个 token 的写回耗时
+    parser.add_argument("--chan-size", type=int, default=8)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    slow_rids = set(range(args.slow))
+    modes = ("shared", "per_request") if args.mode == "both" else (args.mode,)
+    for mode in modes:
+        chans = run_pipeline(mode, args.requests, args.workers, slow_rids, args.slow_delay,
+                             args.chan_size, args.verbose)
+        report(mode, chans, slow_rids)
 
     print("ALL DONE")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,224 @@
+import os
+import sys
+import json
+import mmap
+import time
+import argparse
+import resource
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+FILE = "test_100mb.bin"
+PAGE = mmap.PAGESIZE
+CHUNK = 16 * 1024 * 1024
+
+
+# ---- 各种读法：每个函数都要把整个文件真正读/摸一遍，返回读到的字节数 ----
+
+def read_full(path: str) -> int:
+    with open(path, "rb") as f:
+        data = f.read()   # 整个文件进内存（一次分配 + 一次拷贝）
+    return len(data)
+
+def _readinto_full(path: str, mv: memoryview) -> int:
+    # 不带缓冲的 FileIO 一次 readinto 就是一次 read(2)，Linux 上一次最多返回 0x7ffff000 字节（约 2GB），
+    # 几个 GB 的 checkpoint 要循环读到填满，不然只读了一部分却按整个文件算 GB/s
+    off = 0
+    with open(path, "rb", buffering=0) as f:
+        while off < len(mv):
+            n = f.readinto(mv[off:])
+            if not n:
+                break
+            off += n
+    if off != len(mv):
+        raise RuntimeError(f"{path}: read {off} bytes, expected {len(mv)} (file changed while reading?)")
+    return off
+
+def readinto_bytearray(path: str) -> int:
+    buf = bytearray(os.path.getsize(path))  # 预分配，读进已有的 buffer，不再额外分配
+    return _readinto_full(path, memoryview(buf))
+
+def readinto_numpy(path: str) -> int:
+    arr = np.empty(os.path.getsize(path), dtype=np.uint8)
+    return _readinto_full(path, memoryview(arr))
+
+def read_chunked(path: str) -> int:
+    # 流式读：内存里只有一个 CHUNK 大小的 buffer 反复用
+    buf = bytearray(CHUNK)
+    mv = memoryview(buf)
+    n = 0
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            k = f.readinto(mv)
+            if not k:
+                break
+            n += k
+    return n
+
+def pread_threads(path: str, threads: int = 8) -> int:
+    """多线程按偏移并行读进同一块预分配的 buffer；preadv 直接写进 buffer 切片，读的时候不持有 GIL"""
+    size = os.path.getsize(path)
+    buf = bytearray(size)
+    mv = memoryview(buf)
+    fd = os.open(path, os.O_RDONLY)
+
+    def read_range(off: int) -> int:
+        end = min(off + CHUNK, size)
+        if hasattr(os, "preadv"):
+            return os.preadv(fd, [mv[off:end]], off)
+        data = os.pread(fd, end - off, off)
+        mv[off:off + len(data)] = data
+        return len(data)
+
+    try:
+        with ThreadPoolExecutor(max_workers=threads) as ex:
+            return sum(ex.map(read_range, range(0, size, CHUNK)))
+    finally:
+        os.close(fd)
+
+def _mmap_touch(path: str, order: str, advice=()) -> int:
+    """
+    mmap 后每个 page 读一个字节，保证每一页都真的被缺页加载进来。
+    order=seq 按地址顺序摸，order=rand 随机顺序摸；advice 是先做的 madvise
+    """
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for a in advice:
+                mm.madvise(a)
+            arr = np.frombuffer(mm, dtype=np.uint8)
+            idx = np.arange(0, len(arr), PAGE)
+            if order == "rand":
+                np.random.default_rng(0).shuffle(idx)
+            arr[idx].sum()
+            n = len(arr)
+            del arr
+        finally:
+            mm.close()
+    return n
+
+def mmap_seq(path: str) -> int:
+    return _mmap_touch(path, "seq")
+
+def mmap_rand(path: str) -> int:
+    return _mmap_touch(path, "rand")
+
+def mmap_madv_seq(path: str) -> int:
+    # SEQUENTIAL：内核加大预读；WILLNEED：立刻异步把整个文件读进 page cache
+    return _mmap_touch(path, "seq", (mmap.MADV_SEQUENTIAL, mmap.MADV_WILLNEED))
+
+def mmap_madv_rand(path: str) -> int:
+    # RANDOM：关掉预读，每次缺页只读一页
+    return _mmap_touch(path, "rand", (mmap.MADV_RANDOM,))
+
+def mmap_willneed_rand(path: str) -> int:
+    # 随机访问但提前 WILLNEED：把随机缺页变成一次顺序预读
+    return _mmap_touch(path, "rand", (mmap.MADV_WILLNEED,))
+
+
+METHODS = {
+    "read": read_full,
+    "readinto_bytearray": readinto_bytearray,
+    "readinto_numpy": readinto_numpy,
+    "chunked": read_chunked,
+    "pread_threads": pread_threads,
+    "mmap_seq": mmap_seq,
+    "mmap_rand": mmap_rand,
+    "mmap_madv_seq": mmap_madv_seq,
+    "mmap_madv_rand": mmap_madv_rand,
+    "mmap_willneed_rand": mmap_willneed_rand,
+}
+
+
+# ---- page cache 控制 ----
+
+def drop_cache(path: str) -> bool:
+    """
+    把这个文件从 page cache 里踢掉（冷启动）。不需要 root，但只对干净页、且没有被别的进程 mmap 住的页有效。
+    没有 posix_fadvise 的平台（macOS / Windows）返回 False，冷热结果就没有区别了。
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return True
+
+def warm_cache(path: str):
+    read_chunked(path)
+
+
+def run_one(method: str, path: str) -> dict:
+    """在当前进程里跑一个方法；ru_maxrss 是进程生命周期的峰值，所以每个方法要单独起进程"""
+    fn = METHODS[method]
+    r0 = resource.getrusage(resource.RUSAGE_SELF)
+    t0 = time.perf_counter()
+    n = fn(path)
+    dt = time.perf_counter() - t0
+    r1 = resource.getrusage(resource.RUSAGE_SELF)
+    # Linux 上 ru_maxrss 单位是 KB，macOS 上是字节
+    maxrss_mb = r1.ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10)
+    return {
+        "method": method,
+        "bytes": n,
+        "seconds": round(dt, 4),
+        "gb_per_s": round(n / dt / 1e9, 2) if dt > 0 else 0.0,
+        "major_faults": r1.ru_majflt - r0.ru_majflt,
+        "minor_faults": r1.ru_minflt - r0.ru_minflt,
+        "peak_rss_mb": round(maxrss_mb, 1),
+    }
+
+def run_isolated(method: str, path: str, cache: str) -> dict:
+    # 先在父进程里把 page cache 准备成冷/热状态，再起一个干净的子进程测
+    if cache == "cold":
+        drop_cache(path)
+    else:
+        warm_cache(path)
+    cmd = [sys.executable, os.path.abspath(__file__), "--file", path, "--one", method]
+    out = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    r = json.loads(out.stdout.strip().splitlines()[-1])
+    r["cache"] = cache
+    return r
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", default=FILE)
+    parser.add_argument("--methods", default=",".join(METHODS))
+    parser.add_argument("--cache", choices=("cold", "warm", "both"), default="both")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--json", default="")
+    parser.add_argument("--one", default="")  # 内部用：子进程里只跑一个方法
+    args = parser.parse_args()
+
+    if args.one:
+        print(json.dumps(run_one(args.one, args.file)))
+        return
+
+    size = os.path.getsize(args.file)
+    caches = ("cold", "warm") if args.cache == "both" else (args.cache,)
+    if "cold" in caches and not hasattr(os, "posix_fadvise"):
+        print("warning: posix_fadvise not available, cold runs are not actually cold")
+    print(f"file={args.file} size={size / 2**20:.0f}MB page={PAGE}")
+
+    cols = ("cache", "method", "seconds", "gb_per_s", "major_faults", "minor_faults", "peak_rss_mb")
+    print(" | ".join(cols))
+    results = []
+    for cache in caches:
+        for method in args.methods.split(","):
+            for _ in range(args.repeat):
+                r = run_isolated(method, args.file, cache)
+                results.append(r)
+                print(" | ".join(str(r[k]) for k in cols))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+
+if __name__ == "__main__":
+    main()
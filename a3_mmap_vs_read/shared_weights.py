@@ -0,0 +1,98 @@
+import os
+import mmap
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import psutil
+
+FILE = "test_100mb.bin"
+MODES = ("mmap", "read")
+
+# 每个 worker 进程里的权重：initializer 里加载一次，之后所有任务复用
+_weights = None
+
+
+def init_worker(path: str, mode: str):
+    """
+    mmap：只读映射同一个文件，所有 worker 共享 page cache 里的同一份物理页
+    read：按 read.py 的方式整个读进自己的内存，每个 worker 一份私有拷贝
+    加载完每页摸一下，模拟推理时所有权重都会被用到
+    """
+    global _weights
+    with open(path, "rb") as f:
+        if mode == "mmap":
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            buf = f.read()
+    _weights = np.frombuffer(buf, dtype=np.uint8)
+    _weights[::mmap.PAGESIZE].sum()
+
+def infer(hold: float) -> int:
+    # 模拟一次推理：读一遍权重；hold 让任务多占一会儿 worker，保证池子里每个 worker 都被拉起来
+    _weights[::mmap.PAGESIZE].sum()
+    time.sleep(hold)
+    return os.getpid()
+
+
+def tree_memory(pid: int) -> dict:
+    """
+    统计进程树的内存：
+    RSS 会把共享页在每个进程里都算一次；USS 只算进程独占的页；
+    PSS 把共享页按共享它的进程数平摊，整棵树的 PSS 之和才是真实占用的物理内存。
+    """
+    total = {"rss": 0, "uss": 0, "pss": 0}
+    parent = psutil.Process(pid)
+    for p in [parent] + parent.children(recursive=True):
+        try:
+            m = p.memory_full_info()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+        total["rss"] += m.rss
+        total["uss"] += m.uss
+        total["pss"] += getattr(m, "pss", 0)  # pss 只有 Linux 有
+    return total
+
+def run_case(path: str, mode: str, workers: int) -> dict:
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(path, mode)) as ex:
+        # 提交足够多的任务并等它们跑完，确保 workers 个进程全部起来并完成了加载
+        pids = set(ex.map(infer, [0.05] * workers * 2))
+        startup = time.perf_counter() - t0
+        mem = tree_memory(os.getpid())
+    mb = 2**20
+    return {
+        "mode": mode,
+        "workers": workers,
+        "procs_used": len(pids),
+        "startup_s": round(startup, 3),
+        "rss_mb": round(mem["rss"] / mb, 1),
+        "uss_mb": round(mem["uss"] / mb, 1),
+        "pss_mb": round(mem["pss"] / mb, 1),
+        "pss_per_worker_mb": round(mem["pss"] / mb / workers, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", default=FILE)
+    parser.add_argument("--workers", default="1,2,4,8,16,32")
+    parser.add_argument("--modes", default=",".join(MODES))
+    args = parser.parse_args()
+
+    size = os.path.getsize(args.file)
+    print(f"file={args.file} size={size / 2**20:.0f}MB")
+    cols = ("mode", "workers", "procs_used", "startup_s", "rss_mb", "uss_mb", "pss_mb", "pss_per_worker_mb")
+    print(" | ".join(cols))
+    for mode in args.modes.split(","):
+        for w in [int(x) for x in args.workers.split(",")]:
+            # read 模式每个 worker 一份拷贝，放不下就别跑了，免得把机器打进 swap / OOM
+            if mode == "read" and size * w > psutil.virtual_memory().available * 0.8:
+                print(f"{mode} | {w} | skipped: needs ~{size * w / 2**30:.1f}GB")
+                continue
+            r = run_case(args.file, mode, w)
+            print(" | ".join(str(r[k]) for k in cols))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+一个很小的权重容器格式（思路和 safetensors 一样）：
+
+    [8 字节 little-endian uint64：header 长度 N]
+    [N 字节 JSON header，末尾用空格补齐，让数据区按 ALIGN 对齐]
+    [数据区：每个 tensor 的原始字节，起始位置按 ALIGN 对齐]
+
+header 形如 {"tensors": {name: {"dtype": "<f2", "shape": [..], "offset": 相对数据区起点, "nbytes": ..}}, "metadata": {..}}
+加载时只读 header，tensor 在第一次访问时才从 mmap 上建零拷贝的 NumPy 视图，真正用到的页才会被缺页读进来。
+"""
+
+import json
+import mmap
+import time
+import struct
+import argparse
+
+import numpy as np
+
+MAGIC_LEN = struct.Struct("<Q")
+ALIGN = 64  # 对齐到 cache line，NumPy / SIMD 读起来不会跨行；想按页对齐可以传 mmap.PAGESIZE
+
+
+def _align_up(x: int, a: int) -> int:
+    return (x + a - 1) // a * a
+
+def build_header(specs: dict, metadata: dict = None, align: int = ALIGN):
+    """
+    只根据 {name: (dtype, shape)} 排布数据区，不需要真的有数组（生成超大假 checkpoint 时用）。
+    返回 (header 字节，已补齐对齐), 每个 tensor 的 entry, 数据区总长度
+    """
+    entries = {}
+    offset = 0
+    for name, (dtype, shape) in specs.items():
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        offset = _align_up(offset, align)
+        entries[name] = {"dtype": dtype.str, "shape": list(shape), "offset": offset, "nbytes": nbytes}
+        offset += nbytes
+
+    header = json.dumps({"tensors": entries, "metadata": metadata or {}}, separators=(",", ":")).encode()
+    # header 后面补空格，让数据区起点也对齐（JSON 里尾随空白是合法的）
+    data_start = _align_up(MAGIC_LEN.size + len(header), align)
+    header += b" " * (data_start - MAGIC_LEN.size - len(header))
+    return header, entries, offset
+
+def save(path: str, tensors: dict, metadata: dict = None, align: int = ALIGN):
+    """把 {name: ndarray} 写成容器文件；数组按 C 连续顺序原样写入，不做任何编码"""
+    arrays = {}
+    for name, a in tensors.items():
+        a = np.asarray(a)
+        if not a.flags.c_contiguous:
+            a = a.copy(order="C")  # 不用 ascontiguousarray：它会把 0 维标量变成 1 维
+        arrays[name] = a
+    header, entries, _ = build_header({k: (a.dtype, a.shape) for k, a in arrays.items()}, metadata, align)
+
+    with open(path, "wb") as f:
+        f.write(MAGIC_LEN.pack(len(header)))
+        f.write(header)
+        pos = 0
+        for name, a in arrays.items():
+            off = entries[name]["offset"]
+            if off > pos:
+                f.write(b"\0" * (off - pos))
+            f.write(a.data)
+            pos = off + a.nbytes
+
+
+class TensorFile:
+    """
+    只读加载器：打开时 mmap 整个文件但只解析 header（O(header) 而不是 O(文件大小)）。
+    tf[name] 第一次访问时在 mmap 上建 np.frombuffer 视图并缓存，不拷贝数据，数组是只读的。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (n,) = MAGIC_LEN.unpack_from(self._mm, 0)
+        header = json.loads(self._mm[MAGIC_LEN.size:MAGIC_LEN.size + n])
+        self.entries = header["tensors"]
+        self.metadata = header["metadata"]
+        self.data_start = MAGIC_LEN.size + n
+        self._cache = {}
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        a = self._cache.get(name)
+        if a is None:
+            e = self.entries[name]
+            dtype = np.dtype(e["dtype"])
+            a = np.frombuffer(self._mm, dtype=dtype, count=e["nbytes"] // dtype.itemsize,
+                              offset=self.data_start + e["offset"]).reshape(e["shape"])
+            self._cache[name] = a
+        return a
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def keys(self):
+        return self.entries.keys()
+
+    def close(self):
+        self._cache.clear()
+        try:
+            self._mm.close()
+        except BufferError:
+            # 外面还拿着视图：视图持有 mmap 的引用，等最后一个视图被回收时映射自然释放
+            pass
+        self._mm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--file", default="weights.tnsr")
+    parser.add_argument("--write", action="store_true")         # 先生成一个假的 checkpoint
+    parser.add_argument("--layers", type=int, default=24)
+    parser.add_argument("--dim", type=int, default=2048)
+    parser.add_argument("--touch", default="layers.0.w")        # 加载后只访问这一个 tensor
+    args = parser.parse_args()
+
+    if args.write:
+        rng = np.random.default_rng(0)
+        tensors = {f"layers.{i}.w": rng.standard_normal((args.dim, args.dim), dtype=np.float32).astype(np.float16)
+                   for i in range(args.layers)}
+        save(args.file, tensors, {"layers": args.layers, "dim": args.dim})
+        print(f"wrote {args.file}: {len(tensors)} tensors")
+
+    t0 = time.perf_counter()
+    tf = TensorFile(args.file)
+    t1 = time.perf_counter()
+    w = tf[args.touch]
+    s = float(w.sum(dtype=np.float32))  # 真正读这个 tensor，只有它的页会被缺页加载
+    t2 = time.perf_counter()
+    print(f"open (header only): {(t1 - t0) * 1000:.2f}ms, {len(tf)} tensors")
+    print(f"touch {args.touch} {w.shape} {w.dtype}: {(t2 - t1) * 1000:.2f}ms sum={s:.3f}")
+    del w
+    tf.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,35 @@
 import asyncio
+import json
+import math
+import os
 import time
+from collections import deque
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 
+# 响应缓存和 a5 用的是同一份实现（a5_profiling/cache.py），所以要在仓库根目录按包启动：uvicorn a4_fastapi_mock.app:app
+try:
+    from a5_profiling.cache import ResponseCache, normalize_key
+except ModuleNotFoundError as e:
+    raise ModuleNotFoundError(
+        "a4 用的是 a5_profiling/cache.py 里的 ResponseCache，请在仓库根目录启动：uvicorn a4_fastapi_mock.app:app") from e
+
 app = FastAPI(title="Inference Mock")
 
 # 限流
 MAX_CONCURRENCY = 429
 sem = asyncio.Semaphore(MAX_CONCURRENCY)
 
+# mock 后端的真实能力：同时在跑的请求超过这个数，每个请求都会按比例变慢（像 GPU 被打满）
+BACKEND_CAPACITY = 64
+backend_in_flight = 0
+
+# ADMISSION=0 时 /infer 退回原来的 semaphore 排队，用来对比过载时的 goodput
+ADMISSION = os.environ.get("ADMISSION", "1") != "0"
+# CACHE=0 关掉响应缓存
+CACHE = os.environ.get("CACHE", "1") != "0"
+
 # 请求/响应结构
 class InferRequest(BaseModel):
     prompt: str = Field(..., min_length=1, max_length=4000)
@@ -21,14 +42,28 @@ class InferResponse(BaseModel):
     prompt_tokens: int
     new_tokens: int
     latency_ms: int
+    cache: str = "miss"  # hit / miss / coalesced
+
+class StreamRequest(InferRequest):
+    prefill_ms: int = Field(200, ge=0, le=5000)   # 首 token 之前的 prefill 耗时，决定 TTFT
+    token_ms: int = Field(20, ge=0, le=1000)      # decode 阶段每个 token 的耗时，决定 ITL
+
+# 流式请求的计数：cancelled 是生成到一半客户端断开的
+stream_stats = {"started": 0, "completed": 0, "cancelled": 0, "timeout": 0}
 
 def fake_tokenize(s: str) -> int:
     # mock：粗略用空格拆分当 token 数
     return max(1, len(s.split()))
 
 async def mock_infer(req: InferRequest) -> str:
-    # mock：sleep一会儿模拟推理
-    await asyncio.sleep(req.latency_ms / 1000.0)
+    # mock：sleep一会儿模拟推理，后端过载时按 在跑数 / 容量 变慢
+    global backend_in_flight
+    backend_in_flight += 1
+    try:
+        slowdown = max(1.0, backend_in_flight / BACKEND_CAPACITY)
+        await asyncio.sleep(req.latency_ms / 1000.0 * slowdown)
+    finally:
+        backend_in_flight -= 1
     # mock：返回生成文本
     return req.prompt + " " + ("<tok> " * req.max_new_tokens).strip()
 
@@ -36,23 +71,311 @@ async def mock_infer(req: InferRequest) -> str:
 async def healthz():
     return {"ok": True}
 
+cache = ResponseCache(max_bytes=64 * 2**20, ttl=60.0)
+
+class Rejected(Exception):
+    """准入阶段直接拒绝：429 是我们主动丢负载，503 是熔断"""
+    def __init__(self, status: int, reason: str, retry_after: float):
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdaptiveLimiter:
+    """
+    并发上限自己调（AIMD）：
+    - 请求正常完成且没有明显变慢（实际耗时 / 预期耗时 <= tolerance）：limit += 1/limit，大约每轮 limit 个请求 +1
+    - 变慢或超时：limit *= backoff，两次减小之间至少隔一个平均服务时间，避免一批慢请求把 limit 砍到底
+    超过 limit 的请求进有界等待队列，队列满了直接 429，不再无限排队。
+    """
+    def __init__(self, initial: float = 32, min_limit: int = 4, max_limit: int = MAX_CONCURRENCY,
+                 max_queue: int = 128, tolerance: float = 1.5, backoff: float = 0.9):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.in_flight = 0
+        self.waiters = deque()
+        self.ewma_service = 0.1  # 秒，观测到的平均服务时间
+        self.last_decrease = 0.0
+
+    def expected_wait(self) -> float:
+        # 排在前面的请求按 limit 路并行消化，粗略估计还要等多久
+        if self.in_flight < int(self.limit) and not self.waiters:
+            return 0.0
+        return (len(self.waiters) + 1) * self.ewma_service / self.limit
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.expected_wait()))
+
+    async def acquire(self, deadline, cost: float):
+        """
+        deadline()：请求的截止时刻（perf_counter），排队期间可能变晚（合并进来的请求 deadline 更晚）；cost：这个请求预计要跑多久。
+        排队 + 执行肯定超过 deadline 的请求现在就拒掉，别等它占着队列最后再 504。
+        """
+        # 不用排队的请求也要先看可行性（这时 expected_wait 是 0）：本身就跑不完的放进去只会 504，还会被算成失败去砍 limit、开熔断
+        if cost > deadline() - time.perf_counter():
+            raise Rejected(429, "deadline infeasible", self.retry_after())
+        if self.in_flight < int(self.limit) and not self.waiters:
+            self.in_flight += 1
+            return
+        if len(self.waiters) >= self.max_queue:
+            raise Rejected(429, "queue full", self.retry_after())
+        if self.expected_wait() + cost > deadline() - time.perf_counter():
+            raise Rejected(429, "deadline infeasible", self.retry_after())
+
+        fut = asyncio.get_running_loop().create_future()
+        self.waiters.append(fut)
+        try:
+            # 用 asyncio.wait 而不是 wait_for：到点了不取消 fut，先看 deadline 有没有被推后，推后了接着等
+            while not fut.done():
+                left = deadline() - time.perf_counter() - cost
+                if left <= 0:
+                    break
+                await asyncio.wait({fut}, timeout=left)
+        except asyncio.CancelledError:
+            # 客户端断开：如果名额已经转给我们了，要还回去；没转过来就取消掉，_wake 会跳过它
+            if fut.done():
+                self.release()
+            else:
+                fut.cancel()
+            raise
+        if not fut.done():
+            fut.cancel()
+            try:
+                self.waiters.remove(fut)
+            except ValueError:
+                pass
+            raise Rejected(429, "queue wait exceeded deadline", self.retry_after())
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        # 名额直接转给队头的等待者（in_flight 在这里 +1），不会被新来的插队抢走
+        while self.waiters and self.in_flight < int(self.limit):
+            fut = self.waiters.popleft()
+            if fut.done():
+                continue
+            self.in_flight += 1
+            fut.set_result(None)
+
+    def on_result(self, elapsed: float, expected: float, failed: bool):
+        self.ewma_service = 0.9 * self.ewma_service + 0.1 * elapsed
+        now = time.perf_counter()
+        if failed or (expected > 0 and elapsed / expected > self.tolerance):
+            if now - self.last_decrease > self.ewma_service:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self.last_decrease = now
+        else:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._wake()
+
+class CircuitBreaker:
+    """
+    最近 window 秒内失败（超时 / 异常）比例超过 threshold 就打开，cooldown 秒内所有请求直接 503；
+    冷却后进入 half_open，放 probes 个请求试探：成功就关闭，失败重新打开。
+    主动拒绝的 429 不算失败，不然过载保护自己会把熔断打开。
+    """
+    def __init__(self, window: float = 10.0, min_requests: int = 20, threshold: float = 0.5,
+                 cooldown: float = 5.0, probes: int = 3):
+        self.window = window
+        self.min_requests = min_requests
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.probes = probes
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.probes_left = 0
+        self.events = deque()  # (t, ok)
+
+    def allow(self):
+        now = time.perf_counter()
+        if self.state == "open":
+            if now - self.opened_at < self.cooldown:
+                raise Rejected(503, "circuit open", math.ceil(self.cooldown - (now - self.opened_at)))
+            self.state = "half_open"
+            self.probes_left = self.probes
+        if self.state == "half_open":
+            if self.probes_left <= 0:
+                raise Rejected(503, "circuit half-open", 1)
+            self.probes_left -= 1
+            return True  # 这个请求占了一个试探名额
+        return False
+
+    def return_probe(self):
+        # 试探请求没走到后端（准入 429、客户端断开），record 不会被调用，名额要还回去，不然 half_open 会一直 503
+        if self.state == "half_open":
+            self.probes_left = min(self.probes, self.probes_left + 1)
+
+    def record(self, ok: bool):
+        now = time.perf_counter()
+        if self.state == "half_open":
+            if ok:
+                self.state = "closed"
+                self.events.clear()
+            else:
+                self._open(now)
+            return
+        self.events.append((now, ok))
+        while self.events and now - self.events[0][0] > self.window:
+            self.events.popleft()
+        fails = sum(1 for _, e_ok in self.events if not e_ok)
+        if len(self.events) >= self.min_requests and fails / len(self.events) > self.threshold:
+            self._open(now)
+
+    def _open(self, now: float):
+        self.state = "open"
+        self.opened_at = now
+        self.events.clear()
+
+limiter = AdaptiveLimiter()
+breaker = CircuitBreaker()
+admission_stats = {"ok": 0, "timeout": 0, "queue full": 0, "deadline infeasible": 0,
+                   "queue wait exceeded deadline": 0, "circuit open": 0, "circuit half-open": 0}
+
+@app.exception_handler(Rejected)
+async def rejected_handler(request, exc: Rejected):
+    admission_stats[exc.reason] += 1
+    return JSONResponse(status_code=exc.status, content={"detail": exc.reason},
+                        headers={"Retry-After": str(int(exc.retry_after))})
+
+async def compute(req: InferRequest, deadline) -> str:
+    """
+    deadline() 返回这次计算的截止时刻（perf_counter）：走缓存时是所有在等这次计算的请求里最晚的那个，会随着有人加入 / 离开变化。
+    这里不自己设推理超时：等的请求都走了（不走缓存时是外面的 wait_for 到点），计算会被取消
+    """
+    if ADMISSION:
+        # 熔断 -> 准入（有界队列 + deadline 可行性）-> 执行，整个请求用 timeout_ms 作为端到端 deadline
+        probe = breaker.allow()
+        expected = req.latency_ms / 1000.0
+        try:
+            await limiter.acquire(deadline, expected)
+        except BaseException:
+            if probe:
+                breaker.return_probe()
+            raise
+        t_run = time.perf_counter()
+        try:
+            text = await mock_infer(req)
+        except asyncio.CancelledError:
+            # 到了 deadline 还没算完，没人再等结果了
+            limiter.on_result(time.perf_counter() - t_run, expected, failed=True)
+            breaker.record(False)
+            admission_stats["timeout"] += 1
+            raise
+        finally:
+            limiter.release()
+        limiter.on_result(time.perf_counter() - t_run, expected, failed=False)
+        breaker.record(True)
+        admission_stats["ok"] += 1
+        return text
+
+    # 并发限流：拿不到就排队等；单次推理的硬上限就是 deadline，到点被取消，慢请求不会一直占着名额
+    async with sem:
+        return await mock_infer(req)
+
 @app.post("/infer", response_model=InferResponse)
 async def infer(req: InferRequest):
     start = time.perf_counter()
+    deadline = start + req.timeout_ms / 1000.0
+
+    try:
+        if CACHE:
+            # 相同请求直接拿缓存，或者一起等正在算的那一次；只有 miss 的那个请求会走准入、占后端。
+            # timeout 只管这个请求自己等多久，计算本身按所有等待者里最晚的 deadline 来
+            text, source = await cache.get_or_compute(
+                normalize_key(req.prompt, req.max_new_tokens),
+                lambda shared_deadline: compute(req, shared_deadline),
+                timeout=req.timeout_ms / 1000.0,
+            )
+        else:
+            text, source = await asyncio.wait_for(compute(req, lambda: deadline), req.timeout_ms / 1000.0), "miss"
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="inference timeout")
 
-    # 并发限流：拿不到就排队等
-    async with sem:
-        try:
-            # timeout
-            # 给单次推理一个硬上限，防止慢请求无限占资源
-            text = await asyncio.wait_for(mock_infer(req), timeout=req.timeout_ms / 1000.0)
-        except asyncio.TimeoutError:
-            raise HTTPException(status_code=504, detail="inference timeout")
-        
     latency_ms = int((time.perf_counter() - start) * 1000)
     return InferResponse(
         text=text,
         prompt_tokens=fake_tokenize(req.prompt),
         new_tokens=req.max_new_tokens,
         latency_ms=latency_ms,
-    )
\ No newline at end of file
+        cache=source,
+    )
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {"enabled": CACHE, **cache.snapshot()}
+
+@app.get("/admission/stats")
+async def admission():
+    return {
+        "enabled": ADMISSION,
+        "limit": round(limiter.limit, 2),
+        "in_flight": limiter.in_flight,
+        "queued": len(limiter.waiters),
+        "ewma_service_ms": round(limiter.ewma_service * 1000, 1),
+        "breaker": breaker.state,
+        "backend_in_flight": backend_in_flight,
+        "counts": admission_stats,
+    }
+
+def sse(event: str, data: dict) -> str:
+    # SSE 格式：每个事件是 event/data 两行，空行结尾
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_tokens(req: StreamRequest, start: float):
+    """
+    先 sleep prefill_ms 再逐个吐 token，每个 token 间隔 token_ms。
+    时间戳都是服务端的：ttft = 第一个 token 发出时刻 - 请求进来的时刻，itl = 相邻 token 的间隔。
+    客户端断开时 starlette 会 cancel 正在迭代这个生成器的任务，CancelledError 打断当前的 sleep，生成立刻停止，
+    不会像 /infer 那样把整段 latency 睡完（ASGI spec 2.4 的 server 要等下一次 send 失败才发现断开）。
+    """
+    stream_stats["started"] += 1
+    deadline = start + req.timeout_ms / 1000.0
+    emitted = []
+    try:
+        async with sem:
+            await asyncio.sleep(req.prefill_ms / 1000.0)
+            for i in range(req.max_new_tokens):
+                if i:
+                    await asyncio.sleep(req.token_ms / 1000.0)
+                now = time.perf_counter()
+                if now > deadline:
+                    # 已经发出去的 token 收不回来了，只能发个 error 事件告诉客户端后面没了
+                    stream_stats["timeout"] += 1
+                    yield sse("error", {"detail": "inference timeout", "new_tokens": len(emitted)})
+                    return
+                emitted.append(now)
+                yield sse("token", {"index": i, "token": "<tok>", "t_ms": round((now - start) * 1000, 2)})
+    except asyncio.CancelledError:
+        stream_stats["cancelled"] += 1
+        raise
+
+    itl = sorted((b - a) * 1000 for a, b in zip(emitted, emitted[1:]))
+    stream_stats["completed"] += 1
+    yield sse("done", {
+        "prompt_tokens": fake_tokenize(req.prompt),
+        "new_tokens": len(emitted),
+        "ttft_ms": round((emitted[0] - start) * 1000, 2),
+        "itl_p50_ms": round(itl[len(itl) // 2], 2) if itl else 0.0,
+        "itl_p99_ms": round(itl[min(len(itl) - 1, int(len(itl) * 0.99))], 2) if itl else 0.0,
+        "itl_max_ms": round(itl[-1], 2) if itl else 0.0,
+        "latency_ms": round((time.perf_counter() - start) * 1000, 2),
+    })
+
+@app.post("/infer/stream")
+async def infer_stream(req: StreamRequest):
+    start = time.perf_counter()
+    return StreamingResponse(
+        stream_tokens(req, start),
+        media_type="text/event-stream",
+        # 关掉代理缓冲（nginx），不然 token 会被攒成一大块才发出去，TTFT 就没意义了
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/infer/stream/stats")
+async def infer_stream_stats():
+    return stream_stats
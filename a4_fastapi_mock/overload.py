@@ -0,0 +1,63 @@
+import time
+import random
+import asyncio
+import argparse
+from collections import Counter
+
+import httpx
+
+
+async def one(client, url: str, body: dict, results: list):
+    t0 = time.perf_counter()
+    try:
+        r = await client.post(url, json=body)
+        status = r.status_code
+    except httpx.HTTPError:
+        status = "conn_error"
+    results.append((status, (time.perf_counter() - t0) * 1000))
+
+async def run(url: str, rate: float, duration: float, latency_ms: int, timeout_ms: int, seed: int):
+    """开环 Poisson 发压：按固定到达率发请求，不等上一个返回（和真实用户一样不管服务器忙不忙）"""
+    rng = random.Random(seed)
+    body = {"prompt": "hello", "max_new_tokens": 16, "latency_ms": latency_ms, "timeout_ms": timeout_ms}
+    results, tasks = [], []
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    # 客户端超时比 timeout_ms 宽一点，服务端的 504 / 429 才能回得来
+    async with httpx.AsyncClient(limits=limits, timeout=timeout_ms / 1000.0 + 5) as client:
+        t0 = time.perf_counter()
+        t_next = t0
+        while t_next - t0 < duration:
+            t_next += rng.expovariate(rate)
+            delay = t_next - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(one(client, url, body, results)))
+        await asyncio.gather(*tasks)
+    return results
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000/infer")
+    parser.add_argument("--rate", type=float, default=1500.0)      # 请求/秒
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--latency-ms", type=int, default=80)
+    parser.add_argument("--timeout-ms", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.url, args.rate, args.duration, args.latency_ms, args.timeout_ms, args.seed))
+    counts = Counter(s for s, _ in results)
+    # goodput：在 timeout_ms 之内拿到 200 的请求；超时之后才返回的 200 对用户没有意义
+    good = [ms for s, ms in results if s == 200 and ms <= args.timeout_ms]
+    print(f"sent={len(results)} offered={args.rate:.0f}/s status={dict(counts)}")
+    print(f"goodput={len(good) / args.duration:.1f}/s "
+          f"ok p50={percentile(good, 50):.0f}ms p99={percentile(good, 99):.0f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,35 @@
+import asyncio
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+
+from . import prom
+from .tracing import TraceMiddleware
 
 app = FastAPI(title="Inference Mock")
+# 按 TRACE_SAMPLE 采样记录请求的各阶段，/debug/trace 导出
+app.add_middleware(TraceMiddleware)
+# 所有路由的 Prometheus 指标；后加的在最外层，耗时包含 tracing 中间件
+app.add_middleware(prom.PromMiddleware)
 
 # 导入并注册路由
-from .routes import infer, batch
+from .routes import infer, batch, debug
 infer.register_routes(app)
 batch.register_routes(app)
+debug.register_routes(app)
 
 
 @app.get("/healthz")
 async def healthz():
     return {"ok": True}
+
+
+@app.get("/metrics")
+async def metrics():
+    # Prometheus 文本格式；原来的 JSON 挪到了 /metrics/json
+    return PlainTextResponse(prom.registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.on_event("startup")
+async def _start_prom_flush():
+    if prom.MULTIPROC_DIR:
+        asyncio.create_task(prom.flush_loop())
@@ -0,0 +1,119 @@
+import time
+from collections import deque
+
+
+class BatchAutoTuner:
+    """
+    根据最近一个窗口的 p99、吞吐、排队深度和批填充率，调 BATCH_SIZE / MAX_BATCH_WAIT_MS：
+    - p99 超标且有积压（排队的比一批还多）：瓶颈是吞吐，排队时间占大头 -> 批大小直接翻倍；已经是最大批了就不动（到容量了）
+    - 积压刚消化完的那个窗口：p99 还是被之前排队的请求拉高的，不代表当前配置，不动
+    - p99 超标但没积压：瓶颈是单批耗时 / 凑批等待 -> 先缩等待窗口，缩到底了再缩批
+    - p99 有余量（< headroom * target）且有积压 -> 加大批，吃掉积压
+    - p99 有余量、没积压、批经常凑不满 -> 适当拉长等待窗口，提高每批的填充率
+    - 其它情况（死区）不动
+    迟滞：往"更激进"方向（加批、加等待）要连续 patience 个窗口都这么判断才执行，往保守方向立刻执行；
+    每次调整后冷却一个窗口（那个窗口的数据混着新旧两种配置）。
+    护栏：批大小、等待窗口都夹在上下限里，除了救火的翻倍，每次最多改 25% / 一半，样本不够不做决定。
+    """
+    def __init__(self, p99_target_ms: float = 500.0, min_batch: int = 1, max_batch: int = 32,
+                 min_wait_ms: int = 1, max_wait_ms: int = 200, window_s: float = 1.0,
+                 min_samples: int = 10, headroom: float = 0.8, patience: int = 2, history: int = 100):
+        self.p99_target_ms = p99_target_ms
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.min_wait_ms = min_wait_ms
+        self.max_wait_ms = max_wait_ms
+        self.window_s = window_s
+        self.min_samples = min_samples
+        self.headroom = headroom
+        self.patience = patience
+        self.streak_action = None
+        self.streak = 0
+        self.cooldown = 0
+        self.had_backlog = False
+        self.decisions = deque(maxlen=history)
+
+    def decide(self, p99_ms: float, qps: float, queue_depth: int, fill: float, samples: int,
+               batch_size: int, wait_ms: int):
+        """返回新的 (batch_size, wait_ms)，同时把这次决定记进 decisions"""
+        action, reason = "hold", ""
+        backlog = queue_depth >= batch_size
+        draining, self.had_backlog = self.had_backlog and not backlog, backlog
+        if self.cooldown > 0:
+            self.cooldown -= 1
+            reason = "cooldown after change"
+        elif samples < self.min_samples:
+            reason = f"only {samples} samples in window"
+        elif p99_ms > self.p99_target_ms:
+            if backlog:
+                if batch_size < self.max_batch:
+                    action, reason = "double_batch", "p99 over target with backlog: throughput bound"
+                else:
+                    # 已经是最大批还在积压，说明到容量了；这时候缩批只会更慢、积压更多
+                    reason = "at capacity: p99 over target with backlog, batch already at max"
+            elif draining:
+                reason = "backlog just drained, p99 still from queueing"
+            elif wait_ms > self.min_wait_ms:
+                action, reason = "shrink_wait", "p99 over target without backlog: waiting adds latency"
+            elif batch_size > self.min_batch:
+                action, reason = "shrink_batch", "p99 over target, wait already at minimum"
+            else:
+                reason = "p99 over target but all knobs at limits"
+        elif p99_ms < self.headroom * self.p99_target_ms:
+            if backlog and batch_size < self.max_batch:
+                action, reason = "grow_batch", "headroom with backlog"
+            elif not backlog and fill < 0.5 and wait_ms < self.max_wait_ms:
+                action, reason = "grow_wait", "headroom, batches under half full"
+            else:
+                reason = "headroom, nothing to gain"
+        else:
+            reason = "p99 within dead band"
+
+        # 激进方向要连续 patience 个窗口确认；p99 超标时加批是在救火，也立刻执行
+        aggressive = action in ("grow_batch", "grow_wait") and p99_ms <= self.p99_target_ms
+        if aggressive:
+            self.streak = self.streak + 1 if self.streak_action == action else 1
+            self.streak_action = action
+            if self.streak < self.patience:
+                reason += f" (waiting {self.streak}/{self.patience})"
+                action = "hold"
+        else:
+            self.streak_action, self.streak = None, 0
+
+        new_bs, new_wait = batch_size, wait_ms
+        if action == "grow_batch":
+            new_bs = min(self.max_batch, batch_size + max(1, batch_size // 4))
+        elif action == "double_batch":
+            new_bs = min(self.max_batch, batch_size * 2)
+        elif action == "shrink_batch":
+            new_bs = max(self.min_batch, batch_size * 3 // 4)
+        elif action == "shrink_wait":
+            new_wait = max(self.min_wait_ms, wait_ms // 2)
+        elif action == "grow_wait":
+            new_wait = min(self.max_wait_ms, max(wait_ms + 1, wait_ms * 3 // 2))
+        if (new_bs, new_wait) != (batch_size, wait_ms):
+            self.cooldown = 1
+            self.streak_action, self.streak = None, 0
+
+        self.decisions.append({
+            "t": round(time.time(), 3),
+            "p99_ms": round(p99_ms, 1),
+            "qps": round(qps, 2),
+            "queue_depth": queue_depth,
+            "fill": round(fill, 2),
+            "samples": samples,
+            "action": action,
+            "reason": reason,
+            "batch_size": new_bs,
+            "max_wait_ms": new_wait,
+        })
+        return new_bs, new_wait
+
+    def snapshot(self, last: int = 20) -> dict:
+        return {
+            "p99_target_ms": self.p99_target_ms,
+            "batch_range": [self.min_batch, self.max_batch],
+            "wait_range_ms": [self.min_wait_ms, self.max_wait_ms],
+            "window_s": self.window_s,
+            "decisions": list(self.decisions)[-last:],
+        }
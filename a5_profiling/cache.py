@@ -0,0 +1,146 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict
+
+
+def normalize_key(prompt: str, max_new_tokens: int):
+    # 输出只由 prompt 和 max_new_tokens 决定；latency_ms / timeout_ms 这些只影响调度的字段不进 key。
+    # prompt 不做空白归一化：mock 会把 prompt 原样拼进输出，归一化之后会把别人的原文返回回去
+    return (prompt, max_new_tokens)
+
+def _nbytes(obj) -> int:
+    # 粗略估计缓存条目占多少字节：只数字符串 / bytes 的内容，够用来做上限
+    if isinstance(obj, str):
+        return len(obj.encode())
+    if isinstance(obj, (bytes, bytearray)):
+        return len(obj)
+    if isinstance(obj, (tuple, list)):
+        return sum(_nbytes(x) for x in obj)
+    if isinstance(obj, dict):
+        return sum(_nbytes(k) + _nbytes(v) for k, v in obj.items())
+    return 8
+
+
+class _Flight:
+    """一次正在进行的计算，和在等它的请求各自的 deadline（perf_counter 时间）"""
+    __slots__ = ("task", "deadlines")
+
+    def __init__(self):
+        self.task = None
+        self.deadlines = []
+
+    def deadline(self) -> float:
+        # 计算本身按还在等的请求里最晚的那个 deadline 来，不跟着发起它的那个请求走
+        return max(self.deadlines, default=0.0)
+
+
+class ResponseCache:
+    """
+    推理结果缓存：
+    - OrderedDict 做 LRU，总字节数超过 max_bytes 就从最久没用的开始淘汰
+    - 每条带 TTL，过期的在读到时删掉
+    - single-flight：同一个 key 正在算的时候，后来的请求不再打后端，而是一起等那一次计算
+    计算放在独立的 task 里，大家 await shield(task)：发起计算的那个客户端超时 / 断开了，其它等待者照样拿到结果，结果也照样进缓存；
+    等的人全走了就把计算取消掉，不让没人要的计算继续占着并发名额
+    """
+    def __init__(self, max_bytes: int = 64 * 2**20, ttl: float = 60.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (value, nbytes, expires_at)
+        self.bytes = 0
+        self.inflight = {}            # key -> _Flight
+        # coalesced 只数等到了结果的；等的那次计算失败了（超时、被拒绝）记 coalesced_failed，不算命中
+        self.counts = {"hits": 0, "misses": 0, "coalesced": 0, "coalesced_failed": 0, "evictions": 0, "expired": 0}
+
+    def get(self, key):
+        e = self.entries.get(key)
+        if e is None:
+            return None
+        value, nbytes, expires_at = e
+        if time.monotonic() >= expires_at:
+            self._remove(key)
+            self.counts["expired"] += 1
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        nbytes = _nbytes(key) + _nbytes(value)
+        if nbytes > self.max_bytes:
+            return  # 单条比整个缓存还大，不缓存
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (value, nbytes, time.monotonic() + self.ttl)
+        self.bytes += nbytes
+        while self.bytes > self.max_bytes:
+            old, _ = next(iter(self.entries.items()))
+            self._remove(old)
+            self.counts["evictions"] += 1
+
+    def _remove(self, key):
+        _, nbytes, _ = self.entries.pop(key)
+        self.bytes -= nbytes
+
+    async def get_or_compute(self, key, factory, timeout: float = None):
+        """
+        返回 (value, source)，source 是 hit / miss / coalesced。
+        factory(deadline) 是 async 函数，deadline() 返回当前所有等待者里最晚的 deadline，准入、超时按它算；
+        timeout 是当前这个请求自己愿意等多久（到了抛 asyncio.TimeoutError，只影响自己，除非它是最后一个等待者）
+        """
+        value = self.get(key)
+        if value is not None:
+            self.counts["hits"] += 1
+            return value, "hit"
+
+        flight = self.inflight.get(key)
+        if flight is not None:
+            source = "coalesced"
+        else:
+            self.counts["misses"] += 1
+            source = "miss"
+            flight = _Flight()
+            flight.task = asyncio.create_task(self._run(key, factory, flight))
+            # 所有等待者都走了的话没人取异常，这里取一下，免得打 "exception was never retrieved"
+            flight.task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self.inflight[key] = flight
+
+        deadline = time.perf_counter() + timeout if timeout is not None else math.inf
+        flight.deadlines.append(deadline)
+        try:
+            value = await asyncio.wait_for(asyncio.shield(flight.task), timeout)
+        except BaseException:
+            if source == "coalesced":
+                self.counts["coalesced_failed"] += 1
+            raise
+        finally:
+            flight.deadlines.remove(deadline)
+            if not flight.deadlines and not flight.task.done():
+                # 没人等了：取消计算，并且马上从 inflight 摘掉，免得后来的请求合并到一个正在取消的 task 上
+                flight.task.cancel()
+                if self.inflight.get(key) is flight:
+                    del self.inflight[key]
+        if source == "coalesced":
+            self.counts["coalesced"] += 1
+        return value, source
+
+    async def _run(self, key, factory, flight: _Flight):
+        try:
+            value = await factory(flight.deadline)
+            self.put(key, value)
+            return value
+        finally:
+            if self.inflight.get(key) is flight:
+                del self.inflight[key]
+
+    def snapshot(self) -> dict:
+        lookups = sum(self.counts[k] for k in ("hits", "misses", "coalesced", "coalesced_failed"))
+        return {
+            **self.counts,
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "inflight": len(self.inflight),
+            # coalesced 也算没打到后端
+            "hit_rate": round((self.counts["hits"] + self.counts["coalesced"]) / lookups, 3) if lookups else 0.0,
+        }
@@ -0,0 +1,157 @@
+from collections import deque
+
+
+class BlockAllocator:
+    """固定大小的 block 池，空闲链表分配；block 之间不需要连续，所以没有外部碎片"""
+    def __init__(self, num_blocks: int):
+        self.num_blocks = num_blocks
+        self.free_list = deque(range(num_blocks))
+
+    @property
+    def num_free(self) -> int:
+        return len(self.free_list)
+
+    def allocate(self, n: int):
+        if n > len(self.free_list):
+            return None
+        return [self.free_list.popleft() for _ in range(n)]
+
+    def free(self, blocks):
+        self.free_list.extend(blocks)
+
+
+class PagedKVCache:
+    """
+    模拟 vLLM 式的 paged KV cache：
+    - 显存预算切成 num_blocks 个 block，每个 block 放 block_size 个 token 的 KV
+    - 每个请求一张 block table（逻辑 block -> 物理 block），token 数涨过 block 边界时才追加一个 block
+    - 显存不够时可以把整个请求的 block 换出到 CPU swap 空间（swap_blocks 个），之后再换回来
+    只做簿记不存数据；单线程（事件循环里）使用
+    """
+    def __init__(self, num_blocks: int, block_size: int = 16, swap_blocks: int = 0, watermark: float = 0.01):
+        self.block_size = block_size
+        self.gpu = BlockAllocator(num_blocks)
+        self.cpu = BlockAllocator(swap_blocks)
+        # 新请求准入时至少留这么多空闲 block，给正在跑的请求 decode 时追加用，减少刚进来就被抢占
+        self.watermark_blocks = int(num_blocks * watermark)
+        self.tables = {}    # seq_id -> [gpu block]
+        self.tokens = {}    # seq_id -> 已占用的 token 数
+        self.swapped = {}   # seq_id -> [cpu block]
+        self.peak_used = 0
+        self.samples = 0
+        self.util_sum = 0.0
+        self.frag_sum = 0.0
+        self.counts = {"admitted": 0, "admit_blocked": 0, "preempt_swap": 0, "preempt_recompute": 0,
+                       "swap_in": 0, "swapped_blocks": 0}
+
+    def blocks_for(self, n_tokens: int) -> int:
+        return (n_tokens + self.block_size - 1) // self.block_size
+
+    def can_admit(self, n_tokens: int) -> bool:
+        ok = self.blocks_for(n_tokens) + self.watermark_blocks <= self.gpu.num_free
+        if not ok:
+            self.counts["admit_blocked"] += 1
+        return ok
+
+    def fits_at_all(self, n_tokens: int) -> bool:
+        # 一个请求用满显存都放不下，排多久也没用。和 can_admit / can_swap_in 一样要留 watermark，
+        # 不然差那几个 block 的请求过了这关、却永远准入不了
+        return self.blocks_for(n_tokens) + self.watermark_blocks <= self.gpu.num_blocks
+
+    def allocate(self, seq_id, n_tokens: int) -> bool:
+        blocks = self.gpu.allocate(self.blocks_for(n_tokens))
+        if blocks is None:
+            return False
+        self.tables[seq_id] = blocks
+        self.tokens[seq_id] = n_tokens
+        self.counts["admitted"] += 1
+        self._track()
+        return True
+
+    def free_slots(self, seq_id) -> int:
+        # 最后一个 block 里还能放几个 token，0 表示下一个 token 要新 block
+        return len(self.tables[seq_id]) * self.block_size - self.tokens[seq_id]
+
+    def append_slots(self, seq_id, k: int = 1) -> bool:
+        """decode 出 k 个新 token；跨过 block 边界就追加 block，申请不到返回 False（调用方去抢占）"""
+        n = self.tokens[seq_id] + k
+        need = self.blocks_for(n) - len(self.tables[seq_id])
+        if need > 0:
+            blocks = self.gpu.allocate(need)
+            if blocks is None:
+                return False
+            self.tables[seq_id].extend(blocks)
+            self._track()
+        self.tokens[seq_id] = n
+        return True
+
+    def free(self, seq_id):
+        self.gpu.free(self.tables.pop(seq_id, ()))
+        self.tokens.pop(seq_id, None)
+        self.cpu.free(self.swapped.pop(seq_id, ()))
+
+    def swap_out(self, seq_id) -> bool:
+        """把请求的 KV 整个挪到 CPU：成功的话恢复时不用重算；swap 空间不够返回 False"""
+        n = len(self.tables[seq_id])
+        cpu_blocks = self.cpu.allocate(n)
+        if cpu_blocks is None:
+            return False
+        self.gpu.free(self.tables.pop(seq_id))
+        self.swapped[seq_id] = cpu_blocks
+        self.counts["preempt_swap"] += 1
+        self.counts["swapped_blocks"] += n
+        return True
+
+    def preempt_recompute(self, seq_id):
+        # 换不出去就直接丢掉 KV，恢复时从 prompt 重新 prefill
+        self.gpu.free(self.tables.pop(seq_id))
+        self.tokens.pop(seq_id, None)
+        self.counts["preempt_recompute"] += 1
+
+    def can_swap_in(self, seq_id) -> bool:
+        return len(self.swapped[seq_id]) + self.watermark_blocks <= self.gpu.num_free
+
+    def swap_in(self, seq_id) -> bool:
+        blocks = self.gpu.allocate(len(self.swapped[seq_id]))
+        if blocks is None:
+            return False
+        self.cpu.free(self.swapped.pop(seq_id))
+        self.tables[seq_id] = blocks
+        self.counts["swap_in"] += 1
+        self._track()
+        return True
+
+    def _track(self):
+        self.peak_used = max(self.peak_used, self.gpu.num_blocks - self.gpu.num_free)
+
+    def _usage(self):
+        used = self.gpu.num_blocks - self.gpu.num_free
+        stored = sum(self.tokens[s] for s in self.tables)
+        util = used / self.gpu.num_blocks if self.gpu.num_blocks else 0.0
+        # 内部碎片：已分配 block 里没放 token 的槽位占比（只有每个请求最后一个 block 会有空位）
+        frag = 1 - stored / (used * self.block_size) if used else 0.0
+        return used, util, frag
+
+    def sample(self):
+        # 每个 decode step 采一次，算运行期间的平均利用率（空闲时的瞬时值没什么意义）
+        _, util, frag = self._usage()
+        self.samples += 1
+        self.util_sum += util
+        self.frag_sum += frag
+
+    def snapshot(self) -> dict:
+        used, util, frag = self._usage()
+        return {
+            **self.counts,
+            "block_size": self.block_size,
+            "num_blocks": self.gpu.num_blocks,
+            "used_blocks": used,
+            "peak_used_blocks": self.peak_used,
+            "utilization": round(util, 3),
+            "internal_fragmentation": round(frag, 3),
+            "mean_utilization": round(self.util_sum / self.samples, 3) if self.samples else 0.0,
+            "mean_internal_fragmentation": round(self.frag_sum / self.samples, 3) if self.samples else 0.0,
+            "running_seqs": len(self.tables),
+            "swapped_seqs": len(self.swapped),
+            "swap_free_blocks": self.cpu.num_free,
+        }
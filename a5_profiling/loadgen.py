@@ -0,0 +1,286 @@
+"""
+独立进程的开环压测，替代 /batch/test（它在服务进程里发压、会换掉全局 stats / BATCH_SIZE、清空共享队列，还是一次性的闭环突发）：
+    python -m a5_profiling.loadgen --target batch --rates 20,40,80,160 --batch-configs 4:50,8:50,16:20 --out report
+- 按固定间隔或 Poisson 到达发请求，不等上一个返回；连接池复用 keep-alive 连接（--connections 个）
+- coordinated omission 校正：延迟从"计划发出的时刻"算起，而不是从真正发到网络上的时刻。
+  连接池满了、压测进程自己卡了，请求晚发出去的那段时间也算进延迟（用户可不会因为服务器忙就晚点来）；
+  同时报一份从真正发出（httpcore 开始写请求头）算的延迟做对比，两者差得多说明压测端或连接池成了瓶颈
+- 扫 到达率 × 批配置（/batch/config 的 batch_size:max_wait_ms），每格先预热再测，输出 JSON + 带吞吐-p99 曲线的 HTML，标出饱和拐点
+"""
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+from collections import Counter
+
+import httpx
+
+from .metrics import LogHistogram
+
+TARGETS = {"infer": "/infer", "batch": "/batch/infer_one", "stream": "/infer/stream"}
+
+
+def make_body(args, rng: random.Random) -> dict:
+    # prompt 带个随机数，别让 /infer 的响应缓存把请求全吃掉
+    body = {"prompt": f"{args.prompt} {rng.randrange(10**9)}", "max_new_tokens": args.max_new_tokens,
+            "latency_ms": args.latency_ms, "timeout_ms": args.timeout_ms}
+    if args.target == "stream":
+        body.update(prefill_ms=args.prefill_ms, token_ms=args.token_ms)
+    return body
+
+
+class Cell:
+    """一格（一个到达率 × 一个批配置）的结果；延迟都放进 LogHistogram，多少请求内存都一样"""
+    def __init__(self):
+        self.counts = Counter()
+        self.corrected = LogHistogram()  # 计划发出 -> 收完响应
+        self.service = LogHistogram()    # 真正发出 -> 收完响应（没做校正的，闭环压测工具报的就是这个）
+        self.ttft = LogHistogram()       # 流式：计划发出 -> 第一块数据
+        self.send_lag = LogHistogram()   # 计划发出 -> 真正发出
+        self.ok = 0
+        self.good = 0
+
+    def record(self, status, intended: float, wire: float, first: float, done: float, slo_ms: float):
+        self.counts[str(status)] += 1
+        if status != 200:
+            return
+        ms = (done - intended) * 1000
+        self.ok += 1
+        self.good += ms <= slo_ms
+        self.corrected.add(ms)
+        self.service.add((done - (wire or intended)) * 1000)
+        self.send_lag.add(((wire or intended) - intended) * 1000)
+        if first:
+            self.ttft.add((first - intended) * 1000)
+
+
+async def send_one(client: httpx.AsyncClient, path: str, body: dict, stream: bool, intended: float,
+                   cell: Cell, slo_ms: float):
+    times = {"wire": 0.0, "first": 0.0}
+
+    async def trace(event: str, info: dict):
+        # httpcore 开始写请求头 = 真正拿到连接发出去了（之前可能在等连接池）
+        if event == "http11.send_request_headers.started":
+            times["wire"] = time.perf_counter()
+
+    try:
+        if stream:
+            async with client.stream("POST", path, json=body, extensions={"trace": trace}) as r:
+                status = r.status_code
+                async for _ in r.aiter_bytes():
+                    if not times["first"]:
+                        times["first"] = time.perf_counter()
+        else:
+            r = await client.post(path, json=body, extensions={"trace": trace})
+            status = r.status_code
+    except httpx.TimeoutException:
+        status = "client_timeout"
+    except httpx.HTTPError:
+        status = "conn_error"
+    if cell is not None:
+        cell.record(status, intended, times["wire"], times["first"], time.perf_counter(), slo_ms)
+
+
+async def run_cell(client: httpx.AsyncClient, args, rate: float, rng: random.Random) -> Cell:
+    """按计划时刻表开环发压：前 warmup 秒的请求照发但不计入结果"""
+    path = TARGETS[args.target]
+    cell = Cell()
+    tasks = []
+    t0 = time.perf_counter()
+    t_measure = t0 + args.warmup
+    t_end = t_measure + args.duration
+    t_next = t0
+    while t_next < t_end:
+        delay = t_next - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        record = cell if t_next >= t_measure else None
+        tasks.append(asyncio.create_task(send_one(client, path, make_body(args, rng), args.target == "stream",
+                                                  t_next, record, args.slo_ms)))
+        t_next += rng.expovariate(rate) if args.arrival == "poisson" else 1.0 / rate
+    await asyncio.gather(*tasks)
+    return cell
+
+
+def summarize(cell: Cell, rate: float, duration: float) -> dict:
+    c, s = cell.corrected, cell.service
+    p50, p90, p99, p999 = c.percentiles(50, 90, 99, 99.9)
+    s50, s99 = s.percentiles(50, 99)
+    out = {
+        "target_rps": rate,
+        # 实际发出的速率（Poisson 在几秒的窗口里会偏离目标值不少），拐点按它来判断吞吐跟没跟上
+        "offered_rps": round(sum(cell.counts.values()) / duration, 2),
+        "throughput_rps": round(cell.ok / duration, 2),
+        "goodput_rps": round(cell.good / duration, 2),
+        "status": dict(cell.counts),
+        "p50_ms": round(p50, 1), "p90_ms": round(p90, 1), "p99_ms": round(p99, 1), "p999_ms": round(p999, 1),
+        "uncorrected_p50_ms": round(s50, 1), "uncorrected_p99_ms": round(s99, 1),
+        "send_lag_p99_ms": round(cell.send_lag.percentile(99), 1),
+    }
+    if cell.ttft.count:
+        out["ttft_p50_ms"], out["ttft_p99_ms"] = (round(x, 1) for x in cell.ttft.percentiles(50, 99))
+    return out
+
+
+def find_knee(points: list, latency_factor: float = 2.0, min_ratio: float = 0.95):
+    """
+    饱和拐点：按到达率从小到大，吞吐和 goodput 都还跟得上实际发出速率（>= min_ratio）、p99 还没超过最低到达率时 p99 的
+    latency_factor 倍的最后一个点；再往上加压只会排队，吞吐不涨、p99 起飞。
+    goodput 那条是防止最低的到达率就已经过载（这时 p99 基准本身就是排队排出来的）
+    """
+    pts = sorted(points, key=lambda p: p["target_rps"])
+    if not pts:
+        return None
+    base = max(pts[0]["p99_ms"], 1.0)
+    knee = None
+    for p in pts:
+        if (p["throughput_rps"] < min_ratio * p["offered_rps"] or p["goodput_rps"] < min_ratio * p["offered_rps"]
+                or p["p99_ms"] > latency_factor * base):
+            break
+        knee = p
+    return knee
+
+
+def svg_chart(series: dict, knees: dict, width: int = 720, height: int = 420) -> str:
+    """吞吐（x）- p99（y，对数坐标）曲线，每个批配置一条线，拐点画个圈"""
+    colors = ["#1f77b4", "#d62728", "#2ca02c", "#ff7f0e", "#9467bd", "#8c564b"]
+    pad = 60
+    xs = [p["throughput_rps"] for pts in series.values() for p in pts] or [1]
+    ys = [max(p["p99_ms"], 1.0) for pts in series.values() for p in pts] or [1]
+    x_max = max(xs) * 1.1
+    y_lo, y_hi = math.log10(min(ys)) - 0.1, math.log10(max(ys)) + 0.1
+
+    def px(x):
+        return pad + x / x_max * (width - 2 * pad)
+
+    def py(y):
+        return height - pad - (math.log10(max(y, 1.0)) - y_lo) / (y_hi - y_lo or 1) * (height - 2 * pad)
+
+    out = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" font-family="sans-serif" font-size="12">',
+           f'<line x1="{pad}" y1="{height - pad}" x2="{width - pad}" y2="{height - pad}" stroke="#333"/>',
+           f'<line x1="{pad}" y1="{pad}" x2="{pad}" y2="{height - pad}" stroke="#333"/>',
+           f'<text x="{width / 2}" y="{height - 20}" text-anchor="middle">throughput (req/s)</text>',
+           f'<text x="15" y="{height / 2}" transform="rotate(-90 15 {height / 2})" text-anchor="middle">p99 ms (log)</text>']
+    for k in range(5):
+        x = x_max * k / 4
+        out.append(f'<text x="{px(x)}" y="{height - pad + 15}" text-anchor="middle">{x:.0f}</text>')
+        y = 10 ** (y_lo + (y_hi - y_lo) * k / 4)
+        out.append(f'<text x="{pad - 5}" y="{py(y) + 4}" text-anchor="end">{y:.0f}</text>')
+    for i, (name, pts) in enumerate(series.items()):
+        color = colors[i % len(colors)]
+        pts = sorted(pts, key=lambda p: p["target_rps"])
+        line = " ".join(f"{px(p['throughput_rps']):.1f},{py(p['p99_ms']):.1f}" for p in pts)
+        out.append(f'<polyline points="{line}" fill="none" stroke="{color}" stroke-width="2"/>')
+        for p in pts:
+            out.append(f'<circle cx="{px(p["throughput_rps"]):.1f}" cy="{py(p["p99_ms"]):.1f}" r="3" fill="{color}">'
+                       f'<title>{name} offered={p["offered_rps"]} p99={p["p99_ms"]}ms</title></circle>')
+        knee = knees.get(name)
+        if knee:
+            out.append(f'<circle cx="{px(knee["throughput_rps"]):.1f}" cy="{py(knee["p99_ms"]):.1f}" r="8" '
+                       f'fill="none" stroke="{color}" stroke-width="2"/>')
+        out.append(f'<text x="{width - pad - 110}" y="{pad + 15 * i}" fill="{color}">{name}</text>')
+    out.append("</svg>")
+    return "\n".join(out)
+
+
+def html_report(report: dict) -> str:
+    series = {}
+    for cell in report["cells"]:
+        series.setdefault(cell["config"], []).append(cell)
+    cols = ("config", "target_rps", "offered_rps", "throughput_rps", "goodput_rps", "p50_ms", "p99_ms", "p999_ms",
+            "uncorrected_p99_ms", "send_lag_p99_ms", "status")
+    rows = "\n".join("<tr>" + "".join(f"<td>{c.get(k, '')}</td>" for k in cols) + "</tr>" for c in report["cells"])
+    knees = "".join(f"<li>{name}: offered {k['offered_rps']} req/s, throughput {k['throughput_rps']}, p99 {k['p99_ms']}ms</li>"
+                    if k else f"<li>{name}: 第一个到达率就已经饱和</li>" for name, k in report["knees"].items())
+    return f"""<!doctype html><html><head><meta charset="utf-8"><title>loadgen report</title>
+<style>body{{font-family:sans-serif;margin:24px}} td,th{{border:1px solid #ccc;padding:4px 8px;text-align:right}} table{{border-collapse:collapse}}</style>
+</head><body>
+<h2>{report['target']} {report['url']}</h2>
+<p>arrival={report['arrival']} duration={report['duration']}s warmup={report['warmup']}s slo={report['slo_ms']}ms
+connections={report['connections']}；延迟从计划发出时刻算（coordinated omission 已校正），uncorrected 是从真正发出算的</p>
+{svg_chart(series, report['knees'])}
+<h3>饱和拐点（圆圈）</h3><ul>{knees}</ul>
+<table><tr>{''.join(f'<th>{k}</th>' for k in cols)}</tr>
+{rows}
+</table></body></html>
+"""
+
+
+async def sweep(args) -> dict:
+    rng = random.Random(args.seed)
+    rates = [float(x) for x in args.rates.split(",")]
+    configs = [c for c in args.batch_configs.split(",") if c] if args.target == "batch" else []
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    cells = []
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout_ms / 1000.0 + 5) as client:
+        original = None
+        if configs:
+            # 扫完（或者中途出错 / Ctrl-C）把服务的批配置改回原样，别影响压测之后的流量
+            r = await client.get("/batch/metrics")
+            r.raise_for_status()
+            m = r.json()
+            original = {"batch_size": m["current_batch_size"], "max_wait_ms": m["max_batch_wait_ms"]}
+        try:
+            for config in configs or ["default"]:
+                if config != "default":
+                    bs, wait = (int(x) for x in config.split(":"))
+                    r = await client.post("/batch/config", json={"batch_size": bs, "max_wait_ms": wait})
+                    r.raise_for_status()
+                for rate in rates:
+                    cell = summarize(await run_cell(client, args, rate, rng), rate, args.duration)
+                    cell["config"] = config
+                    cells.append(cell)
+                    print(f"{config:>8} target={rate:>6.1f} offered={cell['offered_rps']:>7.2f} thr={cell['throughput_rps']:>7.2f} good={cell['goodput_rps']:>7.2f} "
+                          f"p50={cell['p50_ms']:>7.1f} p99={cell['p99_ms']:>8.1f} uncorrected_p99={cell['uncorrected_p99_ms']:>8.1f} "
+                          f"lag_p99={cell['send_lag_p99_ms']:>6.1f} {cell['status']}", flush=True)
+                    await asyncio.sleep(args.cooldown)  # 上一格的积压清掉再测下一格
+        finally:
+            if original is not None:
+                r = await client.post("/batch/config", json=original)
+                r.raise_for_status()
+                print(f"restored /batch/config: {original}", flush=True)
+    knees = {}
+    for config in configs or ["default"]:
+        knees[config] = find_knee([c for c in cells if c["config"] == config])
+    return {"url": args.url, "target": args.target, "arrival": args.arrival, "duration": args.duration,
+            "warmup": args.warmup, "slo_ms": args.slo_ms, "connections": args.connections,
+            "cells": cells, "knees": knees}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--target", choices=sorted(TARGETS), default="infer")  # stream 是 a4 的 /infer/stream
+    parser.add_argument("--rates", default="10,20,40,80")                 # 请求/秒，逗号分隔
+    parser.add_argument("--batch-configs", default="")                     # batch_size:max_wait_ms，逗号分隔，只对 batch 有用
+    parser.add_argument("--arrival", choices=("poisson", "fixed"), default="poisson")
+    parser.add_argument("--duration", type=float, default=10.0)            # 每格计入结果的时长
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--cooldown", type=float, default=1.0)
+    parser.add_argument("--connections", type=int, default=256)            # 连接池大小（keep-alive 复用）
+    parser.add_argument("--slo-ms", type=float, default=1000.0)            # goodput：这个时间内拿到 200 才算
+    parser.add_argument("--prompt", default="请介绍一下Python")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--latency-ms", type=int, default=80)
+    parser.add_argument("--timeout-ms", type=int, default=5000)
+    parser.add_argument("--prefill-ms", type=int, default=200)
+    parser.add_argument("--token-ms", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="")                               # 写 <out>.json 和 <out>.html
+    args = parser.parse_args()
+
+    report = asyncio.run(sweep(args))
+    for config, knee in report["knees"].items():
+        print(f"knee {config}: " + (f"offered={knee['offered_rps']} throughput={knee['throughput_rps']} p99={knee['p99_ms']}ms"
+                                    if knee else "saturated at the lowest rate"))
+    if args.out:
+        with open(args.out + ".json", "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        with open(args.out + ".html", "w", encoding="utf-8") as f:
+            f.write(html_report(report))
+        print(f"wrote {args.out}.json {args.out}.html")
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,181 @@
+import math
 import threading
 import time
-from collections import deque
+
+# HDR 式的对数分桶：值按微秒取整，每个 2 的幂区间再切成 2**SUB_BITS 份，相对误差不超过 1 / 2**(SUB_BITS+1)（约 1.6%）
+SUB_BITS = 5
+UNITS_PER_MS = 1000
+
+
+def bucket_index(value_ms: float) -> int:
+    v = max(0, int(value_ms * UNITS_PER_MS))
+    shift = v.bit_length() - SUB_BITS - 1
+    if shift <= 0:
+        return v  # 小于 2**(SUB_BITS+1) 微秒的值一个值一个桶，精确
+    return (shift << SUB_BITS) + (v >> shift)
+
+def bucket_value(index: int) -> float:
+    """桶的代表值（中点），单位 ms"""
+    if index < 2 << SUB_BITS:
+        return index / UNITS_PER_MS
+    shift = (index >> SUB_BITS) - 1
+    lo = (index - (shift << SUB_BITS)) << shift
+    return (lo + (1 << shift) / 2) / UNITS_PER_MS
+
+
+class LogHistogram:
+    """
+    对数分桶直方图：add 是 O(1)（算桶号 + 字典加一），分位数只和非空桶的个数有关（延迟通常就集中在几十个桶里），
+    和样本数无关；两个直方图可以直接逐桶相加合并（多个时间片 / 多个 worker）
+    """
+    __slots__ = ("counts", "count", "sum", "min", "max")
+
+    def __init__(self):
+        self.counts = {}  # 桶号 -> 次数，稀疏存
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def add(self, value_ms: float, n: int = 1):
+        i = bucket_index(value_ms)
+        self.counts[i] = self.counts.get(i, 0) + n
+        self.count += n
+        self.sum += value_ms * n
+        if value_ms < self.min:
+            self.min = value_ms
+        if value_ms > self.max:
+            self.max = value_ms
+
+    def merge(self, other: "LogHistogram") -> "LogHistogram":
+        for i, c in other.counts.items():
+            self.counts[i] = self.counts.get(i, 0) + c
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def subtract(self, other: "LogHistogram"):
+        # 滑动窗口里把过期的时间片减掉；min / max 减不回去，由调用方另外算
+        for i, c in other.counts.items():
+            left = self.counts[i] - c
+            if left:
+                self.counts[i] = left
+            else:
+                del self.counts[i]
+        self.count -= other.count
+        self.sum -= other.sum
+
+    def percentiles(self, *ps: float) -> list:
+        """
+        和 percentile() 一样取第 int(p% * (n-1)) 个（从 0 数），落在哪个桶就返回桶的中点，再夹到 [min, max]。
+        多个分位数一起算，桶只排序、扫一遍
+        """
+        if not self.count:
+            return [0.0] * len(ps)
+        ranks = sorted((int((p / 100.0) * (self.count - 1)), k) for k, p in enumerate(ps))
+        out = [self.max] * len(ps)
+        j, seen = 0, 0
+        for i in sorted(self.counts):
+            seen += self.counts[i]
+            while j < len(ranks) and seen > ranks[j][0]:
+                out[ranks[j][1]] = min(max(bucket_value(i), self.min), self.max)
+                j += 1
+            if j == len(ranks):
+                break
+        return out
+
+    def percentile(self, p: float) -> float:
+        return self.percentiles(p)[0]
+
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def to_dict(self) -> dict:
+        # 给跨进程合并用（json 的 key 只能是字符串）
+        return {"counts": {str(i): c for i, c in self.counts.items()}, "count": self.count, "sum": self.sum,
+                "min": self.min if self.count else 0.0, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "LogHistogram":
+        h = cls()
+        h.counts = {int(i): c for i, c in d["counts"].items()}
+        h.count, h.sum, h.max = d["count"], d["sum"], d["max"]
+        h.min = d["min"] if h.count else math.inf
+        return h
+
 
 class LatencyStats:
-    """保存最近 N 次请求的延迟，用来算 p50/p90/p99"""
-    def __init__(self, maxlen=5000):
-        self.maxlen = maxlen
+    """
+    最近 window_s 秒的延迟分布：一圈 window_s / slot_s 个时间片，每片一个 LogHistogram，
+    写入只碰当前时间片（时间片轮回来时先清空），查询更短的窗口时把覆盖到的时间片合并起来。
+    整个窗口另外维护一个滚动合计（写入时同时加，时间片过期时减掉），查整个窗口不用合并 60 片。
+    add 和查询的开销都和请求量无关；另外留一个从创建开始的累计直方图
+    """
+    def __init__(self, window_s: float = 60.0, slot_s: float = 1.0):
+        self.slot_s = slot_s
+        self.n_slots = max(1, int(math.ceil(window_s / slot_s)))
         self.lock = threading.Lock()
-        self.latencies_ms = deque(maxlen=maxlen)
-        self.req_timestamps = deque(maxlen=maxlen)  # 用于粗算 QPS
+        self.slots = [LogHistogram() for _ in range(self.n_slots)]
+        self.epochs = [-1] * self.n_slots  # 每个位置当前装的是第几个时间片，-1 = 空（不在滚动合计里）
+        self.rolling = LogHistogram()
+        self.total = LogHistogram()
+
+    def _expire(self, i: int):
+        self.rolling.subtract(self.slots[i])
+        self.slots[i] = LogHistogram()
+        self.epochs[i] = -1
 
-    def add(self, latency_ms: int):
-        now = time.time()
+    def add(self, latency_ms: float):
+        epoch = int(time.monotonic() / self.slot_s)
+        i = epoch % self.n_slots
         with self.lock:
-            self.latencies_ms.append(latency_ms)
-            self.req_timestamps.append(now)
+            if self.epochs[i] != epoch:
+                if self.epochs[i] >= 0:
+                    self._expire(i)
+                self.epochs[i] = epoch
+            self.slots[i].add(latency_ms)
+            self.rolling.add(latency_ms)
+            self.total.add(latency_ms)
 
-    def snapshot(self):
+    def window(self, seconds: float = None):
+        """
+        合并最近 seconds 秒（默认整个窗口）的时间片，返回 (直方图, 实际覆盖的秒数)。
+        按时间片取整：当前没走完的那片 + 往前 ceil(seconds / slot_s) 片，覆盖时长按实际算，QPS 不会偏
+        """
+        now = time.monotonic()
+        epoch = int(now / self.slot_s)
+        n = self.n_slots - 1 if seconds is None else min(self.n_slots - 1, int(math.ceil(seconds / self.slot_s)))
+        merged = LogHistogram()
         with self.lock:
-            l = list(self.latencies_ms)
-            t = list(self.req_timestamps)
-        return l, t
+            # 一段时间没请求的话，有的时间片没被新写入覆盖，这里顺手过期掉
+            for i, e in enumerate(self.epochs):
+                if 0 <= e < epoch - (self.n_slots - 1):
+                    self._expire(i)
+            if n == self.n_slots - 1:
+                merged.merge(self.rolling)
+                live = [self.slots[i] for i, e in enumerate(self.epochs) if e >= 0]
+                merged.min = min((h.min for h in live), default=math.inf)
+                merged.max = max((h.max for h in live), default=0.0)
+            else:
+                for i, e in enumerate(self.epochs):
+                    if epoch - n <= e <= epoch:
+                        merged.merge(self.slots[i])
+        return merged, now - (epoch - n) * self.slot_s
+
+    def snapshot(self, seconds: float = None) -> dict:
+        h, covered = self.window(seconds)
+        p50, p90, p99 = h.percentiles(50, 90, 99)
+        return {
+            "count": h.count,
+            "avg_latency_ms": round(h.mean(), 2),
+            "p50_ms": round(p50),
+            "p90_ms": round(p90),
+            "p99_ms": round(p99),
+            "qps": round(h.count / covered, 2) if covered > 0 else 0.0,
+        }
+
 
 def percentile(sorted_list, p: float) -> int:
     if not sorted_list:
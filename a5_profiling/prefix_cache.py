@@ -0,0 +1,152 @@
+import heapq
+import time
+
+
+class Node:
+    __slots__ = ("key", "children", "parent", "last_access")
+
+    def __init__(self, key: tuple = (), parent=None):
+        self.key = key            # 这条边上的 token 序列
+        self.children = {}        # 子节点第一个 token -> Node
+        self.parent = parent
+        self.last_access = time.monotonic()
+
+
+class RadixCache:
+    """
+    KV 前缀缓存的模拟（思路同 SGLang 的 RadixAttention）：
+    已经 prefill 过的 token 序列存在一棵 radix tree 里，边上是一段 token；新请求从根往下匹配，
+    匹配上的最长前缀的 KV 可以直接复用，只有没匹配上的后缀需要重新 prefill。
+    总 token 数超过 token_budget 时按 LRU 淘汰叶子（叶子删掉后父节点变成叶子，可以继续被淘汰）。
+    叶子按访问时间放在一个常驻的小顶堆里（懒删除：访问时只压新条目，旧条目弹出来时再认出是过期的丢掉），
+    淘汰不用每次把整棵树的叶子扫一遍。
+    单线程（事件循环里）使用，不加锁。
+    """
+    def __init__(self, token_budget: int = 200_000):
+        self.token_budget = token_budget
+        self.root = Node()
+        self.size = 0  # 树里一共存了多少 token
+        self.nodes = 0  # 不算根的节点数，用来判断堆里过期条目是不是太多了
+        self.heap = []  # (last_access, id, node)，叶子的 LRU 堆，可能有过期条目
+        self.counts = {"lookups": 0, "hit_requests": 0, "prompt_tokens": 0, "cached_tokens": 0,
+                       "inserted_tokens": 0, "evicted_tokens": 0}
+
+    def match_prefix(self, tokens) -> int:
+        """返回能复用的前缀长度，并刷新路径上节点的访问时间"""
+        tokens = tuple(tokens)
+        now = time.monotonic()
+        node, i = self.root, 0
+        while i < len(tokens):
+            child = node.children.get(tokens[i])
+            if child is None:
+                break
+            k = _common_len(child.key, tokens, i)
+            self._touch(child, now)
+            i += k
+            if k < len(child.key):
+                break  # 只匹配了这条边的一部分，部分复用也算
+            node = child
+
+        self.counts["lookups"] += 1
+        self.counts["prompt_tokens"] += len(tokens)
+        self.counts["cached_tokens"] += i
+        self.counts["hit_requests"] += i > 0
+        return i
+
+    def insert(self, tokens):
+        """prefill 完成后把整条序列放进树里；已经存在的前缀不重复计数"""
+        tokens = tuple(tokens)
+        now = time.monotonic()
+        node, i = self.root, 0
+        while i < len(tokens):
+            child = node.children.get(tokens[i])
+            if child is None:
+                leaf = Node(tokens[i:], node)
+                node.children[tokens[i]] = leaf
+                self.nodes += 1
+                self._touch(leaf, leaf.last_access)
+                self.size += len(leaf.key)
+                self.counts["inserted_tokens"] += len(leaf.key)
+                break
+            k = _common_len(child.key, tokens, i)
+            if k < len(child.key):
+                child = self._split(child, k)
+            self._touch(child, now)
+            node = child
+            i += k
+
+        if self.size > self.token_budget:
+            self.evict(self.size - self.token_budget)
+
+    def _split(self, child: Node, k: int) -> Node:
+        # 把 child 的边在第 k 个 token 处切开：parent -> mid(key[:k]) -> child(key[k:])
+        mid = Node(child.key[:k], child.parent)
+        mid.last_access = child.last_access
+        self.nodes += 1
+        child.parent.children[child.key[0]] = mid
+        child.key = child.key[k:]
+        child.parent = mid
+        mid.children[child.key[0]] = child
+        return mid
+
+    def _touch(self, node: Node, now: float):
+        node.last_access = now
+        if not node.children:
+            heapq.heappush(self.heap, (now, id(node), node))
+            if len(self.heap) > 2 * self.nodes + 64:
+                # 过期条目（被删掉的、长出子节点的、后来又被访问过的）攒多了就按当前的叶子重建一次，均摊下来还是 O(1)
+                self.heap = [(n.last_access, id(n), n) for n in self._leaves()]
+                heapq.heapify(self.heap)
+
+    def evict(self, n_tokens: int) -> int:
+        """淘汰至少 n_tokens 个 token：每次删最久没访问的叶子，整条边一起删"""
+        freed = 0
+        while freed < n_tokens and self.heap:
+            t, _, leaf = heapq.heappop(self.heap)
+            if leaf.parent is None or leaf.children or t != leaf.last_access:
+                continue  # 过期条目
+            parent = leaf.parent
+            del parent.children[leaf.key[0]]
+            leaf.parent = None
+            self.nodes -= 1
+            freed += len(leaf.key)
+            if parent is not self.root and not parent.children:
+                heapq.heappush(self.heap, (parent.last_access, id(parent), parent))
+        self.size -= freed
+        self.counts["evicted_tokens"] += freed
+        return freed
+
+    def _leaves(self):
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.children:
+                stack.extend(node.children.values())
+            elif node is not self.root:
+                yield node
+
+    def snapshot(self) -> dict:
+        c = self.counts
+        return {
+            **c,
+            "size_tokens": self.size,
+            "token_budget": self.token_budget,
+            # token 命中率：prompt token 里有多少不用重新 prefill；request 命中率：至少复用了一个 token 的请求占比
+            "token_hit_rate": round(c["cached_tokens"] / c["prompt_tokens"], 3) if c["prompt_tokens"] else 0.0,
+            "request_hit_rate": round(c["hit_requests"] / c["lookups"], 3) if c["lookups"] else 0.0,
+        }
+
+
+def _common_len(key: tuple, tokens: tuple, start: int) -> int:
+    # 先整段比较（C 层面的 tuple 比较，长 system prompt 完全相同是最常见的情况），不相等再二分找分叉点
+    n = min(len(key), len(tokens) - start)
+    if key[:n] == tokens[start:start + n]:
+        return n
+    lo, hi = 0, n  # key[:lo] 相同，key[:hi] 不同
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if key[lo:mid] == tokens[start + lo:start + mid]:
+            lo = mid
+        else:
+            hi = mid
+    return lo
@@ -0,0 +1,89 @@
+"""
+离线回放 prompt trace，估算前缀缓存能省多少 prefill：
+    python -m a5_profiling.prefix_sim --trace prompts.jsonl --budgets 0,20000,200000
+trace 是 jsonl，每行至少有 prompt，可选 max_new_tokens；不给 --trace 就生成一份"共享 system prompt + 随机用户问题"的假 trace。
+"""
+import json
+import random
+import argparse
+
+from .metrics import percentile
+from .prefix_cache import RadixCache
+from .tokenizer import tokenize
+
+
+def load_trace(path: str):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def synthetic_trace(n: int, n_system: int, system_words: int, user_words: int, seed: int = 0):
+    """n_system 个长 system prompt，按 Zipf 式权重被选中（少数几个特别热），后面拼一段随机的用户输入"""
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = ["".join(rng.choices(letters, k=rng.randint(2, 8))) for _ in range(5000)]
+    systems = [" ".join(rng.choices(words, k=system_words)) for _ in range(n_system)]
+    weights = [1.0 / (i + 1) for i in range(n_system)]
+    trace = []
+    for _ in range(n):
+        system = rng.choices(systems, weights)[0]
+        user = " ".join(rng.choices(words, k=max(1, int(rng.expovariate(1.0 / user_words)))))
+        trace.append({"prompt": system + " " + user, "max_new_tokens": 64})
+    return trace
+
+def replay(trace, budget: int, prefill_ms: float, decode_ms: float) -> dict:
+    """
+    顺序回放：每个请求先查前缀缓存，prefill 只算没命中的后缀，然后把整条 prompt 插进去。
+    TTFT 按 prefill 时间算（不含排队），单请求总耗时 = prefill + max_new_tokens * decode_ms，吞吐 = 请求数 / 总耗时
+    """
+    cache = RadixCache(token_budget=budget) if budget > 0 else None
+    ttft, total_ms = [], 0.0
+    for req in trace:
+        tokens = tokenize(req["prompt"])
+        cached = cache.match_prefix(tokens) if cache else 0
+        if cache:
+            cache.insert(tokens)
+        prefill = (len(tokens) - cached) * prefill_ms
+        ttft.append(prefill)
+        total_ms += prefill + req.get("max_new_tokens", 64) * decode_ms
+    ttft.sort()
+    snap = cache.snapshot() if cache else {"token_hit_rate": 0.0, "request_hit_rate": 0.0}
+    return {
+        "budget": budget,
+        "token_hit_rate": snap["token_hit_rate"],
+        "request_hit_rate": snap["request_hit_rate"],
+        "ttft_mean_ms": round(sum(ttft) / len(ttft), 2),
+        "ttft_p50_ms": round(percentile(ttft, 50), 2),
+        "ttft_p99_ms": round(percentile(ttft, 99), 2),
+        "req_per_s": round(len(trace) / (total_ms / 1000.0), 2) if total_ms else 0.0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trace", default="")
+    parser.add_argument("--budgets", default="0,5000,20000,100000")  # 前缀缓存能放多少 token，0 = 不开
+    parser.add_argument("--prefill-ms", type=float, default=0.05)    # 每个 prompt token 的 prefill 耗时
+    parser.add_argument("--decode-ms", type=float, default=5.0)      # 每个生成 token 的 decode 耗时
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--systems", type=int, default=20)
+    parser.add_argument("--system-words", type=int, default=1500)
+    parser.add_argument("--user-words", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.trace:
+        trace = load_trace(args.trace)
+    else:
+        trace = synthetic_trace(args.requests, args.systems, args.system_words, args.user_words, args.seed)
+
+    base = None
+    cols = ("budget", "token_hit_rate", "request_hit_rate", "ttft_mean_ms", "ttft_p50_ms", "ttft_p99_ms", "req_per_s")
+    print(f"{len(trace)} requests")
+    print(" | ".join(cols) + " | speedup")
+    for b in [int(x) for x in args.budgets.split(",")]:
+        r = replay(trace, b, args.prefill_ms, args.decode_ms)
+        base = base or r
+        speedup = r["req_per_s"] / base["req_per_s"] if base["req_per_s"] else 0.0
+        print(" | ".join(str(r[k]) for k in cols) + f" | {speedup:.2f}x")
+
+if __name__ == "__main__":
+    main()
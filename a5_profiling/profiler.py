@@ -0,0 +1,156 @@
+"""
+线上用的采样 profiler：不用 cProfile 重启服务，跑着的进程里开一个后台线程定时抓所有线程的调用栈（sys._current_frames），
+按 flamegraph.pl / speedscope 认的 collapsed 格式（"根;...;叶 次数"）汇总；同时在事件循环里测调度延迟（loop lag）。
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from .metrics import LogHistogram
+
+# 事件循环空闲时停在 selector 的 select / poll 上，叶子是这些的样本算空闲
+IDLE_LEAVES = ("select (selectors.py)", "poll (selectors.py)", "wait (threading.py)")
+SWITCH_INTERVAL = 0.0001
+
+
+class StackSampler:
+    """
+    后台线程每 interval 秒抓一次所有线程的栈。栈帧的名字按 code 对象缓存，每次采样只是走一遍 f_back 链。
+    采样线程拿 GIL 的那一小段时间会和被测代码抢，开销按 sampling_overhead（采样耗时 / 总时长）报出来
+    """
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.sample_time = 0.0
+        self._labels = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._t0 = 0.0
+        self._switch = 0.005
+        self.duration = 0.0
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            # 用函数定义的行号而不是当前执行到的行号，同一个函数不会因为行号不同被拆成很多个框
+            base = os.path.basename(code.co_filename)
+            if base in ("selectors.py", "threading.py"):
+                label = f"{code.co_name} ({base})"  # IDLE_LEAVES 按这个名字匹配
+            else:
+                label = f"{code.co_name} ({base}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    def _sample(self):
+        me = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for tid, frame in sys._current_frames().items():
+            if tid == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(tid, f"thread-{tid}"))
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self):
+        next_t = time.perf_counter()
+        while not self._stop.is_set():
+            t = time.perf_counter()
+            self._sample()
+            self.sample_time += time.perf_counter() - t
+            next_t += self.interval
+            self._stop.wait(max(0.0, next_t - time.perf_counter()))
+
+    def start(self):
+        # 采样线程醒了以后要等主线程让出 GIL 才能采：默认 5ms 的 switch interval 比一段忙碌时间还长，
+        # 主线程往往在这之前就进 select 主动释放了，采到的就全是空闲。采样期间把 switch interval 调小，
+        # 醒来 0.1ms 内就能拿到 GIL，采到的是醒来那一刻主线程在干什么；只有采样线程在抢 GIL，多出来的切换很少
+        self._switch = sys.getswitchinterval()
+        sys.setswitchinterval(SWITCH_INTERVAL)
+        self._t0 = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        sys.setswitchinterval(self._switch)
+        self.duration = time.perf_counter() - self._t0
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {n}" for stack, n in self.stacks.most_common()) + "\n"
+
+    def summary(self, thread: str = "MainThread", top: int = 20) -> dict:
+        """只看 thread 这个线程（默认事件循环所在的主线程）：空闲比例、按自身耗时 / 包含子调用耗时排的函数"""
+        own, total, busy, n = Counter(), Counter(), 0, 0
+        for stack, c in self.stacks.items():
+            frames = stack.split(";")
+            if frames[0] != thread:
+                continue
+            n += c
+            if frames[-1] in IDLE_LEAVES:
+                continue
+            busy += c
+            own[frames[-1]] += c
+            for f in set(frames[1:]):
+                total[f] += c
+        return {
+            "thread": thread,
+            "samples": n,
+            "busy_ratio": round(busy / n, 3) if n else 0.0,
+            "top_self": [{"frame": f, "samples": c, "ratio": round(c / n, 3)} for f, c in own.most_common(top)],
+            "top_total": [{"frame": f, "samples": c, "ratio": round(c / n, 3)} for f, c in total.most_common(top)],
+        }
+
+
+class LoopLagMonitor:
+    """
+    事件循环调度延迟：每 interval 秒用 call_at 定一个回调，回调真正执行的时刻 - 计划时刻 = lag。
+    有同步代码（pydantic 校验、拼字符串、排序）占着事件循环时，lag 就会涨，所有请求都跟着等
+    """
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.hist = LogHistogram()
+        self._handle = None
+        self._loop = None
+
+    def _tick(self, scheduled: float):
+        now = self._loop.time()
+        self.hist.add((now - scheduled) * 1000.0)
+        nxt = max(scheduled + self.interval, now)
+        self._handle = self._loop.call_at(nxt, self._tick, nxt)
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        t = self._loop.time() + self.interval
+        self._handle = self._loop.call_at(t, self._tick, t)
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+
+    def snapshot(self) -> dict:
+        h = self.hist
+        p50, p99 = h.percentiles(50, 99)
+        return {"interval_ms": self.interval * 1000, "count": h.count, "mean_ms": round(h.mean(), 3),
+                "p50_ms": round(p50, 3), "p99_ms": round(p99, 3), "max_ms": round(h.max, 3)}
+
+
+async def profile(seconds: float, interval: float = 0.005, lag_interval: float = 0.01):
+    """在当前进程里采 seconds 秒，返回 (StackSampler, LoopLagMonitor)"""
+    sampler = StackSampler(interval)
+    lag = LoopLagMonitor(lag_interval)
+    sampler.start()
+    lag.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        lag.stop()
+        sampler.stop()
+    return sampler, lag
@@ -0,0 +1,250 @@
+"""
+Prometheus 文本格式的指标（不依赖 prometheus_client，自己写 exposition）：
+- PromMiddleware：所有路由的请求数、按 route / status 的耗时直方图、in-flight gauge
+- batch.py 往 queue_depth / batch_size 直方图里打点
+- 多个 uvicorn worker（--workers N）时每个进程有自己的一份，设了 PROMETHEUS_MULTIPROC_DIR 的话
+  每个进程每秒（以及被抓取时）把自己的那份写成 <dir>/metrics_<pid>.json，哪个 worker 被抓都把所有文件合并起来再输出
+"""
+import asyncio
+import json
+import os
+import time
+from starlette.routing import Match
+
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR", "")
+FLUSH_INTERVAL_S = 1.0
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}  # label 值的 tuple -> 值（histogram 是 [每个桶的次数..., sum]）
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    """多进程时按 worker 求和（in-flight、队列长度这些加起来才是整台机器的）；进程没了它的 gauge 就不算了"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames=(), fn=None):
+        super().__init__(name, help, labelnames)
+        self.fn = fn  # 不带 label 的 gauge 可以给一个函数，抓取的时候再取值
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        v = self.values.get(key)
+        if v is None:
+            v = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        # 存的是落在每个区间里的次数（不是累计的），合并时直接相加；最后一格是 +Inf，再后面是 sum
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        v[i] += 1
+        v[-1] += value
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def state(self) -> dict:
+        for m in self.metrics:
+            if isinstance(m, Gauge) and m.fn is not None:
+                m.set(m.fn())
+        return {
+            "pid": os.getpid(),
+            "metrics": {m.name: [[list(k), v] for k, v in m.values.items()] for m in self.metrics},
+        }
+
+    def collect(self) -> dict:
+        """本进程的值；多进程模式下先把自己写出去，再把目录里所有进程的合起来。返回 name -> {label tuple: 值}"""
+        if not MULTIPROC_DIR:
+            state = self.state()["metrics"]
+            return {m.name: _merge({}, state[m.name]) for m in self.metrics}
+        self.flush()
+        merged = {m.name: {} for m in self.metrics}
+        gauges = {m.name for m in self.metrics if isinstance(m, Gauge)}
+        for fname in os.listdir(MULTIPROC_DIR):
+            if not (fname.startswith("metrics_") and fname.endswith(".json")):
+                continue
+            try:
+                with open(os.path.join(MULTIPROC_DIR, fname)) as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                continue  # 正好赶上别的进程在写（写是 rename 过去的，一般不会），或者文件坏了，这次先跳过
+            alive = _pid_alive(state["pid"])
+            for name, samples in state["metrics"].items():
+                if name in merged and (alive or name not in gauges):
+                    _merge(merged[name], samples)
+        return merged
+
+    def flush(self):
+        if not MULTIPROC_DIR:
+            return
+        path = os.path.join(MULTIPROC_DIR, f"metrics_{os.getpid()}.json")
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.state(), f)
+        os.replace(tmp, path)  # 原子替换，别的进程读到的要么是旧的要么是新的
+
+    def render(self) -> str:
+        values = self.collect()
+        lines = []
+        for m in self.metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            for key, v in sorted(values[m.name].items()):
+                labels = list(zip(m.labelnames, key))
+                if isinstance(m, Histogram):
+                    cum = 0
+                    for le, c in zip(m.buckets + ("+Inf",), v[:-1]):
+                        cum += c
+                        lines.append(f"{m.name}_bucket{_labels(labels + [('le', _num(le))])} {cum}")
+                    lines.append(f"{m.name}_sum{_labels(labels)} {_num(v[-1])}")
+                    lines.append(f"{m.name}_count{_labels(labels)} {cum}")
+                else:
+                    lines.append(f"{m.name}{_labels(labels)} {_num(v)}")
+        return "\n".join(lines) + "\n"
+
+
+def _merge(into: dict, samples) -> dict:
+    for key, v in samples:
+        key = tuple(key)
+        old = into.get(key)
+        if old is None:
+            into[key] = list(v) if isinstance(v, list) else v
+        elif isinstance(v, list):
+            into[key] = [a + b for a, b in zip(old, v)]
+        else:
+            into[key] = old + v
+    return into
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _num(x) -> str:
+    if isinstance(x, str):
+        return x  # "+Inf"
+    x = float(x)
+    return str(int(x)) if x.is_integer() else repr(x)
+
+def _labels(pairs) -> str:
+    if not pairs:
+        return ""
+    esc = lambda s: str(s).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    "http_requests_total", "HTTP requests by route template and status", ("method", "route", "status")))
+http_latency = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency (until the last body chunk is sent)",
+    LATENCY_BUCKETS, ("method", "route", "status")))
+http_in_flight = registry.register(Gauge(
+    "http_requests_in_flight", "HTTP requests currently being handled", ("method", "route")))
+queue_depth = registry.register(Histogram(
+    "batch_queue_depth", "Requests queued (queue + waiting) seen by each new batch request", DEPTH_BUCKETS))
+batch_size = registry.register(Histogram(
+    "batch_size", "Requests per static batch / per continuous decode step", SIZE_BUCKETS, ("engine",)))
+
+
+class PromMiddleware:
+    """
+    纯 ASGI 中间件。route label 用路由模板而不是原始 path（避免 label 基数爆炸），没匹配上的记成 unmatched。
+    路由要进了 app 里面才匹配，in-flight 在进来时就要记，所以这里自己按 scope["app"] 的路由表先匹配一次（结果按 path 缓存）
+    """
+    def __init__(self, app, cache_size: int = 1000):
+        self.app = app
+        self.cache_size = cache_size
+        self._routes = {}
+
+    def _route(self, scope) -> str:
+        key = (scope["method"], scope["path"])
+        route = self._routes.get(key)
+        if route is None:
+            route = "unmatched"
+            for r in scope["app"].router.routes:
+                match, _ = r.matches(scope)
+                if match == Match.FULL:
+                    route = r.path
+                    break
+                if match == Match.PARTIAL and route == "unmatched":
+                    route = r.path  # path 对上了 method 不对（405），也算这个路由
+            if len(self._routes) < self.cache_size:
+                self._routes[key] = route
+        return route
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        method, route = scope["method"], self._route(scope)
+        status = {"code": 500}
+
+        async def send_tracked(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        http_in_flight.inc(method=method, route=route)
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_tracked)
+        finally:
+            http_in_flight.dec(method=method, route=route)
+            http_requests.inc(method=method, route=route, status=status["code"])
+            http_latency.observe(time.perf_counter() - t0, method=method, route=route, status=status["code"])
+
+
+async def flush_loop():
+    # 多进程模式下定期把本进程的值写出去：别的 worker 被抓取时看到的最多晚 FLUSH_INTERVAL_S
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL_S)
+        registry.flush()
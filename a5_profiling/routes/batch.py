@@ -1,21 +1,77 @@
 import asyncio
+import itertools
+import random
 import time
+from collections import deque
 from dataclasses import dataclass
 from fastapi import HTTPException, Body
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Optional
 
-from ..metrics import LatencyStats, percentile
+from .. import prom, tracing
+from ..autotune import BatchAutoTuner
+from ..kv_cache import PagedKVCache
+from ..metrics import LatencyStats
+from ..tokenizer import count_tokens
 
 # 配置参数
 BATCH_SIZE = 4
 MAX_BATCH_WAIT_MS = 50
 
+# KV cache 显存预算：真正限制一台机器能同时跑多少请求的是显存，不是请求个数
+KV_BLOCK_SIZE = 16               # 每个 block 放多少 token
+KV_BYTES_PER_TOKEN = 512 * 1024  # 每个 token 的 KV 大小，7B 模型 fp16 约 2 * 32 层 * 4096 * 2 字节
+KV_MEMORY_MB = 1024
+KV_SWAP_MB = 512                 # CPU swap 空间，被抢占的请求 KV 换到这里
+
+# 推理引擎：static = 一批跑完才进下一批；continuous = 每个 decode step 都可以有请求进出（iteration-level）
+ENGINES = ("static", "continuous")
+ENGINE = "static"
+PREFILL_MS_PER_TOKEN = 0.0       # prefill 每个 prompt token 的耗时，0 = 不算 prefill（和原来一样）
+PREFILL_CHUNK_TOKENS = 256       # continuous 模式每个 step 最多 prefill 这么多 token，长 prompt 分几步做完
+
+# static 引擎的凑批策略：fifo = 严格按到达顺序凑够 BATCH_SIZE；bucketed = 按长度分桶 + token 预算
+BATCH_POLICIES = ("fifo", "bucketed")
+BATCH_POLICY = "fifo"
+BATCH_TOKEN_BUDGET = 4096        # bucketed：一批按 padding 之后的 token 数（人数 * 最长请求）封顶
+LOOKAHEAD = 32                   # bucketed：最多往后看这么多个排队的请求挑同桶的
+
+# 批越大每个 decode step 越慢（真实 GPU 上批大了要读更多 KV、算更多 token）：每多一个请求 step 慢这么多比例。
+# 0 = 批大小不影响 step 耗时（和原来一样），这时候批越大越好，也就没什么可调的
+BATCH_STEP_COST = 0.0
+
+# 自动调参：后台按 p99 目标调 BATCH_SIZE / MAX_BATCH_WAIT_MS，默认关，/batch/config 里打开
+AUTOTUNE = False
+tuner = BatchAutoTuner()
+
+
+def make_kv_cache(memory_mb: int = KV_MEMORY_MB, swap_mb: int = KV_SWAP_MB) -> PagedKVCache:
+    block_bytes = KV_BLOCK_SIZE * KV_BYTES_PER_TOKEN
+    return PagedKVCache(memory_mb * 2**20 // block_bytes, KV_BLOCK_SIZE, swap_mb * 2**20 // block_bytes)
+
+kv = make_kv_cache()
+
 # 统计对象
-stats = LatencyStats(maxlen=5000)
+stats = LatencyStats(window_s=60.0)
 
 # 待处理队列
 queue: asyncio.Queue = asyncio.Queue()
+# 被抢占 / 准入时显存不够退回来的请求，下次凑批优先从这里取
+waiting: deque = deque()
+# continuous 引擎里正在跑的请求（切回 static 时要先把它们跑完）
+running: list = []
+# static 引擎每一批的 padding 统计，/batch/test 里按批返回
+batch_log: list = []
+_seq_ids = itertools.count()
+_batch_ids = itertools.count()
+
+# 抓取时取当前值的 gauge；排队深度 / 批大小的分布在入队和成批时打进 prom 的直方图
+prom.registry.register(prom.Gauge("batch_queue_length", "Requests waiting for a batch (queue + waiting)",
+                                  fn=lambda: queue.qsize() + len(waiting)))
+prom.registry.register(prom.Gauge("batch_running", "Requests running in the continuous engine",
+                                  fn=lambda: len(running)))
+prom.registry.register(prom.Gauge("kv_cache_used_blocks", "KV cache blocks in use",
+                                  fn=lambda: kv.gpu.num_blocks - kv.gpu.num_free))
 
 
 @dataclass
@@ -23,6 +79,17 @@ class Pending:
     req: "BatchInferRequest"
     enqueued_at: float
     fut: asyncio.Future
+    seq_id: int = 0
+    prompt_tokens: int = 0
+    generated: int = 0      # 已经生成的 token 数（swap 抢占会保留，recompute 抢占清零）
+    prefilled: int = 0      # continuous 模式下 prompt 已经 prefill 了多少 token
+    admitted_at: float = 0.0
+    trace: Optional[tracing.Trace] = None  # 采样中的请求才有
+    batch_id: int = -1      # static 引擎里最后一次跑它的是第几批
+
+    def __post_init__(self):
+        self.seq_id = next(_seq_ids)
+        self.prompt_tokens = count_tokens(self.req.prompt)
 
 
 class BatchInferRequest(BaseModel):
@@ -41,10 +108,18 @@ class SingleInferResponse(BaseModel):
 
 class BatchTestRequest(BaseModel):
     batch_size: int = Field(4, ge=1, le=32)
-    num_requests: int = Field(16, ge=1, le=100)
+    num_requests: int = Field(16, ge=1, le=5000)
     prompt: str = Field("请介绍一下Python")
     max_new_tokens: int = Field(64, ge=1, le=512)
     latency_ms: int = Field(80, ge=0, le=5000)
+    engine: Optional[str] = None       # 这次测试用哪个引擎，不传就用当前配置
+    # 长度抖动：每个请求的 max_new_tokens 在 [max_new_tokens * (1 - jitter), max_new_tokens] 里均匀取，
+    # latency_ms 按比例缩放（每个 token 的耗时不变），用来制造长短混合的请求
+    length_jitter: float = Field(0.0, ge=0, le=1)
+    arrival_rate: float = Field(0.0, ge=0)  # 请求/秒，Poisson 到达；0 = 一次性全部入队
+    seed: int = 0
+    policy: Optional[str] = None       # static 引擎的凑批策略，不传就用当前配置
+    token_budget: Optional[int] = None
 
 
 class BatchTestResult(BaseModel):
@@ -61,60 +136,373 @@ class BatchTestResult(BaseModel):
     p99_server_latency_ms: int
     total_time_ms: int
     throughput_requests_per_sec: float
-
-
-async def mock_batch_infer(reqs: List[BatchInferRequest]) -> List[str]:
-    # 模拟批推理：耗时由最慢请求决定（尾部绑架）
-    sleep_ms = max(r.latency_ms for r in reqs)
-    await asyncio.sleep(sleep_ms / 1000.0)
-    return [r.prompt + " " + ("<tok> " * r.max_new_tokens).strip() for r in reqs]
-
-
-async def batch_worker():
-    # 后台 worker：凑批并执行推理
-    while True:
-        first: Pending = await queue.get()
-        batch = [first]
-        t_first = first.enqueued_at
-        deadline = t_first + (MAX_BATCH_WAIT_MS / 1000.0)
-
-        # 在等待窗口内尽量凑够 BATCH_SIZE
-        while len(batch) < BATCH_SIZE:
-            timeout = deadline - time.perf_counter()
+    # static 引擎的凑批情况：waste = 1 - 有效 decode token / (批大小 * 批内最长 max_new_tokens)
+    batches: int = 0
+    avg_batch_size: float = 0.0
+    padding_waste_ratio: float = 0.0
+    per_batch: List[dict] = []
+    # 开了自动调参时，测试结束那一刻调到了多少（测试完会恢复成测试前的配置）
+    final_batch_size: int = 0
+    final_max_wait_ms: int = 0
+
+
+def mock_text(req: BatchInferRequest) -> str:
+    return req.prompt + " " + ("<tok> " * req.max_new_tokens).strip()
+
+
+def try_admit(p: Pending) -> bool:
+    """按 KV block 准入：swap 出去的请求换回来；其它请求为 prompt（+ 已生成的 token）申请 block"""
+    if p.seq_id in kv.swapped:
+        return kv.can_swap_in(p.seq_id) and kv.swap_in(p.seq_id)
+    n = p.prompt_tokens + p.generated
+    return kv.can_admit(n) and kv.allocate(p.seq_id, n)
+
+def preempt(p: Pending):
+    # 优先换出到 CPU（恢复时不用重算），swap 空间满了就丢掉 KV，之后从头重算
+    if not kv.swap_out(p.seq_id):
+        kv.preempt_recompute(p.seq_id)
+        p.generated = 0
+        p.prefilled = 0
+        if p.trace:
+            p.trace.instant("preempted", mode="recompute")
+    elif p.trace:
+        p.trace.instant("preempted", mode="swap", blocks=len(kv.swapped[p.seq_id]))
+    waiting.appendleft(p)
+
+def finish(p: Pending, text: str = None, error: Exception = None):
+    kv.free(p.seq_id)
+    now = time.perf_counter()
+    if p.trace:
+        admitted = p.admitted_at or now
+        p.trace.span("batch_wait", p.enqueued_at, admitted)
+        args = {"engine": ENGINE, "batch": p.batch_id, "seq": p.seq_id, "tokens": p.generated}
+        if error is not None:
+            args["error"] = repr(error)
+        p.trace.span("batch_infer", admitted, now, **args)
+    if p.fut.done():
+        return  # 客户端已经超时走了
+    if error is not None:
+        p.fut.set_exception(error)
+        return
+    wait_ms = int((p.admitted_at - p.enqueued_at) * 1000)
+    infer_ms = int((now - p.admitted_at) * 1000)
+    server_latency_ms = wait_ms + infer_ms
+    stats.add(server_latency_ms)
+    p.fut.set_result(SingleInferResponse(
+        text=text,
+        batch_wait_ms=wait_ms,
+        batch_infer_ms=infer_ms,
+        server_latency_ms=server_latency_ms,
+    ))
+
+async def next_pending(timeout: float = None):
+    if waiting:
+        return waiting.popleft()
+    if timeout is None:
+        return await queue.get()
+    if timeout <= 0:
+        # 等待窗口已经过了，但队列里已经在排的请求不需要再等，直接拿
+        try:
+            return queue.get_nowait()
+        except asyncio.QueueEmpty:
+            raise asyncio.TimeoutError
+    return await asyncio.wait_for(queue.get(), timeout=timeout)
+
+async def run_batch(batch: List[Pending]):
+    """
+    按 decode step 跑一批：每步每个请求生成一个 token，跨过 block 边界时追加 block。
+    block 不够时抢占这批里最后进来的请求（vLLM 同样的策略：先来的优先），被抢占的回到 waiting 队头。
+    每步耗时 = 批内最慢请求的 latency_ms / max_new_tokens，显存够的时候整批耗时和原来一样由最慢的请求决定。
+    只有跨 block 边界和请求结束时才有事发生，所以一次直接推进到下一个这样的点，不用每个 token 都醒一次。
+    """
+    active = list(batch)
+    step_s = max(p.req.latency_ms / p.req.max_new_tokens for p in active) / 1000.0
+    step_s *= 1 + BATCH_STEP_COST * (len(active) - 1)
+    # 整批一起 prefill（swap 回来的请求不用重算）
+    prefill = sum(p.prompt_tokens for p in active if not p.prefilled)
+    for p in active:
+        p.prefilled = p.prompt_tokens
+    t_next = time.perf_counter() + prefill * PREFILL_MS_PER_TOKEN / 1000.0
+    while active:
+        k = min(min(kv.free_slots(p.seq_id) or kv.block_size, p.req.max_new_tokens - p.generated)
+                for p in active)
+        t_next += k * step_s
+        await asyncio.sleep(max(0.0, t_next - time.perf_counter()))
+        kv.sample()
+        for p in list(active):
+            if p not in active:
+                continue  # 这一步里已经被后面的请求抢占掉了
+            if p.fut.done():
+                active.remove(p)  # 客户端超时走了，显存立刻还回去
+                kv.free(p.seq_id)
+                continue
+            while not kv.append_slots(p.seq_id, k):
+                victim = active.pop()
+                preempt(victim)
+                if victim is p:
+                    break
+            else:
+                p.generated += k
+                if p.generated >= p.req.max_new_tokens:
+                    active.remove(p)
+                    finish(p, mock_text(p.req))
+
+
+async def fill_fifo(batch: List[Pending]):
+    """严格按到达顺序，在等待窗口内尽量凑够 BATCH_SIZE，同时 KV block 要够"""
+    deadline = batch[0].enqueued_at + (MAX_BATCH_WAIT_MS / 1000.0)
+    while len(batch) < BATCH_SIZE:
+        timeout = deadline - time.perf_counter()
+        try:
+            nxt = await next_pending(max(timeout, 0))
+        except asyncio.TimeoutError:
+            break
+        if nxt.fut.done():
+            kv.free(nxt.seq_id)
+            continue
+        if not try_admit(nxt):
+            waiting.appendleft(nxt)  # 显存不够：放回队头，这批就这么多
+            break
+        batch.append(nxt)
+
+def length_bucket(p: Pending) -> int:
+    # 按 mock 耗时（latency_ms，和 max_new_tokens 成正比）分桶，每桶是上一桶的 2 倍
+    return max(1, p.req.latency_ms).bit_length()
+
+def padded_tokens(batch: List[Pending]) -> int:
+    # 静态批按最长的请求 padding：每个位置都要陪跑到最长的那个生成完
+    return len(batch) * max(p.prompt_tokens + p.req.max_new_tokens for p in batch)
+
+async def fill_bucketed(batch: List[Pending]):
+    """
+    先在等待窗口内把排队的请求拉进 waiting（最多 LOOKAHEAD 个，同桶的已经够装满一批就提前停），再从里面挑和 batch[0] 同一个长度桶的请求，
+    直到 padding 后的 token 数超过 BATCH_TOKEN_BUDGET 或者人数到 BATCH_SIZE。
+    batch[0] 永远是最早到的请求，不管它长短：每一批都会把队头带走，长请求最多等一批，不会被短请求饿死；
+    队头后面不同桶的请求留在 waiting 里，下一批轮到它们当队头。
+    """
+    head = batch[0]
+    bucket = length_bucket(head)
+    # 同桶的候选够装满这一批（人数到 BATCH_SIZE，或者 padding 后到 token 预算）就不用再往后看了，不然每批都白等满整个窗口
+    size, longest = len(batch), max(p.prompt_tokens + p.req.max_new_tokens for p in batch)
+
+    def fills(p: Pending) -> bool:
+        nonlocal size, longest
+        if p.fut.done() or length_bucket(p) != bucket:
+            return False
+        size, longest = size + 1, max(longest, p.prompt_tokens + p.req.max_new_tokens)
+        return size >= BATCH_SIZE or size * longest >= BATCH_TOKEN_BUDGET
+
+    full = any(fills(p) for p in waiting)
+    deadline = head.enqueued_at + (MAX_BATCH_WAIT_MS / 1000.0)
+    while not full and len(waiting) < LOOKAHEAD:
+        timeout = deadline - time.perf_counter()
+        try:
             if timeout <= 0:
-                break
+                p = queue.get_nowait()
+            else:
+                p = await asyncio.wait_for(queue.get(), timeout=timeout)
+        except (asyncio.QueueEmpty, asyncio.TimeoutError):
+            break
+        waiting.append(p)
+        full = fills(p)
+
+    for p in list(waiting):
+        if len(batch) >= BATCH_SIZE:
+            break
+        if p.fut.done():
+            waiting.remove(p)
+            kv.free(p.seq_id)
+            continue
+        if length_bucket(p) != bucket or padded_tokens(batch + [p]) > BATCH_TOKEN_BUDGET:
+            continue
+        if not try_admit(p):
+            break  # 显存不够了，这批就这么多
+        waiting.remove(p)
+        batch.append(p)
+
+def log_batch(batch: List[Pending]):
+    longest = max(p.req.max_new_tokens for p in batch)
+    useful = sum(p.req.max_new_tokens for p in batch)
+    batch_log.append({
+        "t": round(time.time(), 3),
+        "size": len(batch),
+        "max_new_tokens": [p.req.max_new_tokens for p in batch],
+        "padded_tokens": padded_tokens(batch),
+        "waste": round(1 - useful / (len(batch) * longest), 3),
+    })
+    del batch_log[:-1000]
+
+
+async def static_batch_once():
+    # 静态批：凑一批，跑完，再凑下一批
+    first: Pending = await next_pending()
+    if first.fut.done():
+        kv.free(first.seq_id)
+        return
+    if not kv.fits_at_all(first.prompt_tokens + first.req.max_new_tokens):
+        finish(first, error=HTTPException(status_code=413, detail="request exceeds KV cache capacity"))
+        return
+    if not try_admit(first):
+        # 静态批：上一批跑完显存已经全还回来了，理论上不会走到这；保险起见退回去稍后再试
+        waiting.appendleft(first)
+        await asyncio.sleep(MAX_BATCH_WAIT_MS / 1000.0)
+        return
+    batch = [first]
+    t_form = time.perf_counter()
+    if BATCH_POLICY == "bucketed":
+        await fill_bucketed(batch)
+    else:
+        await fill_fifo(batch)
+    log_batch(batch)
+    prom.batch_size.observe(len(batch), engine="static")
+
+    now = time.perf_counter()
+    batch_id = next(_batch_ids)
+    for p in batch:
+        p.batch_id = batch_id
+        if not p.admitted_at:
+            p.admitted_at = now
+
+    try:
+        await run_batch(batch)
+    except Exception as e:
+        for p in batch:
+            finish(p, error=e)
+    if tracing.tracer.sample_rate > 0:
+        # 一批一条，开销有限，采样打开时都记，看批与批之间的间隙
+        tracing.tracer.worker_span("form_batch", t_form, now, batch=batch_id, policy=BATCH_POLICY)
+        tracing.tracer.worker_span("run_batch", now, time.perf_counter(), batch=batch_id, size=len(batch),
+                                   seqs=[p.seq_id for p in batch], padded_tokens=padded_tokens(batch))
+
+
+def admit_step():
+    """
+    continuous 模式每个 step 开头调用：队列里的请求只要 running 没满、KV block 够就加进来，不用等当前这批跑完。
+    不等待：没有请求就直接返回
+    """
+    while len(running) < BATCH_SIZE:
+        if waiting:
+            p = waiting.popleft()
+        else:
             try:
-                nxt = await asyncio.wait_for(queue.get(), timeout=timeout)
-                batch.append(nxt)
-            except asyncio.TimeoutError:
+                p = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+        if p.fut.done():
+            kv.free(p.seq_id)
+            continue
+        if not kv.fits_at_all(p.prompt_tokens + p.req.max_new_tokens):
+            finish(p, error=HTTPException(status_code=413, detail="request exceeds KV cache capacity"))
+            continue
+        if not try_admit(p):
+            waiting.appendleft(p)
+            return
+        if not p.admitted_at:
+            p.admitted_at = time.perf_counter()
+        running.append(p)
+
+async def continuous_step(t_next: float) -> float:
+    """
+    iteration-level 调度的一个 step：
+    1. 新请求在 step 边界加入（admit_step）
+    2. 还没 prefill 完的请求按到达顺序分 PREFILL_CHUNK_TOKENS 的预算做一块 prefill（chunked prefill：
+       长 prompt 不会一次性把整个 step 拖长，正在 decode 的请求 ITL 不会被一个长 prompt 卡住）
+    3. prefill 完的请求各 decode 一个 token，block 不够就抢占最后进来的请求
+    4. 生成完的请求立刻离开，空出来的位置下一个 step 就能被填上
+    step 耗时 = 参与 decode 的请求里最慢的每 token 耗时 + 这一步 prefill 的 token 数 * PREFILL_MS_PER_TOKEN
+    返回下一个 step 的目标时刻（按模型时间累加，事件循环调度慢了下一步就少睡一点追上）
+    """
+    admit_step()
+    if not running:
+        # 队头准入不了（比如 KV cache 被调小了）：这里一定要让出事件循环，不然 batch_worker 的 while True 空转，整个服务卡死；
+        # 等一会儿再试，请求自己超时以后会被丢掉
+        await asyncio.sleep(max(MAX_BATCH_WAIT_MS, 1) / 1000.0)
+        return time.perf_counter()
+    prom.batch_size.observe(len(running), engine="continuous")
+
+    budget = PREFILL_CHUNK_TOKENS
+    prefill_tokens = 0
+    decoding = []
+    for p in running:
+        todo = p.prompt_tokens - p.prefilled  # recompute 抢占回来的请求 prefilled 清零了，要重新 prefill
+        if todo > 0:
+            chunk = min(todo, budget)
+            p.prefilled += chunk
+            budget -= chunk
+            prefill_tokens += chunk
+        else:
+            decoding.append(p)
+
+    step_ms = max((p.req.latency_ms / p.req.max_new_tokens for p in decoding), default=0.0)
+    step_ms *= 1 + BATCH_STEP_COST * max(0, len(decoding) - 1)
+    t_step = time.perf_counter()
+    t_next += (step_ms + prefill_tokens * PREFILL_MS_PER_TOKEN) / 1000.0
+    await asyncio.sleep(max(0.0, t_next - time.perf_counter()))
+    kv.sample()
+    # step 很密（每个 token 一个），只在 running 里有采样请求时才记
+    if tracing.tracer.sample_rate > 0 and any(p.trace for p in running):
+        tracing.tracer.worker_span("step", t_step, time.perf_counter(), running=len(running),
+                                   decoding=len(decoding), prefill_tokens=prefill_tokens)
+
+    for p in decoding:
+        if p not in running:
+            continue  # 这一步里已经被抢占掉了
+        if p.fut.done():
+            running.remove(p)
+            kv.free(p.seq_id)
+            continue
+        while not kv.append_slots(p.seq_id, 1):
+            victim = running.pop()
+            preempt(victim)
+            if victim is p:
                 break
+        else:
+            p.generated += 1
+            if p.generated >= p.req.max_new_tokens:
+                running.remove(p)
+                finish(p, mock_text(p.req))
+    return t_next
 
-        # 计算每个请求的 batch wait 时间
-        now = time.perf_counter()
-        waits_ms = [int((now - p.enqueued_at) * 1000) for p in batch]
-
-        # 执行批推理
-        i0 = time.perf_counter()
-        try:
-            texts = await mock_batch_infer([p.req for p in batch])
-        except Exception as e:
-            for p in batch:
-                if not p.fut.done():
-                    p.fut.set_exception(e)
+async def batch_worker():
+    # 后台 worker：按当前 ENGINE 调度；从 continuous 切回 static 时先把 running 里的请求跑完
+    t_next = time.perf_counter()
+    while True:
+        if not running and not waiting and queue.empty():
+            # 空闲时阻塞等第一个请求，别空转；等到了再看用哪个引擎，中途切换配置也能立刻生效
+            waiting.append(await queue.get())
+        if ENGINE == "continuous" or running:
+            if not running:
+                t_next = time.perf_counter()  # 从空闲恢复，模型时间从现在重新算
+            t_next = await continuous_step(t_next)
+        else:
+            await static_batch_once()
+
+async def autotune_loop():
+    """
+    每 tuner.window_s 秒看一次最近一个窗口：p99、完成的 QPS、排队深度（queue + waiting）、批填充率，
+    交给 tuner 决定新的 BATCH_SIZE / MAX_BATCH_WAIT_MS。关着的时候只空转不记录
+    """
+    global BATCH_SIZE, MAX_BATCH_WAIT_MS
+    while True:
+        await asyncio.sleep(tuner.window_s)
+        if not AUTOTUNE:
             continue
-        infer_ms = int((time.perf_counter() - i0) * 1000)
-
-        # 分发结果
-        for p, text, wait_ms in zip(batch, texts, waits_ms):
-            server_latency_ms = wait_ms + infer_ms
-            stats.add(server_latency_ms)
-            if not p.fut.done():
-                p.fut.set_result(SingleInferResponse(
-                    text=text,
-                    batch_wait_ms=wait_ms,
-                    batch_infer_ms=infer_ms,
-                    server_latency_ms=server_latency_ms,
-                ))
+        since = time.time() - tuner.window_s
+        recent, covered = stats.window(tuner.window_s)
+        if ENGINE == "continuous":
+            fill = len(running) / BATCH_SIZE
+        else:
+            sizes = [b["size"] for b in batch_log[-200:] if b["t"] >= since]
+            fill = sum(sizes) / len(sizes) / BATCH_SIZE if sizes else 0.0
+        BATCH_SIZE, MAX_BATCH_WAIT_MS = tuner.decide(
+            p99_ms=recent.percentile(99),
+            qps=recent.count / covered,
+            queue_depth=queue.qsize() + len(waiting),
+            fill=fill,
+            samples=recent.count,
+            batch_size=BATCH_SIZE,
+            wait_ms=MAX_BATCH_WAIT_MS,
+        )
 
 
 async def run_concurrent_requests(req: BatchTestRequest) -> List[SingleInferResponse]:
@@ -122,16 +510,23 @@ async def run_concurrent_requests(req: BatchTestRequest) -> List[SingleInferResp
     loop = asyncio.get_running_loop()
     futures = []
     start_time = time.perf_counter()
+    rng = random.Random(req.seed)
 
     for _ in range(req.num_requests):
+        if req.arrival_rate > 0:
+            await asyncio.sleep(rng.expovariate(req.arrival_rate))
         fut = loop.create_future()
+        scale = 1.0 - rng.random() * req.length_jitter
+        n_tokens = max(1, int(req.max_new_tokens * scale))
         test_req = BatchInferRequest(
             prompt=req.prompt,
-            max_new_tokens=req.max_new_tokens,
-            latency_ms=req.latency_ms,
+            max_new_tokens=n_tokens,
+            latency_ms=int(req.latency_ms * n_tokens / req.max_new_tokens),
             timeout_ms=5000,
         )
-        queue.put_nowait(Pending(req=test_req, enqueued_at=time.perf_counter(), fut=fut))
+        prom.queue_depth.observe(queue.qsize() + len(waiting))
+        queue.put_nowait(Pending(req=test_req, enqueued_at=time.perf_counter(), fut=fut,
+                                 trace=tracing.tracer.start("batch_test request")))
         futures.append(fut)
 
     # 等待所有结果
@@ -160,28 +555,44 @@ def register_routes(app):
     async def _start_batch_worker():
         # 启动后台批处理 worker
         asyncio.create_task(batch_worker())
+        asyncio.create_task(autotune_loop())
 
     @app.post("/batch/infer_one", response_model=SingleInferResponse)
     async def batch_infer_one(req: BatchInferRequest = Body(...)):
         # 单请求入队，等待批处理结果
         loop = asyncio.get_running_loop()
         fut = loop.create_future()
-        await queue.put(Pending(req=req, enqueued_at=time.perf_counter(), fut=fut))
+        tr = tracing.current()
+        prom.queue_depth.observe(queue.qsize() + len(waiting))
+        await queue.put(Pending(req=req, enqueued_at=time.perf_counter(), fut=fut, trace=tr))
 
         try:
             return await asyncio.wait_for(fut, timeout=req.timeout_ms / 1000.0)
         except asyncio.TimeoutError:
             raise HTTPException(status_code=504, detail="inference timeout")
+        finally:
+            if tr:
+                tr.handler_end = time.perf_counter()
 
     @app.post("/batch/test", response_model=BatchTestResult)
     async def batch_test(req: BatchTestRequest):
         # 批量并发测试，返回性能统计
-        test_stats = LatencyStats(maxlen=req.num_requests * 2)
+        test_stats = LatencyStats()
 
         # 备份原始配置并使用测试配置
-        global stats, BATCH_SIZE
+        global stats, BATCH_SIZE, MAX_BATCH_WAIT_MS, ENGINE, BATCH_POLICY, BATCH_TOKEN_BUDGET, batch_log
+        if req.engine is not None and req.engine not in ENGINES:
+            raise HTTPException(status_code=400, detail=f"engine must be one of {ENGINES}")
+        if req.policy is not None and req.policy not in BATCH_POLICIES:
+            raise HTTPException(status_code=400, detail=f"policy must be one of {BATCH_POLICIES}")
         original_stats, stats = stats, test_stats
         original_batch_size, BATCH_SIZE = BATCH_SIZE, req.batch_size
+        original_wait = MAX_BATCH_WAIT_MS
+        original_engine, ENGINE = ENGINE, req.engine or ENGINE
+        original_policy, BATCH_POLICY = BATCH_POLICY, req.policy or BATCH_POLICY
+        original_budget, BATCH_TOKEN_BUDGET = BATCH_TOKEN_BUDGET, req.token_budget or BATCH_TOKEN_BUDGET
+        original_log, batch_log = batch_log, []
+        test_log = batch_log
 
         # 清空队列确保干净测试
         while not queue.empty():
@@ -189,21 +600,28 @@ def register_routes(app):
                 queue.get_nowait()
             except:
                 break
+        while waiting:
+            kv.free(waiting.popleft().seq_id)
 
         t0 = time.perf_counter()
         results = await run_concurrent_requests(req)
         total_time_ms = int((time.perf_counter() - t0) * 1000)
 
         # 恢复原始配置
+        final_batch_size, final_wait = BATCH_SIZE, MAX_BATCH_WAIT_MS
         stats = original_stats
         BATCH_SIZE = original_batch_size
+        MAX_BATCH_WAIT_MS = original_wait
+        ENGINE = original_engine
+        BATCH_POLICY = original_policy
+        BATCH_TOKEN_BUDGET = original_budget
+        batch_log = original_log
 
         successful = sum(1 for r in results if not r.text.startswith("Error:"))
         failed = len(results) - successful
 
-        latencies, _ = test_stats.snapshot()
-        latencies.sort()
-        avg_latency = sum(latencies) / len(latencies) if latencies else 0.0
+        # 用累计直方图：测试可能跑得比滑动窗口长
+        h = test_stats.total
         throughput = len(results) / (total_time_ms / 1000.0) if total_time_ms > 0 else 0.0
 
         return BatchTestResult(
@@ -212,42 +630,91 @@ def register_routes(app):
             total_requests=len(results),
             successful=successful,
             failed=failed,
-            avg_server_latency_ms=round(avg_latency, 2),
-            min_server_latency_ms=min(latencies) if latencies else 0,
-            max_server_latency_ms=max(latencies) if latencies else 0,
-            p50_server_latency_ms=percentile(latencies, 50) if latencies else 0,
-            p90_server_latency_ms=percentile(latencies, 90) if latencies else 0,
-            p99_server_latency_ms=percentile(latencies, 99) if latencies else 0,
+            avg_server_latency_ms=round(h.mean(), 2),
+            min_server_latency_ms=int(h.min) if h.count else 0,
+            max_server_latency_ms=int(h.max),
+            p50_server_latency_ms=round(h.percentile(50)),
+            p90_server_latency_ms=round(h.percentile(90)),
+            p99_server_latency_ms=round(h.percentile(99)),
             total_time_ms=total_time_ms,
             throughput_requests_per_sec=round(throughput, 2),
+            batches=len(test_log),
+            avg_batch_size=round(sum(b["size"] for b in test_log) / len(test_log), 2) if test_log else 0.0,
+            padding_waste_ratio=round(
+                1 - sum(sum(b["max_new_tokens"]) for b in test_log)
+                / sum(b["size"] * max(b["max_new_tokens"]) for b in test_log), 3) if test_log else 0.0,
+            per_batch=test_log,
+            final_batch_size=final_batch_size,
+            final_max_wait_ms=final_wait,
         )
 
     @app.get("/batch/metrics")
     async def batch_metrics():
         # 获取当前统计指标
-        latencies, ts = stats.snapshot()
-        latencies.sort()
-        now = time.time()
-        window = 10.0
-        recent = [x for x in ts if x >= now - window]
-        qps = len(recent) / window if window > 0 else 0.0
-        avg_latency = sum(latencies) / len(latencies) if latencies else 0.0
-
+        # 分位数看最近 60 秒，QPS 看最近 10 秒
+        snap = stats.snapshot()
         return {
-            "count": len(latencies),
-            "avg_latency_ms": round(avg_latency, 2),
-            "p50_ms": percentile(latencies, 50) if latencies else 0,
-            "p90_ms": percentile(latencies, 90) if latencies else 0,
-            "p99_ms": percentile(latencies, 99) if latencies else 0,
-            "qps_10s": round(qps, 2),
+            "count": snap["count"],
+            "total_count": stats.total.count,
+            "avg_latency_ms": snap["avg_latency_ms"],
+            "p50_ms": snap["p50_ms"],
+            "p90_ms": snap["p90_ms"],
+            "p99_ms": snap["p99_ms"],
+            "qps_10s": stats.snapshot(10.0)["qps"],
             "current_batch_size": BATCH_SIZE,
             "max_batch_wait_ms": MAX_BATCH_WAIT_MS,
+            "engine": ENGINE,
+            "policy": BATCH_POLICY,
+            "token_budget": BATCH_TOKEN_BUDGET,
+            "recent_batch_waste": round(sum(b["waste"] for b in batch_log[-100:]) / len(batch_log[-100:]), 3)
+            if batch_log else 0.0,
+            "running": len(running),
+            "waiting": len(waiting),
+            "kv": kv.snapshot(),
+            "batch_step_cost": BATCH_STEP_COST,
+            "autotune": {"enabled": AUTOTUNE, **tuner.snapshot()},
         }
 
     @app.post("/batch/config")
-    async def update_config(batch_size: int = Body(..., embed=True), max_wait_ms: int = Body(..., embed=True)):
-        # 动态更新批处理配置
-        global BATCH_SIZE, MAX_BATCH_WAIT_MS
-        BATCH_SIZE = batch_size
-        MAX_BATCH_WAIT_MS = max_wait_ms
-        return {"batch_size": BATCH_SIZE, "max_batch_wait_ms": MAX_BATCH_WAIT_MS}
+    async def update_config(batch_size: Optional[int] = Body(None, embed=True),
+                            max_wait_ms: Optional[int] = Body(None, embed=True),
+                            kv_memory_mb: Optional[int] = Body(None, embed=True),
+                            kv_swap_mb: Optional[int] = Body(None, embed=True),
+                            engine: Optional[str] = Body(None, embed=True),
+                            prefill_ms_per_token: Optional[float] = Body(None, embed=True),
+                            policy: Optional[str] = Body(None, embed=True),
+                            token_budget: Optional[int] = Body(None, embed=True),
+                            batch_step_cost: Optional[float] = Body(None, embed=True),
+                            autotune: Optional[bool] = Body(None, embed=True),
+                            p99_target_ms: Optional[float] = Body(None, embed=True)):
+        # 动态更新批处理配置；改 KV 预算会重建 KV cache，只在空闲时改
+        global BATCH_SIZE, MAX_BATCH_WAIT_MS, KV_MEMORY_MB, KV_SWAP_MB, kv, ENGINE, PREFILL_MS_PER_TOKEN
+        global BATCH_POLICY, BATCH_TOKEN_BUDGET, BATCH_STEP_COST, AUTOTUNE
+        if engine is not None and engine not in ENGINES:
+            raise HTTPException(status_code=400, detail=f"engine must be one of {ENGINES}")
+        if policy is not None and policy not in BATCH_POLICIES:
+            raise HTTPException(status_code=400, detail=f"policy must be one of {BATCH_POLICIES}")
+        BATCH_POLICY = policy or BATCH_POLICY
+        BATCH_TOKEN_BUDGET = token_budget or BATCH_TOKEN_BUDGET
+        BATCH_SIZE = batch_size or BATCH_SIZE
+        MAX_BATCH_WAIT_MS = max_wait_ms if max_wait_ms is not None else MAX_BATCH_WAIT_MS
+        ENGINE = engine or ENGINE
+        if prefill_ms_per_token is not None:
+            PREFILL_MS_PER_TOKEN = prefill_ms_per_token
+        if batch_step_cost is not None:
+            BATCH_STEP_COST = batch_step_cost
+        if p99_target_ms is not None:
+            tuner.p99_target_ms = p99_target_ms
+        if autotune is not None:
+            AUTOTUNE = autotune
+        if kv_memory_mb is not None or kv_swap_mb is not None:
+            if kv.tables or kv.swapped:
+                raise HTTPException(status_code=409, detail="KV cache busy")
+            KV_MEMORY_MB = kv_memory_mb if kv_memory_mb is not None else KV_MEMORY_MB
+            KV_SWAP_MB = kv_swap_mb if kv_swap_mb is not None else KV_SWAP_MB
+            kv = make_kv_cache(KV_MEMORY_MB, KV_SWAP_MB)
+        return {"batch_size": BATCH_SIZE, "max_batch_wait_ms": MAX_BATCH_WAIT_MS, "engine": ENGINE,
+                "policy": BATCH_POLICY, "token_budget": BATCH_TOKEN_BUDGET,
+                "prefill_ms_per_token": PREFILL_MS_PER_TOKEN, "batch_step_cost": BATCH_STEP_COST,
+                "autotune": AUTOTUNE, "p99_target_ms": tuner.p99_target_ms,
+                "kv_memory_mb": KV_MEMORY_MB, "kv_swap_mb": KV_SWAP_MB, "kv_num_blocks": kv.gpu.num_blocks}
@@ -0,0 +1,60 @@
+import asyncio
+from fastapi import Body, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from typing import Optional
+
+from ..profiler import profile
+from ..tracing import tracer
+
+# 同一时间只跑一个 profile，免得两个采样线程叠在一起
+_profile_lock = asyncio.Lock()
+
+
+def register_routes(app):
+    @app.get("/debug/trace")
+    async def export_trace(limit: Optional[int] = None):
+        # Chrome trace-event JSON：curl -o trace.json 之后拖进 https://ui.perfetto.dev
+        return tracer.export(limit)
+
+    @app.get("/debug/trace/stats")
+    async def trace_stats():
+        return tracer.snapshot()
+
+    @app.post("/debug/trace/config")
+    async def trace_config(sample_rate: Optional[float] = Body(None, embed=True),
+                           capacity: Optional[int] = Body(None, embed=True),
+                           clear: bool = Body(False, embed=True)):
+        if sample_rate is not None:
+            if not 0 <= sample_rate <= 1:
+                raise HTTPException(status_code=400, detail="sample_rate must be in [0, 1]")
+            tracer.sample_rate = sample_rate
+        if capacity is not None:
+            tracer.resize(capacity)
+        if clear:
+            tracer.traces.clear()
+            tracer.worker.clear()
+        return tracer.snapshot()
+
+    @app.get("/debug/profile")
+    async def debug_profile(seconds: float = Query(5.0, gt=0, le=60),
+                            interval_ms: float = Query(5.0, ge=1, le=1000),
+                            format: str = Query("json", pattern="^(json|collapsed)$")):
+        """
+        采 seconds 秒的调用栈 + 事件循环 lag。format=collapsed 直接返回 flamegraph.pl / speedscope 能读的文本：
+        curl -o profile.txt 'localhost:8000/debug/profile?seconds=10&format=collapsed'
+        """
+        if _profile_lock.locked():
+            raise HTTPException(status_code=409, detail="a profile is already running")
+        async with _profile_lock:
+            sampler, lag = await profile(seconds, interval_ms / 1000.0)
+        if format == "collapsed":
+            return PlainTextResponse(sampler.collapsed())
+        return {
+            "seconds": round(sampler.duration, 3),
+            "samples": sampler.samples,
+            "interval_ms": interval_ms,
+            "sampling_overhead": round(sampler.sample_time / sampler.duration, 4) if sampler.duration else 0.0,
+            "loop_lag": lag.snapshot(),
+            "main_thread": sampler.summary(),
+            "collapsed": sampler.collapsed(),
+        }
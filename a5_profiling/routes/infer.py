@@ -3,9 +3,16 @@ import time
 from fastapi import HTTPException
 from pydantic import BaseModel, Field
 
-from ..metrics import LatencyStats, percentile
+from .. import tracing
+from ..cache import ResponseCache, normalize_key
+from ..metrics import LatencyStats
+from ..prefix_cache import RadixCache
+from ..tokenizer import tokenize
 
-stats = LatencyStats(maxlen=5000)
+stats = LatencyStats(window_s=60.0)
+cache = ResponseCache(max_bytes=64 * 2**20, ttl=60.0)
+# KV 前缀缓存：token 预算大约相当于能放下多少 token 的 KV
+prefix_cache = RadixCache(token_budget=200_000)
 # 限流
 MAX_CONCURRENCY = 8
 sem = asyncio.Semaphore(MAX_CONCURRENCY)
@@ -16,67 +23,105 @@ class InferRequest(BaseModel):
     max_new_tokens: int = Field(64, ge=1, le=512)
     latency_ms: int = Field(80, ge=0, le=5000)  # mock 推理耗时
     timeout_ms: int = Field(1500, ge=1, le=20000)
+    # 每个没命中前缀缓存的 prompt token 的 prefill 耗时；0 表示只按 latency_ms 收固定耗时（原来的行为）
+    prefill_ms_per_token: float = Field(0.0, ge=0, le=100)
 
 class InferResponse(BaseModel):
     text: str
     server_latency_ms: int
     queue_wait_ms: int
     infer_ms: int
+    cache: str = "miss"  # hit / miss / coalesced；非 miss 时 queue_wait_ms / infer_ms 为 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0  # 命中前缀缓存、不用重新 prefill 的 token 数
 
 
-def fake_tokenize(s: str) -> int:
-    # mock：粗略用空格拆分当 token 数
-    return max(1, len(s.split()))
-
-
-async def mock_infer(req: InferRequest) -> str:
-    # mock：sleep一会儿模拟推理
-    await asyncio.sleep(req.latency_ms / 1000.0)
+async def mock_infer(req: InferRequest, uncached_tokens: int = 0) -> str:
+    # mock：sleep一会儿模拟推理；prefill 只算没命中前缀缓存的那部分 token
+    await asyncio.sleep((req.latency_ms + uncached_tokens * req.prefill_ms_per_token) / 1000.0)
     # mock：返回生成文本
     return req.prompt + " " + ("<tok> " * req.max_new_tokens).strip()
 
 
 # 注册路由的主函数
 def register_routes(app):
-    @app.get("/metrics")
-    async def metrics():
-        latencies, ts = stats.snapshot()
-        latencies.sort()
-        now = time.time()
-        # 粗算最近 10 秒 QPS
-        window = 10.0
-        recent = [x for x in ts if x >= now - window]
-        qps = len(recent) / window if window > 0 else 0.0
+    @app.get("/metrics/json")
+    async def metrics_json():
+        # 分位数看最近 60 秒，QPS 看最近 10 秒
+        snap = stats.snapshot()
         return {
-            "count": len(latencies),
-            "p50_ms": percentile(latencies, 50),
-            "p90_ms": percentile(latencies, 90),
-            "p99_ms": percentile(latencies, 99),
-            "qps_10s": round(qps, 2),
+            "count": snap["count"],
+            "total_count": stats.total.count,
+            "p50_ms": snap["p50_ms"],
+            "p90_ms": snap["p90_ms"],
+            "p99_ms": snap["p99_ms"],
+            "qps_10s": stats.snapshot(10.0)["qps"],
+            "prefix_cache": prefix_cache.snapshot(),
         }
 
-    @app.post("/infer", response_model=InferResponse)
-    async def infer(req: InferRequest):
-        t0 = time.perf_counter()
+    @app.get("/cache/stats")
+    async def cache_stats():
+        return cache.snapshot()
+
+    @app.get("/prefix_cache/stats")
+    async def prefix_cache_stats():
+        return prefix_cache.snapshot()
 
+    async def compute(req: InferRequest) -> dict:
         # 记录进入 semaphore 前后的时间差 = queue wait
+        # 在 single-flight 的 task 里跑，trace 是触发这次计算的那个请求的（task 创建时拷贝了 context）
+        tr = tracing.current()
         q0 = time.perf_counter()
         async with sem:
-            queue_wait_ms = int((time.perf_counter() - q0) * 1000)
+            s0 = time.perf_counter()
+            queue_wait_ms = int((s0 - q0) * 1000)
 
+            # 拿到执行权时才查前缀缓存：排队期间别的请求可能刚把同一个前缀放进去
+            tokens = tokenize(req.prompt)
+            cached = prefix_cache.match_prefix(tokens)
             i0 = time.perf_counter()
-            try:
-                text = await asyncio.wait_for(mock_infer(req), timeout=req.timeout_ms / 1000.0)
-            except asyncio.TimeoutError:
-                raise HTTPException(status_code=504, detail="inference timeout")
-            infer_ms = int((time.perf_counter() - i0) * 1000)
+            text = await mock_infer(req, len(tokens) - cached)
+            i1 = time.perf_counter()
+            infer_ms = int((i1 - i0) * 1000)
+            prefix_cache.insert(tokens)
+        if tr:
+            tr.span("queue_wait", q0, s0)
+            tr.span("prefix_match", s0, i0, prompt_tokens=len(tokens), cached_tokens=cached)
+            tr.span("inference", i0, i1, uncached_tokens=len(tokens) - cached)
+        return {"text": text, "queue_wait_ms": queue_wait_ms, "infer_ms": infer_ms,
+                "prompt_tokens": len(tokens), "cached_tokens": cached}
+
+    @app.post("/infer", response_model=InferResponse)
+    async def infer(req: InferRequest):
+        tr = tracing.current()
+        t0 = time.perf_counter()
+
+        # 相同的 prompt / max_new_tokens 直接拿缓存，或者等正在算的那一次（single-flight）
+        try:
+            result, source = await cache.get_or_compute(
+                normalize_key(req.prompt, req.max_new_tokens),
+                # 不用单独的推理超时：等结果的请求都超时走了，cache 会把这次计算取消掉，占着的 sem 名额跟着还回来
+                lambda deadline: compute(req),
+                timeout=req.timeout_ms / 1000.0,
+            )
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="inference timeout")
 
-        server_latency_ms = int((time.perf_counter() - t0) * 1000)
+        t1 = time.perf_counter()
+        server_latency_ms = int((t1 - t0) * 1000)
         stats.add(server_latency_ms)
+        if tr:
+            tr.span("infer", t0, t1, cache=source)
+            tr.handler_end = time.perf_counter()
 
+        miss = source == "miss"
         return InferResponse(
-            text=text,
+            text=result["text"],
             server_latency_ms=server_latency_ms,
-            queue_wait_ms=queue_wait_ms,
-            infer_ms=infer_ms,
+            queue_wait_ms=result["queue_wait_ms"] if miss else 0,
+            infer_ms=result["infer_ms"] if miss else 0,
+            cache=source,
+            prompt_tokens=result["prompt_tokens"],
+            # 响应缓存命中时整个 prompt 都没有重新 prefill
+            cached_tokens=result["cached_tokens"] if miss else result["prompt_tokens"],
         )
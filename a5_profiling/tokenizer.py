@@ -0,0 +1,18 @@
+import re
+import zlib
+
+VOCAB_SIZE = 32000
+
+# 词、数字、单个汉字、单个标点各算一个 token（比 split() 更接近真实 tokenizer 的粒度）
+_PIECE = re.compile(r"[A-Za-z]+|\d|[^\sA-Za-z\d]")
+
+
+def tokenize(text: str) -> list:
+    """
+    mock tokenizer：切成 piece 后用 crc32 映射到 [0, VOCAB_SIZE) 的 token id。
+    不用内置 hash()：它每个进程加了随机盐，同一段文本在不同进程 / 不同次启动会得到不同 id，trace 就没法复现
+    """
+    return [zlib.crc32(p.encode()) % VOCAB_SIZE for p in _PIECE.findall(text)]
+
+def count_tokens(text: str) -> int:
+    return max(1, len(_PIECE.findall(text)))
@@ -0,0 +1,144 @@
+"""
+轻量的请求级 tracing：按比例采样，采中的请求记录各阶段的 span，放在环形缓冲里，
+导出成 Chrome trace-event JSON（chrome://tracing 或 https://ui.perfetto.dev 直接打开）。
+没采中的请求只多一次 ContextVar 读取和一次 None 判断。
+"""
+import itertools
+import os
+import random
+import time
+from collections import deque
+from contextvars import ContextVar
+
+TRACE_SAMPLE = float(os.environ.get("TRACE_SAMPLE", "0"))  # 采样比例，0 = 关
+MAX_SPANS_PER_TRACE = 256  # 单个请求最多记这么多个 span（continuous 下抢占很多次的请求也不会无限涨）
+WORKER_TID = 0             # batch_worker 自己的 span 画在这一行，请求各占一行
+
+_current: ContextVar = ContextVar("trace", default=None)
+
+
+def current():
+    """当前请求的 Trace，没采中返回 None"""
+    return _current.get()
+
+
+class Trace:
+    __slots__ = ("id", "name", "events", "dropped", "handler_end")
+
+    def __init__(self, trace_id: int, name: str):
+        self.id = trace_id
+        self.name = name
+        self.events = []     # (name, start, end, args)，时间都是 perf_counter；end 为 None 表示瞬时事件
+        self.dropped = 0
+        self.handler_end = 0.0  # 路由函数返回的时刻，之后到开始发响应之间是 response_model 校验 + JSON 序列化
+
+    def span(self, name: str, start: float, end: float, **args):
+        if len(self.events) >= MAX_SPANS_PER_TRACE:
+            self.dropped += 1
+            return
+        self.events.append((name, start, end, args))
+
+    def instant(self, name: str, t: float = None, **args):
+        self.span(name, time.perf_counter() if t is None else t, None, **args)
+
+
+class Tracer:
+    def __init__(self, sample_rate: float = TRACE_SAMPLE, capacity: int = 1000, worker_capacity: int = 20000):
+        self.sample_rate = sample_rate
+        # 开始时就放进环形缓冲（不用等结束再放），之后的 span 直接往里加；满了挤掉最老的
+        self.traces = deque(maxlen=capacity)
+        self.worker = deque(maxlen=worker_capacity)  # batch_worker 的 span：凑批、整批推理、continuous 的 step
+        self.epoch = time.perf_counter()
+        self._ids = itertools.count(1)
+        self.counts = {"started": 0, "skipped": 0, "worker_spans": 0}
+
+    def start(self, name: str):
+        if self.sample_rate <= 0 or (self.sample_rate < 1 and random.random() >= self.sample_rate):
+            self.counts["skipped"] += 1
+            return None
+        tr = Trace(next(self._ids), name)
+        self.traces.append(tr)
+        self.counts["started"] += 1
+        return tr
+
+    def worker_span(self, name: str, start: float, end: float, **args):
+        self.worker.append((name, start, end, args))
+        self.counts["worker_spans"] += 1
+
+    def resize(self, capacity: int):
+        self.traces = deque(self.traces, maxlen=capacity)
+
+    def _us(self, t: float) -> float:
+        return round((t - self.epoch) * 1e6, 1)
+
+    def _event(self, name, start, end, args, tid) -> dict:
+        ev = {"name": name, "ts": self._us(start), "pid": 1, "tid": tid, "args": args}
+        if end is None:
+            ev.update(ph="i", s="t")
+        else:
+            ev.update(ph="X", dur=round((end - start) * 1e6, 1))
+        return ev
+
+    def export(self, limit: int = None) -> dict:
+        """最近 limit 个请求的 trace + 同一时间段里 batch_worker 的 span"""
+        traces = list(self.traces)[-limit:] if limit else list(self.traces)
+        events = [{"name": "process_name", "ph": "M", "pid": 1, "args": {"name": "a5_profiling"}},
+                  {"name": "thread_name", "ph": "M", "pid": 1, "tid": WORKER_TID, "args": {"name": "batch_worker"}}]
+        since = None
+        for tr in traces:
+            if not tr.events:
+                continue
+            events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tr.id,
+                           "args": {"name": f"#{tr.id} {tr.name}"}})
+            for name, start, end, args in tr.events:
+                events.append(self._event(name, start, end, args, tr.id))
+                since = start if since is None else min(since, start)
+            if tr.dropped:
+                events.append(self._event("spans_dropped", tr.events[-1][1], None, {"n": tr.dropped}, tr.id))
+        if since is not None:
+            events.extend(self._event(*w, WORKER_TID) for w in self.worker if (w[2] or w[1]) >= since)
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def snapshot(self) -> dict:
+        return {**self.counts, "sample_rate": self.sample_rate, "buffered_traces": len(self.traces),
+                "capacity": self.traces.maxlen, "buffered_worker_spans": len(self.worker)}
+
+
+tracer = Tracer()
+
+
+class TraceMiddleware:
+    """
+    纯 ASGI 中间件（不用 BaseHTTPMiddleware，ContextVar 能直接传到路由函数里）：
+    采中的请求记 http 整体耗时、serialize（路由返回 -> 开始发响应）和 send（发响应头 -> 最后一块 body）
+    """
+    def __init__(self, app, skip_prefixes=("/debug",)):
+        self.app = app
+        self.skip_prefixes = skip_prefixes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.skip_prefixes):
+            return await self.app(scope, receive, send)
+        tr = tracer.start(f"{scope['method']} {scope['path']}")
+        if tr is None:
+            return await self.app(scope, receive, send)
+
+        token = _current.set(tr)
+        t0 = time.perf_counter()
+        resp = {"status": 500, "start": 0.0}
+
+        async def send_traced(message):
+            if message["type"] == "http.response.start":
+                now = time.perf_counter()
+                resp.update(status=message["status"], start=now)
+                if tr.handler_end:
+                    tr.span("serialize", tr.handler_end, now)
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                tr.span("send", resp["start"], time.perf_counter())
+
+        try:
+            await self.app(scope, receive, send_traced)
+        finally:
+            tr.span("http", t0, time.perf_counter(), status=resp["status"])
+            _current.reset(token)